@@ -1,16 +1,31 @@
+import time
+_import_started = time.perf_counter()
+
+import io
 import os
 import json
 import uuid
-import torch
-import torch.nn as nn
+import shutil
+import tempfile
+import threading
+import numpy as np
 from PIL import Image
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from torchvision import transforms, models
 
 # Local Import
-from chatbot import BetelLeafChatbot
+import metrics
+from chatbot import BetelLeafChatbot, SessionStore
+from batching import MicroBatcher
+from upload_store import UploadStore
+from prediction_cache import PredictionCache, sha256_key, dhash_key
+from bulk_predict import iter_uploads, iter_zip, predict_stream, to_ndjson
+from model_registry import ModelRegistry, legacy_artifact
+from quality_gate import QualityGate, ImageRejected
+from embedding_index import open_index
+from drift_monitor import DriftMonitor, STATUS_LEVELS, merge_snapshots
 
 # ======================================================
 # CONFIGURATION & PATHS
@@ -19,12 +34,111 @@ class Config:
     UPLOAD_FOLDER = "uploads"
     MODEL_WEIGHTS = "betel_leaf_model.pth"
     CLASS_INDEX_FILE = "class_indices.json"
+    # Temperature scaling written by evaluate.py --fit-temperature (optional)
+    CALIBRATION_FILE = "calibration.json"
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
-    DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # "auto" picks CUDA when available
+    DEVICE = "auto"
+    # "background" loads the model on a thread at import so /api/chat answers at once,
+    # "lazy" defers it to the first prediction, "eager" blocks the import until loaded
+    MODEL_LOAD = os.environ.get("MODEL_LOAD", "background")
+    # Memory-map the weights file instead of copying it into freshly allocated tensors
+    MMAP_WEIGHTS = os.environ.get("MMAP_WEIGHTS", "1") != "0"
+    # "eager" serves MODEL_WEIGHTS; "torchscript" serves an artifact from export_model.py
+    MODEL_FORMAT = "eager"
+    EXPORTED_MODEL = "betel_leaf_model.int8-static.ts"
+    # Dynamic micro-batching: concurrent requests are grouped into one forward pass
+    BATCH_MAX_SIZE = 16
+    BATCH_MAX_WAIT_MS = 5.0
+    IMG_SIZE = 224
+    # Let libjpeg downscale large phone photos while decoding
+    JPEG_DRAFT_DECODE = True
+    # Uploads are decoded from memory; persisting them is optional and asynchronous.
+    # The store only manages (and evicts from) its own subfolder
+    PERSIST_UPLOADS = True
+    UPLOAD_STORE_FOLDER = os.path.join(UPLOAD_FOLDER, "received")
+    UPLOAD_MAX_FILES = 1000
+    UPLOAD_MAX_BYTES = 512 * 1024 * 1024
+    UPLOAD_MAX_AGE_SECONDS = 7 * 24 * 3600
+    # Prediction cache keyed by image content ("sha256") or perceptual hash ("dhash")
+    ENABLE_PREDICTION_CACHE = True
+    CACHE_KEY_MODE = "sha256"
+    CACHE_MAX_ENTRIES = 2048
+    CACHE_TTL_SECONDS = 3600
+    # Per-user chat context, keyed by the X-Session-ID header (or "session_id" field)
+    SESSION_TTL_SECONDS = 6 * 3600
+    MAX_CHAT_SESSIONS = 10000
+    # Test-time augmentation: "off", "always" (K views in one batch) or "adaptive"
+    # (K views only when the plain pass is below the confidence threshold)
+    TTA_MODE = "adaptive"
+    TTA_VIEWS = 4
+    TTA_CONFIDENCE_THRESHOLD = 0.5
+    # Quality gate before inference: "reject" blurry/dark/non-leaf photos, "shadow" only
+    # counts them in metrics, "off" skips it. "auto" rejects once thresholds have been
+    # calibrated (quality_gate.py calibrate) and shadows on the built-in defaults
+    QUALITY_GATE = os.environ.get("QUALITY_GATE", "auto")
+    QUALITY_THRESHOLDS_FILE = "quality_thresholds.json"
+    # Similar-case retrieval (embedding_index.py build); /api/predict?similar=K returns
+    # the K nearest labelled reference images
+    EMBEDDING_INDEX_DIR = "embedding_index"
+    SIMILAR_MAX_K = 10
+    SIMILAR_THUMBNAIL_SIZE = 256
+    # Drift monitor: sliding window over the last N predictions vs. the val profile
+    # from drift_monitor.py reference; PSI is only reported once MIN_SAMPLES are in
+    DRIFT_WINDOW = 1000
+    DRIFT_MIN_SAMPLES = 200
+    DRIFT_REFERENCE_FILE = "drift_reference.json"
+    # Versioned models (model_registry.py); without a registry the files above are served.
+    # CURRENT (or the legacy files) is polled so a new model is hot-reloaded; 0 disables
+    MODEL_REGISTRY_DIR = "models"
+    MODEL_WATCH_SECONDS = 5.0
+    # Admin endpoints need this X-Admin-Token; without one they only accept localhost
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+    # Bulk scoring (/api/predict/batch)
+    BULK_DECODE_WORKERS = 4
+    # Asyncio front-end (async_app.py): bounded inference pool and admission control
+    ASYNC_INFERENCE_WORKERS = 16
+    ASYNC_MAX_PENDING = 64
+    ASYNC_UPLOAD_TIMEOUT_SECONDS = 60
+    # Upload bodies buffered in memory at once, across all requests; beyond it uploads get 429
+    ASYNC_MAX_UPLOAD_BUFFER_BYTES = 256 * 1024 * 1024
+    # Request body caps; larger bodies get 413 before they are read or spooled
+    MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+    MAX_BATCH_UPLOAD_BYTES = 512 * 1024 * 1024
+
+class UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        # Bulk scoring accepts whole archives; every other endpoint uses MAX_CONTENT_LENGTH
+        if self.endpoint == "predict_batch":
+            return Config.MAX_BATCH_UPLOAD_BYTES
+        return super().max_content_length
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = Config.MAX_UPLOAD_BYTES
 CORS(app)
-os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+
+upload_store = UploadStore(
+    Config.UPLOAD_STORE_FOLDER,
+    max_files=Config.UPLOAD_MAX_FILES,
+    max_bytes=Config.UPLOAD_MAX_BYTES,
+    max_age_seconds=Config.UPLOAD_MAX_AGE_SECONDS
+) if Config.PERSIST_UPLOADS else None
+
+prediction_cache = PredictionCache(
+    max_entries=Config.CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.CACHE_TTL_SECONDS
+) if Config.ENABLE_PREDICTION_CACHE else None
+
+quality_gate = QualityGate.from_file(Config.QUALITY_THRESHOLDS_FILE) if Config.QUALITY_GATE != "off" else None
+if Config.QUALITY_GATE == "auto":
+    quality_gate_mode = "reject" if quality_gate.calibrated else "shadow"
+else:
+    quality_gate_mode = Config.QUALITY_GATE
+
+# Opened once here; an index built later is picked up by the model watcher's poll
+embedding_index = open_index(Config.EMBEDDING_INDEX_DIR)
 
 # ======================================================
 # RESOURCE LOADING (CLASSES & DISEASE DATA)
@@ -58,46 +172,247 @@ DISEASE_INFO = {
 }
 
 # ======================================================
-# MODEL ARCHITECTURE & INITIALIZATION
+# MODEL LOADING (torch is only imported here)
 # ======================================================
-def get_model(num_classes):
-    """Initializes EfficientNet-B0 with custom classifier head."""
-    model = models.efficientnet_b0(weights=None) 
-    in_features = model.classifier[1].in_features
-    model.classifier = nn.Sequential(
-        nn.Dropout(p=0.5, inplace=True),
-        nn.Linear(in_features, num_classes)
-    )
-    return model
-
-def load_trained_model():
-    """Loads weights and prepares model for inference."""
-    if not CLASSES:
-        return None
-    
-    model = get_model(len(CLASSES))
-    try:
-        model.load_state_dict(torch.load(Config.MODEL_WEIGHTS, map_location=Config.DEVICE))
-        model.to(Config.DEVICE)
-        model.eval()
-        print(f"✅ Model loaded on {Config.DEVICE}")
-        return model
-    except FileNotFoundError:
-        print(f"❌ Weights file '{Config.MODEL_WEIGHTS}' not found.")
-        return None
-
-# Global Model & Chatbot instances
-model = load_trained_model()
+engine = None
+# The engine served before the last swap, kept loaded for instant rollback
+previous_engine = None
+model_status = "not_loaded"
+startup_timings = {}
+reload_state = {"status": "idle", "version": None, "error": None, "seconds": None}
+_engine_lock = threading.Lock()
+_loader_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_loader_thread = None
+_watcher_pid = None
+
+registry = ModelRegistry(Config.MODEL_REGISTRY_DIR)
+
+def served_model_path():
+    """Path of the legacy model artifact configured for serving (used when the registry is empty)."""
+    return Config.EXPORTED_MODEL if Config.MODEL_FORMAT == "torchscript" else Config.MODEL_WEIGHTS
+
+def resolve_artifact(version=None):
+    """The registry's CURRENT (or a given) version, falling back to the legacy top-level files."""
+    version = version or registry.current()
+    if version:
+        return registry.artifact(version)
+    return legacy_artifact(served_model_path(), Config.MODEL_FORMAT, Config.CLASS_INDEX_FILE,
+                           Config.CALIBRATION_FILE)
+
+def load_engine():
+    """Imports the vision stack and loads the model once; concurrent callers wait for that load."""
+    global engine, model_status
+    if model_status in ("ready", "failed"):
+        return engine
+    with _engine_lock:
+        if model_status in ("ready", "failed"):
+            return engine
+        model_status = "loading"
+        started = time.perf_counter()
+        timings = {}
+        try:
+            import inference
+            timings["import_torch"] = round(time.perf_counter() - started, 4)
+            engine = inference.load_engine(Config, resolve_artifact(), timings)
+        except Exception as e:
+            print(f"❌ Error loading model: {e}")
+            engine = None
+        timings["model_load_total"] = round(time.perf_counter() - started, 4)
+        timings["model_ready_since_import"] = round(time.perf_counter() - _import_started, 4)
+        startup_timings.update(timings)
+        if engine is not None:
+            metrics.MODEL_LOAD_SECONDS.set(timings["model_load_total"])
+        model_status = "ready" if engine is not None else "failed"
+    return engine
+
+def start_background_load():
+    """Starts loading the model on a background thread (no-op if already started)."""
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is not None or model_status != "not_loaded":
+            return
+        # Not a daemon: exiting mid-import of torch aborts the interpreter, so short-lived
+        # scripts that import app (bulk_predict.py) wait for the load instead
+        _loader_thread = threading.Thread(target=load_engine, name="model-loader")
+        _loader_thread.start()
+
+def reload_model(version=None):
+    """
+    Loads and warms up a model version next to the serving one, then swaps it in.
+    Requests already holding the old engine finish on it; the old engine stays
+    loaded as `previous_engine` for rollback. Returns the served version.
+    """
+    global engine, previous_engine, model_status
+    with _reload_lock:
+        artifact = resolve_artifact(version)
+        if engine is not None and artifact.version == engine.version:
+            return engine.version
+        reload_state.update(status="loading", version=artifact.version, error=None)
+        started = time.perf_counter()
+        import inference
+        new_engine = inference.load_engine(Config, artifact)
+        if new_engine is None:
+            reload_state.update(status="failed", error=f"Could not load {artifact.version}")
+            raise RuntimeError(reload_state["error"])
+        previous_engine, engine = engine, new_engine
+        model_status = "ready"
+        if version and registry.current() != version:
+            # Keep CURRENT in sync so file watchers (other workers) converge on it
+            registry.activate(version)
+        reload_state.update(status="ready", seconds=round(time.perf_counter() - started, 3))
+        print(f"🔄 Now serving model {engine.version} (previous: {getattr(previous_engine, 'version', None)})")
+        return engine.version
+
+def rollback_model():
+    """Swaps the previous engine back in instantly; returns the served version."""
+    global engine, previous_engine
+    with _reload_lock:
+        if previous_engine is None:
+            raise RuntimeError("No previous model version is loaded")
+        previous_engine, engine = engine, previous_engine
+        if engine.version in registry.versions():
+            registry.activate(engine.version)
+        print(f"⏪ Rolled back to model {engine.version}")
+        return engine.version
+
+def _watch_signature():
+    if registry.current():
+        return registry.current_signature()
+    return resolve_artifact().signature()
+
+def _watch_loop():
+    global embedding_index
+    seen = _watch_signature()
+    pending = None
+    while True:
+        time.sleep(Config.MODEL_WATCH_SECONDS)
+        if embedding_index is None:
+            embedding_index = open_index(Config.EMBEDDING_INDEX_DIR)
+        signature = _watch_signature()
+        if signature == seen:
+            pending = None
+            continue
+        # Reload once the change has been stable for a full poll (no half-written files)
+        if signature != pending:
+            pending = signature
+            continue
+        seen, pending = signature, None
+        try:
+            reload_model()
+        except Exception as e:
+            print(f"❌ Model reload failed, still serving {getattr(engine, 'version', None)}: {e}")
+
+def ensure_watcher():
+    """Starts the model file watch in this process (again after fork, like the batcher)."""
+    global _watcher_pid
+    if Config.MODEL_WATCH_SECONDS <= 0 or _watcher_pid == os.getpid():
+        return
+    with _loader_lock:
+        if _watcher_pid == os.getpid():
+            return
+        _watcher_pid = os.getpid()
+        threading.Thread(target=_watch_loop, name="model-watcher", daemon=True).start()
+
+def warmup():
+    """Loads the model if needed and runs one dummy item through the batcher."""
+    current = load_engine()
+    if current is not None:
+        ensure_watcher()
+        blank = np.zeros((Config.IMG_SIZE, Config.IMG_SIZE, 3), dtype=np.uint8)
+        batcher.infer((current, blank))
+
+def _forward(current, arrays):
+    # Pooled features come from the same pass; only kept when there is an index to search
+    if embedding_index is None:
+        return [(p, None) for p in current.forward_batch(arrays)]
+    probabilities, embeddings = current.forward_batch(arrays, with_embeddings=True)
+    return list(zip(probabilities, embeddings if embeddings is not None else [None] * len(arrays)))
+
+def forward_batch(items):
+    """
+    Runs queued (engine, HxWx3 uint8 array) items and returns per-item
+    (probabilities, embedding or None). Items normally share one engine;
+    right after a swap, each engine runs its own items.
+    """
+    first = items[0][0]
+    if all(item_engine is first for item_engine, _ in items):
+        return _forward(first, [array for _, array in items])
+
+    groups = {}
+    for i, (item_engine, _) in enumerate(items):
+        groups.setdefault(id(item_engine), (item_engine, []))[1].append(i)
+    results = [None] * len(items)
+    for item_engine, indices in groups.values():
+        outputs = _forward(item_engine, [items[i][1] for i in indices])
+        for output, i in zip(outputs, indices):
+            results[i] = output
+    return results
+
+# Global Batcher & Chatbot instances (cheap: no torch needed)
+batcher = MicroBatcher(forward_batch, Config.BATCH_MAX_SIZE, Config.BATCH_MAX_WAIT_MS)
 chatbot = BetelLeafChatbot(CLASSES)
+drift_monitor = DriftMonitor(
+    [CLASSES[i] for i in sorted(CLASSES)],
+    window=Config.DRIFT_WINDOW,
+    reference_path=Config.DRIFT_REFERENCE_FILE,
+    min_samples=Config.DRIFT_MIN_SAMPLES
+) if CLASSES else None
+chat_sessions = SessionStore(Config.SESSION_TTL_SECONDS, Config.MAX_CHAT_SESSIONS)
 
-# ======================================================
-# IMAGE PRE-PROCESSING
-# ======================================================
-inference_transforms = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+# Values owned by other components are sampled when /metrics is scraped
+for _name, _help, _fn in [
+    ("betel_batch_queue_depth", "Requests waiting for a batched forward pass.",
+     lambda: batcher.stats.snapshot()["queue_depth"]),
+    ("betel_batch_mean_size", "Mean items per batched forward pass.",
+     lambda: batcher.stats.snapshot()["mean_batch_size"]),
+    ("betel_chat_sessions", "Live chat sessions.", lambda: len(chat_sessions)),
+]:
+    metrics.REGISTRY.register(metrics.Gauge(_name, _help, _fn))
+for _name, _help, _fn in [
+    ("betel_cache_hits_total", "Prediction cache hits.",
+     lambda: prediction_cache.snapshot()["hits"] if prediction_cache is not None else None),
+    ("betel_cache_misses_total", "Prediction cache misses.",
+     lambda: prediction_cache.snapshot()["misses"] if prediction_cache is not None else None),
+    ("betel_uploads_dropped_total", "Uploads not persisted because the writer was backlogged.",
+     lambda: upload_store.snapshot()["dropped"] if upload_store is not None else None),
+]:
+    metrics.REGISTRY.register(metrics.Counter(_name, _help, _fn))
+
+# Each worker publishes its window; reports and resets cover all of them (serve.py)
+metrics.REGISTRY.share("drift", lambda: drift_monitor.window.snapshot() if drift_monitor is not None else None)
+metrics.REGISTRY.on_broadcast("drift_reset", lambda: drift_monitor.window.reset() if drift_monitor is not None else None)
+
+def drift_report():
+    snapshots = [s for s in metrics.REGISTRY.shared_state("drift") if s is not None]
+    return drift_monitor.report(engine.version if engine is not None else None, merge_snapshots(snapshots))
+
+def observe_drift(probabilities):
+    """Adds one prediction's probability vector to the drift window (O(1))."""
+    if drift_monitor is not None and len(probabilities) == drift_monitor.window.num_classes:
+        drift_monitor.observe(probabilities)
+
+# The drift gauges share one report, computed once per /metrics scrape
+_scraped_drift = {"report": None}
+
+@metrics.REGISTRY.on_scrape
+def _scrape_drift():
+    _scraped_drift["report"] = drift_report() if drift_monitor is not None else None
+
+def _scraped_drift_value(key):
+    report = _scraped_drift["report"]
+    return report[key] if report is not None else None
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "betel_drift_psi", "Population stability index of the prediction window vs. the val profile.",
+    lambda: _scraped_drift_value("psi"), label="signal", cluster_wide=True))
+metrics.REGISTRY.register(metrics.Gauge(
+    "betel_drift_status", "Drift status: -1 insufficient data, 0 ok, 1 warning, 2 drift.",
+    lambda: STATUS_LEVELS.get(_scraped_drift_value("status")), cluster_wide=True))
+metrics.REGISTRY.register(metrics.Gauge(
+    "betel_drift_window_predictions", "Predictions currently in the drift window.",
+    lambda: _scraped_drift_value("window")["count"] if _scraped_drift["report"] is not None else None,
+    cluster_wide=True))
 
 # ======================================================
 # UTILITIES
@@ -105,6 +420,17 @@ inference_transforms = transforms.Compose([
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
+def requested_session_id(payload=None):
+    """The caller's session ID from the X-Session-ID header or a 'session_id' field, if any."""
+    session_id = request.headers.get("X-Session-ID")
+    if not session_id and payload:
+        session_id = payload.get("session_id")
+    return session_id
+
+def with_session(response, session_id):
+    response.headers["X-Session-ID"] = session_id
+    return response
+
 def calculate_severity(confidence):
     if confidence < 50: return "Uncertain"
     if confidence < 70: return "Mild Infection"
@@ -114,26 +440,211 @@ def calculate_severity(confidence):
 # ======================================================
 # CORE INFERENCE LOGIC
 # ======================================================
-def run_inference(img_path, top_k=3):
-    """Processes image and returns top-K predictions and severity."""
-    img = Image.open(img_path).convert("RGB")
-    img_tensor = inference_transforms(img).unsqueeze(0).to(Config.DEVICE)
+def _copy_result(result):
+    """
+    Copies cached (predictions, severity, model_version, embedding, probabilities)
+    to the (predictions, severity, model_version, embedding) run_inference returns,
+    so callers cannot mutate the cache; the embedding array is read-only and shared.
+    """
+    results, severity, model_version, embedding = result[:4]
+    return [dict(r) for r in results], severity, model_version, embedding
 
-    with torch.no_grad():
-        outputs = model(img_tensor)
-        probabilities = torch.softmax(outputs, dim=1)[0]
+def _cache_hit(cached):
+    # Repeat images are real traffic, so they count towards drift like fresh predictions
+    observe_drift(cached[4])
+    return _copy_result(cached)
 
-    top_probs, top_indices = torch.topk(probabilities, top_k)
-    
-    results = []
-    for prob, idx in zip(top_probs, top_indices):
-        results.append({
-            "label": CLASSES[int(idx)],
-            "confidence": round(float(prob) * 100, 2)
-        })
+def forward_views(current, img_arrays):
+    """
+    Submits views together so they share one batched forward pass; returns
+    their probabilities and embeddings as two lists.
+    """
+    futures = batcher.submit_many([(current, array) for array in img_arrays])
+    outputs = [future.result() for future in futures]
+    metrics.record("batch_queue", futures[0].queue_ms / 1000)
+    metrics.record("batch_forward", max(future.forward_ms for future in futures) / 1000)
+    return [p for p, _ in outputs], [e for _, e in outputs]
+
+def check_quality(img_array):
+    """Runs the quality gate; raises ImageRejected in "reject" mode so no forward pass is spent."""
+    with metrics.stage("quality_gate"):
+        scores, reasons = quality_gate.check(img_array)
+    for reason in reasons:
+        metrics.QUALITY_REJECTED_TOTAL.inc(reason=reason, mode=quality_gate_mode)
+    if reasons:
+        metrics.QUALITY_REJECTED_IMAGES_TOTAL.inc(mode=quality_gate_mode)
+    if reasons and quality_gate_mode == "reject":
+        raise ImageRejected(reasons, scores)
+
+def predict_probabilities(current, img, img_array):
+    """
+    Class probabilities for one decoded image, with test-time augmentation per
+    Config.TTA_MODE, plus the plain view's embedding (None without an index).
+    """
+    views = Config.TTA_VIEWS if Config.TTA_MODE != "off" else 1
+    if Config.TTA_MODE == "always" and views > 1:
+        with metrics.stage("tta_views"):
+            arrays = current.preprocessor.tta_views(img, views, base=img_array)
+        metrics.TTA_TOTAL.inc(mode="always")
+        probabilities, embeddings = forward_views(current, arrays)
+        return current.mean_probabilities(probabilities), embeddings[0]
+
+    (probabilities,), (embedding,) = forward_views(current, [img_array])
+    if views > 1 and float(probabilities.max()) < Config.TTA_CONFIDENCE_THRESHOLD:
+        # Only uncertain photos pay for a second (batched) pass; the plain view is reused
+        with metrics.stage("tta_views"):
+            arrays = current.preprocessor.tta_views(img, views, base=img_array)[1:]
+        metrics.TTA_TOTAL.inc(mode="adaptive")
+        probabilities = current.mean_probabilities([probabilities] + forward_views(current, arrays)[0])
+    return probabilities, embedding
+
+def run_inference(source, top_k=3):
+    """
+    Processes image (path, bytes or stream) and returns top-K predictions,
+    severity, the version of the model that produced them and the image's
+    float16 embedding (None when no similar-case index is in use).
+    """
+    if load_engine() is None:
+        raise RuntimeError("Model is not available")
+    ensure_watcher()
+    # Pin the engine for the whole request: a hot reload must not switch models mid-way
+    current = engine
+    preprocessor = current.preprocessor
+
+    cache_key = None
+    # Results differ per model version, top_k and TTA setting, so all are part of the key
+    result_variant = f"{current.version}:{top_k}:{Config.TTA_MODE}:{Config.TTA_VIEWS}"
+    if prediction_cache is not None:
+        if Config.CACHE_KEY_MODE == "sha256" and isinstance(source, (bytes, bytearray, memoryview)):
+            # Exact-content hits skip decoding as well as the forward pass
+            with metrics.stage("cache_lookup"):
+                cache_key = f"{sha256_key(source)}:{result_variant}"
+                cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                return _cache_hit(cached)
+
+    with metrics.stage("decode"):
+        img = preprocessor.open(source)
+
+    if prediction_cache is not None and Config.CACHE_KEY_MODE == "dhash":
+        with metrics.stage("cache_lookup"):
+            cache_key = f"{dhash_key(img)}:{result_variant}"
+            cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return _cache_hit(cached)
+
+    # Resize per image; conversion + normalization happen batched in forward_batch
+    with metrics.stage("resize"):
+        img_array = preprocessor.resize(img)
+
+    if quality_gate is not None:
+        check_quality(img_array)
+
+    # Concurrent callers (and an image's TTA views) share batched forward passes
+    probabilities, embedding = predict_probabilities(current, img, img_array)
+    distribution = probabilities.numpy()
+    distribution.flags.writeable = False
+    observe_drift(distribution)
+    if embedding is not None:
+        embedding = embedding.numpy().astype(np.float16)
+        embedding.flags.writeable = False
+
+    with metrics.stage("topk"):
+        results = []
+        for idx, prob in current.top_k(probabilities, min(top_k, len(current.classes))):
+            results.append({
+                "label": current.classes[idx],
+                "confidence": round(prob * 100, 2)
+            })
 
     severity = calculate_severity(results[0]["confidence"])
-    return results, severity
+    if cache_key is not None:
+        prediction_cache.put(cache_key, (*_copy_result((results, severity, current.version, embedding)),
+                                         distribution))
+    return results, severity, current.version, embedding
+
+def persist_upload(filename, image_bytes):
+    """Hands the upload to the background writer (if persistence is enabled)."""
+    if upload_store is not None:
+        with metrics.stage("persist"):
+            ext = secure_filename(filename).rsplit('.', 1)[1]
+            upload_store.submit(f"{uuid.uuid4().hex}.{ext}", image_bytes)
+
+def similar_cases(embedding, k, model_version):
+    """
+    The k nearest labelled reference images as {"id", "label", "score",
+    "image_url"}, or ([], reason) when retrieval is unavailable.
+    """
+    index = embedding_index
+    if index is None:
+        return [], "No similar-case index has been built"
+    if embedding is None:
+        return [], "The served model format does not expose embeddings"
+    if index.model_version != model_version:
+        return [], f"Similar-case index was built with model {index.model_version}; rebuild it"
+    with metrics.stage("similar_search"):
+        matches = index.search(embedding, k)[0]
+    # Server paths stay private; the thumbnail URL pins the build, since row ids restart on a rebuild
+    build_id = index.build_id
+    return [{"id": m["id"], "label": m["label"], "score": m["score"],
+             "image_url": f"/api/similar/{build_id}/{m['id']}/thumbnail"} for m in matches], None
+
+def diagnose(image_bytes, session_id=None, similar_k=0):
+    """Runs inference, syncs the user's chat session and builds the /api/predict payload."""
+    predictions, severity, model_version, embedding = run_inference(image_bytes)
+
+    main_pred = predictions[0]
+    metrics.PREDICTIONS_TOTAL.inc(label=main_pred["label"], severity=severity)
+    # Sync result with this user's chat session only
+    with metrics.stage("chat_sync"):
+        session_id, session = chat_sessions.get(session_id)
+        chatbot.update_prediction(main_pred["label"], main_pred["confidence"], session)
+        chat_sessions.save(session_id, session)
+
+    # Determine Advice
+    if main_pred["confidence"] < 50:
+        advice = "Prediction uncertain. Please provide a clearer photo of the leaf."
+    else:
+        advice = DISEASE_INFO.get(main_pred["label"], {}).get("advice", "No specific advice found.")
+
+    payload = {
+        "top_predictions": predictions,
+        "severity": severity,
+        "advice": advice,
+        "session_id": session_id,
+        "model_version": model_version,
+        "status": "success"
+    }
+    if similar_k > 0:
+        payload["similar_cases"], note = similar_cases(embedding, min(similar_k, Config.SIMILAR_MAX_K), model_version)
+        if note:
+            payload["similar_cases_note"] = note
+    return payload
+
+# ======================================================
+# REQUEST TRACING
+# ======================================================
+UNTRACED_PATHS = ("/metrics", "/api/trace/")
+
+@app.before_request
+def start_trace():
+    g.request_id = metrics.new_request_id(request.headers.get("X-Request-ID"))
+    if not request.path.startswith(UNTRACED_PATHS):
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.trace = metrics.RequestTrace(g.request_id, endpoint)
+        metrics.activate(g.trace)
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        metrics.finish_request(trace, response.status_code)
+    response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.teardown_request
+def clear_trace(exc=None):
+    metrics.activate(None)
 
 # ======================================================
 # API ENDPOINTS
@@ -141,42 +652,235 @@ def run_inference(img_path, top_k=3):
 
 @app.route("/api/predict", methods=["POST"])
 def predict():
-    if 'image' not in request.files:
+    # Accessing request.files parses (and so receives) the multipart body
+    with metrics.stage("receive"):
+        files = request.files
+    if 'image' not in files:
         return jsonify({"error": "No image part in request"}), 400
     
-    file = request.files['image']
+    file = files['image']
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({"error": "Invalid file type"}), 400
 
-    # Save file with unique ID
-    ext = secure_filename(file.filename).rsplit('.', 1)[1]
-    unique_name = f"{uuid.uuid4().hex}.{ext}"
-    save_path = os.path.join(Config.UPLOAD_FOLDER, unique_name)
-    file.save(save_path)
+    # Decode straight from memory; persistence happens off the request path
+    image_bytes = file.read()
+    persist_upload(file.filename, image_bytes)
 
-    try:
-        predictions, severity = run_inference(save_path)
-        
-        main_pred = predictions[0]
-        # Sync result with chatbot state
-        chatbot.update_prediction(main_pred["label"], main_pred["confidence"])
-
-        # Determine Advice
-        if main_pred["confidence"] < 50:
-            advice = "Prediction uncertain. Please provide a clearer photo of the leaf."
-        else:
-            advice = DISEASE_INFO.get(main_pred["label"], {}).get("advice", "No specific advice found.")
-
-        return jsonify({
-            "top_predictions": predictions,
-            "severity": severity,
-            "advice": advice,
-            "status": "success"
-        })
+    # Waits for a background load in progress, or loads now in "lazy" mode
+    if load_engine() is None:
+        return jsonify({"error": "Model is not available"}), 503
 
+    try:
+        # ?similar=K (or a "similar" form field) adds the K nearest labelled reference images
+        similar_k = request.values.get("similar", 0, type=int)
+        payload = diagnose(image_bytes, requested_session_id(request.form), similar_k)
+        return with_session(jsonify(payload), payload["session_id"])
+    except ImageRejected as e:
+        return jsonify(e.to_dict()), 422
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/similar/<build_id>/<int:row_id>/thumbnail", methods=["GET"])
+def similar_thumbnail(build_id, row_id):
+    """JPEG thumbnail of a similar-case reference image (the image_url in /api/predict?similar=K)."""
+    item = embedding_index.item(row_id, build_id) if embedding_index is not None else None
+    if item is None:
+        return jsonify({"error": "Unknown reference image"}), 404
+    size = (Config.SIMILAR_THUMBNAIL_SIZE, Config.SIMILAR_THUMBNAIL_SIZE)
+    try:
+        with Image.open(item["path"]) as img:
+            img.draft("RGB", size)
+            img = img.convert("RGB")
+    except OSError:
+        return jsonify({"error": "Reference image is no longer available"}), 404
+    img.thumbnail(size)
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    response = Response(buffer.getvalue(), mimetype="image/jpeg")
+    # Rows of a build never change, so the URL can be cached for good
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+@app.route("/api/predict/batch", methods=["POST"])
+def predict_batch():
+    """Scores many images (repeated 'images' files or one 'archive' zip) and streams NDJSON."""
+    if load_engine() is None:
+        return jsonify({"error": "Model is not available"}), 503
+
+    # Werkzeug closes request files once the view returns, so hand the streaming
+    # generator its own copy: the archive in a temp file, loose images as bytes.
+    archive = None
+    if 'archive' in request.files:
+        archive = tempfile.TemporaryFile()
+        try:
+            shutil.copyfileobj(request.files['archive'].stream, archive)
+        except BaseException:
+            archive.close()
+            raise
+        sources = iter_zip(archive)
+    elif 'images' in request.files:
+        sources = list(iter_uploads(request.files.getlist('images')))
+    else:
+        return jsonify({"error": "Provide 'images' files or an 'archive' zip"}), 400
+
+    top_k = request.args.get("top_k", 3, type=int)
+    records = predict_stream(sources, run_inference, Config.BULK_DECODE_WORKERS, top_k)
+    response = Response(stream_with_context(to_ndjson(records)), mimetype="application/x-ndjson")
+    if archive is not None:
+        # Also runs when the client disconnects and the stream is abandoned
+        response.call_on_close(archive.close)
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"error": "Upload too large"}), 413
+
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once the model is loaded in this worker, 503 before that."""
+    status = {
+        "ready": engine is not None,
+        "model_status": model_status,
+        "model_version": engine.version if engine is not None else None,
+        "pid": os.getpid(),
+        "device": str(engine.device) if engine is not None else None,
+        "torch_threads": engine.torch_threads() if engine is not None else None,
+        "startup": startup_timings
+    }
+    return jsonify(status), 200 if engine is not None else 503
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    """Exposes inference batching statistics for latency/throughput tuning."""
+    return jsonify({
+        "batching": batcher.stats.snapshot(),
+        "uploads": upload_store.snapshot() if upload_store is not None else None,
+        "cache": prediction_cache.snapshot() if prediction_cache is not None else None,
+        "embedding_index": embedding_index.snapshot() if embedding_index is not None else None,
+        "chat_sessions": len(chat_sessions)
+    })
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage histograms, request/prediction counters, gauges."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/trace/<request_id>", methods=["GET"])
+def request_trace(request_id):
+    """Per-stage timing breakdown for a recent request (see the X-Request-ID header)."""
+    trace = metrics.find_trace(request_id)
+    if trace is None:
+        return jsonify({"error": "Unknown or expired request ID"}), 404
+    return jsonify(trace)
+
+def admin_allowed():
+    if Config.ADMIN_TOKEN:
+        return request.headers.get("X-Admin-Token") == Config.ADMIN_TOKEN
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+@app.route("/api/admin/models", methods=["GET"])
+def admin_models():
+    """Published versions, the registry's CURRENT and what this worker is serving."""
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({
+        "serving": engine.version if engine is not None else None,
+        "previous": previous_engine.version if previous_engine is not None else None,
+        "current": registry.current(),
+        "versions": [registry.meta(version) for version in registry.versions()],
+        "reload": reload_state
+    })
+
+@app.route("/api/admin/reload", methods=["POST"])
+def admin_reload():
+    """Loads CURRENT (or {"version": ...}) alongside the served model and swaps it in."""
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    version = (request.get_json(silent=True) or {}).get("version")
+    if version and version not in registry.versions():
+        return jsonify({"error": f"Unknown model version '{version}'"}), 404
+    if load_engine() is None and not version:
+        return jsonify({"error": "Model is not available"}), 503
+    try:
+        served = reload_model(version)
+    except Exception as e:
+        return jsonify({"error": str(e), "serving": getattr(engine, "version", None)}), 500
+    return jsonify({"serving": served, "previous": getattr(previous_engine, "version", None)})
+
+@app.route("/api/admin/rollback", methods=["POST"])
+def admin_rollback():
+    """Swaps back to the previously served model without reloading it."""
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        served = rollback_model()
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"serving": served, "previous": previous_engine.version})
+
+@app.route("/api/admin/drift", methods=["GET"])
+def admin_drift():
+    """Prediction drift report over every worker's window vs. the val reference, PSI per signal."""
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    if drift_monitor is None:
+        return jsonify({"error": "Drift monitor is not available"}), 404
+    return jsonify(drift_report())
+
+@app.route("/api/admin/drift/reset", methods=["POST"])
+def admin_drift_reset():
+    """
+    Empties the window, e.g. after swapping models or recomputing the
+    reference. Other serve.py workers empty theirs on their next publish.
+    """
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    if drift_monitor is None:
+        return jsonify({"error": "Drift monitor is not available"}), 404
+    metrics.REGISTRY.broadcast("drift_reset")
+    return jsonify(drift_report())
+
+@app.route("/api/admin/index/add", methods=["POST"])
+def admin_index_add():
+    """Adds newly labelled reference images ('images' files + 'label') to the similar-case index."""
+    if not admin_allowed():
+        return jsonify({"error": "Forbidden"}), 403
+    index = embedding_index
+    if index is None:
+        return jsonify({"error": "No index yet; run 'python embedding_index.py build' first"}), 404
+    label = request.form.get("label", "")
+    if label not in CLASSES.values():
+        return jsonify({"error": f"Unknown label '{label}'"}), 400
+    if load_engine() is None:
+        return jsonify({"error": "Model is not available"}), 503
+
+    folder = os.path.join(Config.EMBEDDING_INDEX_DIR, "references", label)
+    os.makedirs(folder, exist_ok=True)
+    embeddings, items, errors = [], [], []
+    for file in request.files.getlist("images"):
+        if not allowed_file(file.filename):
+            errors.append({"file": file.filename, "error": "Invalid file type"})
+            continue
+        image_bytes = file.read()
+        try:
+            _, _, model_version, embedding = run_inference(image_bytes)
+        except Exception as e:
+            errors.append({"file": file.filename, "error": str(e)})
+            continue
+        if embedding is None or model_version != index.model_version:
+            errors.append({"file": file.filename, "error": "Embedding unavailable for the served model"})
+            continue
+        ext = secure_filename(file.filename).rsplit('.', 1)[1]
+        path = os.path.join(folder, f"{sha256_key(image_bytes)[:16]}.{ext}")
+        with open(path, "wb") as f:
+            f.write(image_bytes)
+        embeddings.append(embedding)
+        items.append({"path": path, "label": label})
+
+    if embeddings:
+        index.add(np.stack(embeddings), items)
+    return jsonify({"added": len(items), "size": len(index), "errors": errors})
+
 @app.route("/api/chat", methods=["POST"])
 def chat():
     data = request.json
@@ -186,10 +890,18 @@ def chat():
         return jsonify({"reply": "I didn't catch that. Could you repeat?"}), 400
 
     try:
-        response = chatbot.get_response(user_input)
-        return jsonify({"reply": response})
+        session_id, session = chat_sessions.get(requested_session_id(data))
+        response = chatbot.get_response(user_input, session)
+        return with_session(jsonify({"reply": response, "session_id": session_id}), session_id)
     except Exception as e:
         return jsonify({"reply": "My chat system is experiencing issues."}), 500
 
+# Chat is usable from here on; the model follows according to Config.MODEL_LOAD
+startup_timings["import_app"] = round(time.perf_counter() - _import_started, 4)
+if Config.MODEL_LOAD == "eager":
+    load_engine()
+elif Config.MODEL_LOAD == "background":
+    start_background_load()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
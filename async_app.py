@@ -0,0 +1,388 @@
+"""
+Asyncio front-end with the same /api/predict and /api/chat contracts as app.py.
+
+Uploads are streamed on the event loop, so a slow client only costs a
+coroutine, never an inference thread; the bytes buffered by all uploads in
+flight are capped, so many slow clients cannot exhaust memory either.
+Decoding and inference run in a bounded thread pool that feeds the shared
+micro-batcher. Admission control rejects work with 429 (queue or upload
+buffer full) or 503 (model unavailable) plus a Retry-After hint.
+
+    python async_app.py --port 5000
+"""
+import argparse
+import asyncio
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import app as core
+import metrics
+from app import Config
+from quality_gate import ImageRejected
+
+UNTRACED_PATHS = ("/metrics", "/api/trace/")
+UPLOAD_CHUNK_BYTES = 64 * 1024
+MAX_FIELD_BYTES = 4096
+MODEL_UNAVAILABLE_RETRY_SECONDS = 5
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadBufferFull(Exception):
+    pass
+
+
+# ======================================================
+# ADMISSION CONTROL
+# ======================================================
+class Admission:
+    """
+    Counts requests holding an inference slot. Only touched from the event
+    loop, so no locking is needed. Retry-After is estimated from recent
+    per-request latency and the work already queued ahead.
+    """
+
+    def __init__(self, max_pending, workers, window=256):
+        self.max_pending = max_pending
+        self.workers = workers
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._latencies = deque(maxlen=window)
+
+    def full(self):
+        return self.pending >= self.max_pending
+
+    def acquire(self):
+        if self.full():
+            self.rejected += 1
+            return False
+        self.pending += 1
+        self.admitted += 1
+        return True
+
+    def release(self, seconds):
+        self.pending -= 1
+        self._latencies.append(seconds)
+
+    def avg_latency(self):
+        return sum(self._latencies) / len(self._latencies) if self._latencies else 1.0
+
+    def retry_after(self):
+        waves = self.pending / max(1, self.workers)
+        return max(1, math.ceil(self.avg_latency() * waves))
+
+    def snapshot(self):
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.avg_latency() * 1000, 2) if self._latencies else None,
+        }
+
+
+class UploadBudget:
+    """
+    Bytes of upload bodies held in memory by requests in flight, reserved
+    chunk by chunk as they stream in and released when the request finishes.
+    Only touched from the event loop, like Admission.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.rejected = 0
+
+    def reserve(self, nbytes):
+        if self.in_flight + nbytes > self.max_bytes:
+            self.rejected += 1
+            return False
+        self.in_flight += nbytes
+        return True
+
+    def release(self, nbytes):
+        self.in_flight -= nbytes
+
+    def snapshot(self):
+        return {"in_flight_bytes": self.in_flight, "max_bytes": self.max_bytes, "rejected": self.rejected}
+
+
+class UploadReservation:
+    """One request's share of the UploadBudget; `close()` returns all of it."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.nbytes = 0
+
+    def reserve(self, nbytes):
+        if not self.budget.reserve(nbytes):
+            raise UploadBufferFull()
+        self.nbytes += nbytes
+
+    def close(self):
+        self.budget.release(self.nbytes)
+        self.nbytes = 0
+
+
+# ======================================================
+# HELPERS
+# ======================================================
+def json_response(payload, status=200, session_id=None, retry_after=None):
+    response = web.json_response(payload, status=status)
+    if session_id is not None:
+        response.headers["X-Session-ID"] = session_id
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+async def read_part(part, limit, reservation=None):
+    """
+    Reads one multipart part chunk by chunk, refusing anything over `limit`
+    bytes, and reserving each chunk against the upload budget when given.
+    """
+    chunks, size = [], 0
+    while True:
+        chunk = await part.read_chunk(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLarge()
+        if reservation is not None:
+            reservation.reserve(len(chunk))
+        chunks.append(chunk)
+
+
+async def read_upload(request, reservation):
+    """Streams the multipart body; returns (filename, image_bytes, form_fields)."""
+    reader = await request.multipart()
+    filename, image_bytes, fields = None, None, {}
+    async for part in reader:
+        if part.name == "image" and part.filename is not None:
+            filename = part.filename
+            image_bytes = await read_part(part, Config.MAX_UPLOAD_BYTES, reservation)
+        elif part.name:
+            fields[part.name] = (await read_part(part, MAX_FIELD_BYTES)).decode("utf-8", "replace")
+    return filename, image_bytes, fields
+
+
+# ======================================================
+# API ENDPOINTS
+# ======================================================
+async def predict(request):
+    admission = request.app["admission"]
+    budget = request.app["upload_budget"]
+    if core.engine is None:
+        # Never block the loop on a model load; "lazy" mode starts it here
+        core.start_background_load()
+        message = "Model is loading" if core.model_status != "failed" else "Model is not available"
+        return json_response({"error": message}, 503, retry_after=MODEL_UNAVAILABLE_RETRY_SECONDS)
+    # Shed load before spending bandwidth on a body we cannot serve
+    if admission.full():
+        admission.rejected += 1
+        return json_response({"error": "Server busy, please retry"}, 429, retry_after=admission.retry_after())
+    if request.content_length is not None and request.content_length > Config.MAX_UPLOAD_BYTES:
+        return json_response({"error": "Upload too large"}, 413)
+    if not request.content_type.startswith("multipart/"):
+        return json_response({"error": "No image part in request"}, 400)
+    if budget.in_flight + (request.content_length or 0) > budget.max_bytes:
+        budget.rejected += 1
+        return json_response({"error": "Server busy, please retry"}, 429, retry_after=admission.retry_after())
+
+    # The buffered body counts against the budget until the response is sent
+    reservation = UploadReservation(budget)
+    try:
+        return await receive_and_diagnose(request, admission, reservation)
+    finally:
+        reservation.close()
+
+
+async def receive_and_diagnose(request, admission, reservation):
+    trace = request.get("trace")
+    receive_started = time.perf_counter()
+    try:
+        filename, image_bytes, fields = await asyncio.wait_for(
+            read_upload(request, reservation), Config.ASYNC_UPLOAD_TIMEOUT_SECONDS
+        )
+        metrics.record("receive", time.perf_counter() - receive_started, trace)
+    except UploadTooLarge:
+        return json_response({"error": "Upload too large"}, 413)
+    except UploadBufferFull:
+        return json_response({"error": "Server busy, please retry"}, 429, retry_after=admission.retry_after())
+    except asyncio.TimeoutError:
+        return json_response({"error": "Upload timed out"}, 408)
+
+    if image_bytes is None:
+        return json_response({"error": "No image part in request"}, 400)
+    if filename == '' or not core.allowed_file(filename):
+        return json_response({"error": "Invalid file type"}, 400)
+
+    # The queue may have filled while this upload was streaming in
+    if not admission.acquire():
+        return json_response({"error": "Server busy, please retry"}, 429, retry_after=admission.retry_after())
+
+    started = time.perf_counter()
+    try:
+        metrics.run_traced(trace, core.persist_upload, filename, image_bytes)
+        session_id = request.headers.get("X-Session-ID") or fields.get("session_id")
+        try:
+            similar_k = int(request.query.get("similar") or fields.get("similar") or 0)
+        except ValueError:
+            return json_response({"error": "'similar' must be an integer"}, 400)
+        loop = asyncio.get_running_loop()
+        # Many requests share the loop thread, so the trace is only activated on the worker
+        payload = await loop.run_in_executor(
+            request.app["executor"], metrics.run_traced, trace, core.diagnose, image_bytes, session_id, similar_k
+        )
+        return json_response(payload, session_id=payload["session_id"])
+    except ImageRejected as e:
+        return json_response(e.to_dict(), 422)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+    finally:
+        admission.release(time.perf_counter() - started)
+
+
+async def chat(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    user_input = (data.get("message") or "").strip()
+
+    if not user_input:
+        return json_response({"reply": "I didn't catch that. Could you repeat?"}, 400)
+
+    try:
+        session_id = request.headers.get("X-Session-ID") or data.get("session_id")
+        # Session lookup takes a lock shared with inference threads, so keep it off the loop;
+        # the default executor is used so chat never queues behind predictions
+        session_id, response = await asyncio.get_running_loop().run_in_executor(
+            None, respond_to_chat, user_input, session_id
+        )
+        return json_response({"reply": response, "session_id": session_id}, session_id=session_id)
+    except Exception:
+        return json_response({"reply": "My chat system is experiencing issues."}, 500)
+
+
+def respond_to_chat(user_input, session_id):
+    session_id, session = core.chat_sessions.get(session_id)
+    return session_id, core.chatbot.get_response(user_input, session)
+
+
+async def stats(request):
+    return json_response({
+        "admission": request.app["admission"].snapshot(),
+        "upload_buffer": request.app["upload_budget"].snapshot(),
+        "batching": core.batcher.stats.snapshot(),
+        "uploads": core.upload_store.snapshot() if core.upload_store is not None else None,
+        "cache": core.prediction_cache.snapshot() if core.prediction_cache is not None else None,
+        "chat_sessions": len(core.chat_sessions)
+    })
+
+
+async def prometheus_metrics(request):
+    return web.Response(body=metrics.REGISTRY.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def request_trace(request):
+    trace = metrics.find_trace(request.match_info["request_id"])
+    if trace is None:
+        return json_response({"error": "Unknown or expired request ID"}, 404)
+    return json_response(trace)
+
+
+@web.middleware
+async def tracing(request, handler):
+    """Tags every response with X-Request-ID and records a trace for API calls."""
+    request_id = metrics.new_request_id(request.headers.get("X-Request-ID"))
+    trace = None
+    if not request.path.startswith(UNTRACED_PATHS):
+        resource = request.match_info.route.resource
+        trace = request["trace"] = metrics.RequestTrace(
+            request_id, resource.canonical if resource is not None else "unmatched"
+        )
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        response = e
+    except asyncio.CancelledError:
+        # The client went away; 499 as in nginx, so the request is still counted
+        if trace is not None:
+            metrics.finish_request(trace, 499)
+        raise
+    except Exception:
+        # aiohttp turns it into a 500; record it as one before it propagates
+        if trace is not None:
+            metrics.finish_request(trace, 500)
+        raise
+    if trace is not None:
+        metrics.finish_request(trace, response.status)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@web.middleware
+async def cors(request, handler):
+    """Mirrors flask-cors defaults: any origin, preflight answered directly."""
+    if request.method == "OPTIONS":
+        response = web.Response()
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        requested = request.headers.get("Access-Control-Request-Headers")
+        if requested:
+            response.headers["Access-Control-Allow-Headers"] = requested
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Expose-Headers"] = "X-Session-ID, Retry-After"
+    return response
+
+
+def create_app(workers=Config.ASYNC_INFERENCE_WORKERS, max_pending=Config.ASYNC_MAX_PENDING,
+               max_upload_buffer=Config.ASYNC_MAX_UPLOAD_BUFFER_BYTES):
+    # Streaming multipart reads are bounded per part and by the shared upload budget,
+    # not by client_max_size
+    application = web.Application(middlewares=[cors, tracing])
+    application["admission"] = Admission(max_pending, workers)
+    application["upload_budget"] = UploadBudget(max_upload_buffer)
+    application["executor"] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+
+    async def shutdown(application):
+        application["executor"].shutdown(wait=False, cancel_futures=True)
+
+    application.on_shutdown.append(shutdown)
+    application.router.add_post("/api/predict", predict)
+    application.router.add_post("/api/chat", chat)
+    application.router.add_get("/api/stats", stats)
+    application.router.add_get("/metrics", prometheus_metrics)
+    application.router.add_get("/api/trace/{request_id}", request_trace)
+    return application
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the betel leaf API on an asyncio front-end.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=Config.ASYNC_INFERENCE_WORKERS,
+                        help="Inference threads (keep >= batch size so the batcher can fill batches)")
+    parser.add_argument("--max-pending", type=int, default=Config.ASYNC_MAX_PENDING,
+                        help="Admitted predictions beyond which requests get 429")
+    args = parser.parse_args(argv)
+
+    # Chat is served immediately; predictions return 503 + Retry-After until the model is ready
+    core.start_background_load()
+    web.run_app(create_app(args.workers, args.max_pending), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
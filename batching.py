@@ -0,0 +1,164 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+
+class BatchStats:
+    """Thread-safe counters for queue depth and the batch-size histogram."""
+
+    def __init__(self, max_batch_size: int):
+        self._lock = threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.batch_size_histogram = [0] * (max_batch_size + 1)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.total_batches = 0
+        self.total_items = 0
+        self.total_wait_ms = 0.0
+        self.total_forward_ms = 0.0
+
+    def on_enqueue(self):
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def on_batch(self, size: int, wait_ms: float, forward_ms: float):
+        with self._lock:
+            self.queue_depth -= size
+            self.batch_size_histogram[size] += 1
+            self.total_batches += 1
+            self.total_items += size
+            self.total_wait_ms += wait_ms
+            self.total_forward_ms += forward_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = self.total_batches or 1
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "total_batches": self.total_batches,
+                "total_items": self.total_items,
+                "mean_batch_size": round(self.total_items / batches, 3),
+                "mean_batch_wait_ms": round(self.total_wait_ms / batches, 3),
+                "mean_forward_ms": round(self.total_forward_ms / batches, 3),
+                "batch_size_histogram": {
+                    str(size): count
+                    for size, count in enumerate(self.batch_size_histogram)
+                    if size and count
+                },
+            }
+
+
+class MicroBatcher:
+    """
+    Collects concurrent inference requests into a single forward pass.
+
+    Callers `submit()` one item each and block on the returned future. A single
+    worker thread waits for the first item, keeps collecting for at most
+    `max_wait_ms` (or until `max_batch_size` items are queued), then calls
+    `forward_fn(items)` once and hands result `i` back to caller `i`.
+    """
+
+    def __init__(self, forward_fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchStats(max_batch_size)
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        # The worker thread is started lazily, and restarted after fork(), so a
+        # batcher created at import time still works in pre-forked servers.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self.stats = BatchStats(self.max_batch_size)
+            self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, item: Any) -> Future:
+        """Queues one item and returns a future resolving to its own result."""
+        self._ensure_started()
+        future = Future()
+        self.stats.on_enqueue()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def submit_many(self, items: Sequence[Any]) -> List[Future]:
+        """
+        Queues several items back to back, so (up to `max_batch_size`) they
+        land in the same forward pass; e.g. the augmented views of one image.
+        """
+        return [self.submit(item) for item in items]
+
+    def infer(self, item: Any, timeout: float = None) -> Any:
+        """Blocking convenience wrapper around `submit()`."""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                # A bad batch must not kill the worker: fail its unresolved futures and go on
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _dispatch(self, batch):
+        items = [item for item, _, _ in batch]
+        started = time.perf_counter()
+        wait_ms = (started - batch[0][2]) * 1000
+
+        try:
+            outputs = self.forward_fn(items)
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"forward_fn returned {len(outputs)} outputs for {len(batch)} items")
+            error = None
+        except Exception as e:
+            outputs, error = None, e
+
+        forward_ms = (time.perf_counter() - started) * 1000
+        self.stats.on_batch(len(batch), wait_ms, forward_ms)
+
+        for i, (_, future, enqueued) in enumerate(batch):
+            # Per-request timing for tracing: time queued, and the shared forward pass
+            future.queue_ms = (started - enqueued) * 1000
+            future.forward_ms = forward_ms
+            if future.done():
+                # Cancelled by its caller
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(outputs[i])
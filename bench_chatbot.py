@@ -0,0 +1,59 @@
+"""
+Intent routing latency: compiled IntentMatcher vs. the per-intent substring
+scan it replaced. Routing parity is covered by tests/test_chatbot.py.
+
+    python bench_chatbot.py
+"""
+import itertools
+import random
+import timeit
+
+from chatbot import BetelLeafChatbot, IntentMatcher, INTENT_PRIORITY
+
+
+def legacy_intent(intents, user_message):
+    """The original routing: one substring scan per intent, in priority order."""
+    msg = user_message.lower().strip()
+    for intent in INTENT_PRIORITY:
+        if any(keyword in msg for keyword in intents.get(intent, [])):
+            return intent
+    return None
+
+
+def build_corpus(intents, samples=5000, seed=0):
+    """Keyword pairs plus random sentences mixing keywords and filler."""
+    rng = random.Random(seed)
+    keywords = [k for intent in INTENT_PRIORITY for k in intents[intent]]
+    filler = ["my", "betel", "vine", "leaves", "are", "yellow", "please", "the", "plant", "is",
+              "SOMETIMES", "Helpful?", "whatever", "soil", "  ", "🌿", "nitrogen", "rain"]
+
+    corpus = [f"{a} {b}" for a, b in itertools.permutations(keywords, 2)]
+    for _ in range(samples):
+        words = rng.sample(filler, rng.randint(1, 8)) + rng.sample(keywords, rng.randint(0, 2))
+        rng.shuffle(words)
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def time_routing(label, bot, corpus):
+    for name, fn in [("legacy", lambda: [legacy_intent(bot.intents, m) for m in corpus]),
+                     ("compiled", lambda: [bot.detect_intent(m) for m in corpus])]:
+        seconds = min(timeit.repeat(fn, number=3, repeat=3)) / 3
+        print(f"⏱️ {f'{name} ({label})':<26} {seconds * 1e6 / len(corpus):.2f} µs/message")
+
+
+if __name__ == "__main__":
+    bot = BetelLeafChatbot({})
+    corpus = build_corpus(bot.intents)
+    time_routing("current vocab", bot, corpus)
+
+    # Simulate a grown vocabulary (translations, new phrasings): 20 extra keywords per intent
+    rng = random.Random(1)
+    bot.intents = {intent: list(keywords) for intent, keywords in bot.intents.items()}
+    for intent in INTENT_PRIORITY:
+        bot.intents[intent] = bot.intents[intent] + [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+            for _ in range(20)
+        ]
+    bot.matcher = IntentMatcher(bot.intents, INTENT_PRIORITY)
+    time_routing("grown vocab", bot, corpus)
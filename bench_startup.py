@@ -0,0 +1,87 @@
+"""
+Startup-time report: cold-starts app.py in fresh interpreters under each
+loading mode and measures how long until chat answers, the model is ready and
+the first prediction returns.
+
+    python bench_startup.py --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROBE = r"""
+import io, json, os, sys, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+client = app.app.test_client()
+client.post("/api/chat", json={"message": "hello"})
+t_chat = time.perf_counter() - t0
+app.load_engine()
+t_ready = time.perf_counter() - t0
+image = sys.argv[1]
+if image:
+    with open(image, "rb") as f:
+        data = f.read()
+    client.post("/api/predict", data={"image": (io.BytesIO(data), os.path.basename(image))},
+                content_type="multipart/form-data")
+t_predict = time.perf_counter() - t0
+print(json.dumps({"import_app": t_import, "first_chat": t_chat, "model_ready": t_ready,
+                  "first_predict": t_predict, "app_timings": app.startup_timings}))
+"""
+
+MODES = [("eager", "0"), ("eager", "1"), ("background", "1"), ("lazy", "1")]
+
+
+def find_image(folder):
+    if os.path.isdir(folder):
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+                return os.path.join(folder, name)
+    return ""
+
+
+def run_once(mode, mmap, image):
+    env = dict(os.environ, MODEL_LOAD=mode, MMAP_WEIGHTS=mmap)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", PROBE, image], env=env, capture_output=True,
+                            text=True, check=True).stdout
+    wall = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_wall"] = wall
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start latency of app.py per loading mode.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per mode (median reported)")
+    parser.add_argument("--image", default=None, help="Image for the first prediction (default: first in uploads/)")
+    parser.add_argument("--out", default=os.path.join("runs", "startup_report.json"))
+    args = parser.parse_args(argv)
+
+    image = args.image or find_image("uploads")
+    metrics = ("import_app", "first_chat", "model_ready", "first_predict", "process_wall")
+    report = {}
+    print(f"{'mode':<18}" + "".join(f"{m:>15}" for m in metrics))
+    for mode, mmap in MODES:
+        runs = [run_once(mode, mmap, image) for _ in range(args.runs)]
+        label = f"{mode}{' +mmap' if mmap == '1' else ''}"
+        report[label] = {
+            "median_seconds": {m: round(statistics.median(r[m] for r in runs), 4) for m in metrics},
+            "app_timings": runs[-1]["app_timings"],
+        }
+        print(f"{label:<18}" + "".join(f"{report[label]['median_seconds'][m]:>14.3f}s" for m in metrics))
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs_per_mode": args.runs,
+                   "modes": report}, f, indent=2)
+    print(f"\n📄 Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Dataset
+
+import distributed
+import train_model
+from checkpoint import ResumableRandomSampler
+from training_stats import RunLog, peak_rss_mb
+
+
+class SyntheticImages(Dataset):
+    """Random normalized images: isolates model/optimizer cost from decoding."""
+
+    def __init__(self, length, num_classes, size=train_model.IMG_SIZE):
+        self.length = length
+        self.num_classes = num_classes
+        self.size = size
+        self.classes = [f"class_{i}" for i in range(num_classes)]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return torch.randn(3, self.size, self.size), index % self.num_classes
+
+
+def run_config(dataset, batch_size, threads, workers, batches, warmup):
+    torch.set_num_threads(threads)
+    train_loader, _ = train_model.build_loaders(dataset, dataset, batch_size, workers)
+    model = train_model.build_model(len(dataset.classes), pretrained=False)
+    optimizer = optim.Adam(model.classifier.parameters(), lr=train_model.LEARNING_RATE)
+    criterion = nn.CrossEntropyLoss()
+
+    if warmup:
+        train_model.train_one_epoch(model, train_loader, criterion, optimizer, max_batches=warmup)
+    _, _, stats = train_model.train_one_epoch(model, train_loader, criterion, optimizer, max_batches=batches)
+    return stats
+
+
+# ======================================================
+# DATA-PARALLEL SCALING (torchrun)
+# ======================================================
+def run_scaling_child(args):
+    """One torchrun process: trains synthetic batches under DDP; rank 0 prints the global throughput."""
+    dist = distributed.init(args.dist_backend)
+    batch_size = args.batch_sizes[0]
+    dataset = SyntheticImages(batch_size * (args.batches + args.warmup) * dist.world_size, num_classes=4)
+    sampler = ResumableRandomSampler(dataset, num_replicas=dist.world_size, rank=dist.rank)
+    train_loader, _ = train_model.build_loaders(dataset, dataset, batch_size, args.workers[0], sampler)
+    model = train_model.build_model(len(dataset.classes), pretrained=False)
+    target = distributed.wrap_model(model)
+    optimizer = optim.Adam(model.classifier.parameters(), lr=train_model.LEARNING_RATE)
+    criterion = nn.CrossEntropyLoss()
+
+    if args.warmup:
+        train_model.train_one_epoch(target, train_loader, criterion, optimizer, max_batches=args.warmup)
+    _, _, stats = train_model.train_one_epoch(target, train_loader, criterion, optimizer,
+                                              max_batches=args.batches)
+    images, seconds = distributed.all_reduce_sum(stats["images"], stats["seconds"])
+    if dist.is_main:
+        mean_seconds = seconds / dist.world_size
+        print(json.dumps({"processes": dist.world_size, "threads_per_process": torch.get_num_threads(),
+                          "images": int(images), "seconds": round(mean_seconds, 3),
+                          "images_per_sec": round(images / mean_seconds, 2),
+                          "stage_seconds": stats["stage_seconds"]}))
+    distributed.shutdown()
+
+
+def run_scaling(args):
+    """Launches the synthetic benchmark under torchrun with 1, 2, 4, ... processes on this machine."""
+    log = RunLog(args.out)
+    results = []
+    for processes in args.processes:
+        command = [sys.executable, "-m", "torch.distributed.run", "--standalone",
+                   f"--nproc-per-node={processes}", os.path.abspath(__file__), "--scaling-child",
+                   "--batch-sizes", str(args.batch_sizes[0]), "--workers", str(args.workers[0]),
+                   "--batches", str(args.batches), "--warmup", str(args.warmup),
+                   "--dist-backend", args.dist_backend]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        record = json.loads(output.strip().splitlines()[-1])
+        baseline = results[0]["images_per_sec"] if results else record["images_per_sec"]
+        record.update(data="synthetic", batch_size=args.batch_sizes[0],
+                      speedup=round(record["images_per_sec"] / baseline, 3))
+        record["efficiency"] = round(record["speedup"] / processes * args.processes[0], 3)
+        log.write(record)
+        results.append(record)
+        print(f"⏱️ processes={processes:<3} threads/proc={record['threads_per_process']:<3} "
+              f"{record['images_per_sec']:>9.1f} img/s  speedup x{record['speedup']:.2f}  "
+              f"efficiency {record['efficiency']:.0%}")
+    print(f"📄 Results appended to {args.out}.jsonl / .csv")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark training throughput across configurations.")
+    parser.add_argument("--data", choices=["synthetic", "images", "shards"], default="synthetic")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, train_model.DEFAULT_WORKERS])
+    parser.add_argument("--batches", type=int, default=10, help="Timed batches per configuration")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed warm-up batches")
+    parser.add_argument("--out", default=os.path.join("runs", "bench_training"))
+    parser.add_argument("--processes", type=int, nargs="+", default=None,
+                        help="Data-parallel scaling run with these process counts, e.g. 1 2 4 8 "
+                             "(uses the first --batch-sizes/--workers value, per process)")
+    parser.add_argument("--dist-backend", default="gloo")
+    parser.add_argument("--scaling-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scaling_child:
+        return run_scaling_child(args)
+    if args.processes:
+        return run_scaling(args)
+
+    if args.data == "synthetic":
+        dataset = SyntheticImages(max(args.batch_sizes) * (args.batches + args.warmup), num_classes=4)
+    else:
+        dataset, _ = train_model.build_datasets(train_model.SHARD_DIR if args.data == "shards" else None)
+
+    log = RunLog(args.out)
+    results = []
+    for batch_size, threads, workers in itertools.product(args.batch_sizes, args.threads, sorted(set(args.workers))):
+        stats = run_config(dataset, batch_size, threads, workers, args.batches, args.warmup)
+        record = {
+            "data": args.data,
+            "batch_size": batch_size,
+            "threads": threads,
+            "workers": workers,
+            "device": str(train_model.DEVICE),
+            "peak_rss_mb": peak_rss_mb(),
+            **stats,
+        }
+        log.write(record)
+        results.append(record)
+        print(f"⏱️ bs={batch_size:<4} threads={threads:<3} workers={workers:<3} "
+              f"{train_model.format_timing(stats)}")
+
+    best = max(results, key=lambda r: r["images_per_sec"])
+    print(f"\n🏆 Best: bs={best['batch_size']} threads={best['threads']} workers={best['workers']} "
+          f"-> {best['images_per_sec']} img/s")
+    print(f"📄 Results appended to {args.out}.jsonl / .csv")
+    print(json.dumps(best["stage_seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+MAX_ARCHIVE_MEMBER_BYTES = 32 * 1024 * 1024
+
+
+def _is_image(name):
+    return '.' in name and name.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+# ======================================================
+# SOURCES: (name, path-or-bytes, true label or None)
+# ======================================================
+def iter_directory(root):
+    """
+    Walks a folder of images. In an ImageFolder layout (root/<class>/img.jpg,
+    like dataset/train or dataset/val) the parent folder is used as true label.
+    """
+    root = os.path.abspath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        label = os.path.basename(dirpath) if dirpath != root else None
+        for filename in sorted(filenames):
+            if _is_image(filename):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root), path, label
+
+
+def iter_zip(fileobj):
+    """Yields images from a zip archive (path or file object, closed when done); folder names act as labels."""
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not _is_image(info.filename):
+                continue
+            if info.file_size > MAX_ARCHIVE_MEMBER_BYTES:
+                yield info.filename, None, None
+                continue
+            parent = os.path.basename(os.path.dirname(info.filename)) or None
+            yield info.filename, archive.read(info), parent
+    if hasattr(fileobj, "close"):
+        fileobj.close()
+
+
+def iter_uploads(files):
+    """Yields Flask/werkzeug FileStorage uploads as raw bytes."""
+    for file in files:
+        if file.filename and _is_image(file.filename):
+            yield file.filename, file.read(), None
+
+
+# ======================================================
+# STREAMING PREDICTION
+# ======================================================
+def predict_stream(sources, predict_fn, workers=4, top_k=3):
+    """
+    Scores sources with a pool of decode workers and yields one dict per image,
+    followed by a final {"summary": ...} record.
+
+    `predict_fn(source, top_k)` is app.run_inference: workers decode in
+    parallel and their forward passes are grouped by the micro-batcher. At most
+    `workers * 4` images are in flight, so memory stays bounded for large folders.
+    """
+    class_counts = Counter()
+    severity_counts = Counter()
+    labelled = correct = errors = total = 0
+
+    def score(name, source, label):
+        if source is None:
+            return {"file": name, "error": "File too large"}
+        try:
+            predictions, severity, model_version, _ = predict_fn(source, top_k)
+        except Exception as e:
+            return {"file": name, "error": str(e)}
+        record = {"file": name, "top_predictions": predictions, "severity": severity,
+                  "model_version": model_version}
+        if label is not None:
+            record["label"] = label
+        return record
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-decode") as pool:
+        pending = deque()
+        sources = iter(sources)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < workers * 4:
+                try:
+                    pending.append(pool.submit(score, *next(sources)))
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                break
+
+            record = pending.popleft().result()
+            total += 1
+            if "error" in record:
+                errors += 1
+            else:
+                predicted = record["top_predictions"][0]["label"]
+                class_counts[predicted] += 1
+                severity_counts[record["severity"]] += 1
+                if "label" in record:
+                    labelled += 1
+                    correct += predicted == record["label"]
+            yield record
+
+    summary = {
+        "total": total,
+        "errors": errors,
+        "per_class": dict(class_counts),
+        "per_severity": dict(severity_counts),
+    }
+    if labelled:
+        summary["labelled"] = labelled
+        summary["accuracy"] = round(100 * correct / labelled, 2)
+    yield {"summary": summary}
+
+
+def to_ndjson(records):
+    for record in records:
+        yield json.dumps(record) + "\n"
+
+
+# ======================================================
+# CLI: python bulk_predict.py dataset/val --out results.ndjson
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a folder or zip of betel leaf images.")
+    parser.add_argument("path", help="Image folder (ImageFolder layout supported) or .zip archive")
+    parser.add_argument("--out", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=4, help="Decode worker threads")
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    from app import run_inference, load_engine
+
+    if load_engine() is None:
+        sys.exit("❌ Model is not available.")
+
+    if zipfile.is_zipfile(args.path):
+        sources = iter_zip(args.path)
+    else:
+        sources = iter_directory(args.path)
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for line in to_ndjson(predict_stream(sources, run_inference, args.workers, args.top_k)):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
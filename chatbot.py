@@ -1,6 +1,250 @@
+from collections import OrderedDict
 from datetime import datetime
-from typing import Optional, Dict, List, Union
+from typing import Optional, Dict, List, Tuple, Union
 import random
+import re
+import secrets
+import threading
+import time
+
+# Order in which intents win when a message matches several of them
+INTENT_PRIORITY = [
+    "greeting", "bot_info", "capabilities", "farming_general", "irrigation",
+    "fertilizer", "harvest", "treatment", "prevention", "time", "thanks"
+]
+
+
+class IntentMatcher:
+    """
+    Finds every intent's keywords in a single pass over the message.
+
+    All keywords are compiled into one trie-shaped regex inside a zero-width
+    lookahead, so `finditer` tries each start position once (overlapping
+    keywords are found, exactly like `keyword in msg`) and reports the longest
+    keyword starting there. Any shorter keyword matching at the same position
+    is a prefix of that one, so each keyword is precomputed to the intents of
+    all its prefix keywords.
+    """
+
+    def __init__(self, intents: Dict[str, List[str]], priority: List[str]):
+        self.priority = priority
+        keyword_intents: Dict[str, set] = {}
+        for rank, intent in enumerate(priority):
+            for keyword in intents.get(intent, []):
+                if keyword:
+                    keyword_intents.setdefault(keyword, set()).add(rank)
+
+        # keyword -> ranks of every intent matched when this keyword is the longest hit
+        self._ranks = {
+            keyword: frozenset().union(*(r for k, r in keyword_intents.items() if keyword.startswith(k)))
+            for keyword in keyword_intents
+        }
+        self._best_rank = {keyword: min(ranks) for keyword, ranks in self._ranks.items()}
+        self._pattern = re.compile(f"(?=({self._trie_pattern(keyword_intents)}))") if keyword_intents else None
+
+    @staticmethod
+    def _trie_pattern(words) -> str:
+        trie: Dict = {}
+        for word in words:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        def build(node) -> str:
+            branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return ""
+            body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            # Greedy optional group: prefer the longer keyword, fall back to this one
+            return f"(?:{body})?" if "" in node else body
+
+        return build(trie)
+
+    def matches(self, msg: str) -> List[str]:
+        """All intents with at least one keyword in `msg`, in priority order."""
+        if self._pattern is None:
+            return []
+        ranks = set()
+        for m in self._pattern.finditer(msg):
+            ranks |= self._ranks[m.group(1)]
+        return [self.priority[r] for r in sorted(ranks)]
+
+    def best(self, msg: str) -> Optional[str]:
+        """Highest-priority matching intent, or None."""
+        if self._pattern is None:
+            return None
+        best_rank = len(self.priority)
+        for m in self._pattern.finditer(msg):
+            rank = self._best_rank[m.group(1)]
+            if rank < best_rank:
+                best_rank = rank
+                if rank == 0:
+                    break
+        return self.priority[best_rank] if best_rank < len(self.priority) else None
+
+
+# Comprehensive Knowledge Base
+KNOWLEDGE_BASE = {
+    "Healthy": {
+        "cause": "Optimal soil nutrition and balanced environment.",
+        "advice": "Maintain current care. Use organic mulch to retain soil moisture.",
+        "severity": "Low",
+        "organic": "Apply Vermicompost every 90 days."
+    },
+    "Leaf_Spot": {
+        "cause": "Cercospora fungal pathogen, usually from high humidity.",
+        "advice": "Remove infected leaves. Improve spacing for better airflow.",
+        "severity": "Moderate",
+        "organic": "Spray 5% Neem Seed Kernel Extract (NSKE)."
+    },
+    "Leaf_Rot": {
+        "cause": "Phytophthora parasitica; thrives in waterlogged soil.",
+        "advice": "Drench soil with 1% Bordeaux mixture. Stop irrigation immediately.",
+        "severity": "High",
+        "organic": "Apply Trichoderma viride mixed with well-rotted manure."
+    },
+    "Bacterial_Disease": {
+        "cause": "Xanthomonas campestris bacteria.",
+        "advice": "Spray Streptocycline (0.5g/L) mixed with Copper Oxychloride.",
+        "severity": "Critical",
+        "organic": "Remove and burn infected vines; avoid harvesting in rain."
+    },
+    "Bacterial_Blight": {
+        "cause": "Bacterial infection spreading via water droplets.",
+        "advice": "Prune affected parts. Avoid high-nitrogen fertilizers.",
+        "severity": "Critical",
+        "organic": "Spray Garlic-Chilli extract as a preventive measure."
+    }
+}
+
+# Intent Mapping
+INTENTS = {
+    "greeting": ["hi", "hello", "hey", "namaste", "salam", "morning", "evening", "start"],
+    "bot_info": ["who are you", "what is your name", "identify yourself", "tell me about you"],
+    "capabilities": ["what can you do", "features", "how to use", "help", "guide"],
+    "farming_general": ["how to grow", "soil type", "climate", "temperature", "sunlight"],
+    "irrigation": ["water", "watering", "irrigation", "how much water"],
+    "harvest": ["harvest", "picking", "collecting", "ready to pick"],
+    "treatment": ["treat", "medicine", "cure", "fix", "remedy", "solution", "what to do"],
+    "prevention": ["prevent", "avoid", "protect", "stop disease"],
+    "fertilizer": ["fertilizer", "manure", "feeding", "nutrition", "npk", "growth boost"],
+    "thanks": ["thank", "helpful", "great", "appreciate", "good job"],
+    "time": ["time", "date", "today"]
+}
+
+# Compiled once: one regex scan per message instead of a substring scan per intent
+INTENT_MATCHER = IntentMatcher(INTENTS, INTENT_PRIORITY)
+
+
+class ChatSession:
+    """Per-user diagnosis context; __slots__ keeps thousands of sessions cheap."""
+    __slots__ = ("last_prediction", "last_confidence", "last_seen")
+
+    def __init__(self):
+        self.last_prediction: Optional[str] = None
+        self.last_confidence: Optional[float] = None
+        self.last_seen = time.monotonic()
+
+
+class SessionStore:
+    """
+    Thread-safe session map with TTL expiry and an LRU memory cap.
+
+    The lock only guards the dictionary lookup, so concurrent users never
+    wait on each other's chat or prediction handling.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_sessions: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        return secrets.token_urlsafe(16)
+
+    def get(self, session_id: Optional[str]) -> Tuple[str, ChatSession]:
+        """Returns (session_id, session), creating a fresh session for unknown or expired IDs."""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and now - session.last_seen > self.ttl_seconds:
+                del self._sessions[session_id]
+                session = None
+            if session is None:
+                session_id = session_id if session_id and len(session_id) <= 64 else self.new_id()
+                session = ChatSession()
+                self._sessions[session_id] = session
+                self._evict(now)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_seen = now
+            return session_id, session
+
+    def _evict(self, now: float):
+        # Oldest entries sit at the front: drop expired ones, then enforce the cap
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.ttl_seconds:
+                del self._sessions[oldest_id]
+            else:
+                break
+
+    def save(self, session_id: str, session: ChatSession):
+        """Persists changes to a session (sessions held in-process are live objects)."""
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SharedSessionStore(SessionStore):
+    """
+    SessionStore backed by a `multiprocessing.Manager().dict()`, so pre-forked
+    server workers see the same chat context whichever worker gets the request.
+
+    Only (label, confidence, last_seen) tuples cross the process boundary;
+    callers must `save()` after updating a session.
+    """
+
+    SWEEP_EVERY = 256
+
+    def __init__(self, shared_dict, ttl_seconds: float = 3600, max_sessions: int = 10000):
+        super().__init__(ttl_seconds, max_sessions)
+        self._shared = shared_dict
+        self._writes = 0
+
+    def get(self, session_id: Optional[str]) -> Tuple[str, ChatSession]:
+        now = time.monotonic()
+        record = self._shared.get(session_id) if session_id else None
+        session = ChatSession()
+        if record is not None and now - record[2] <= self.ttl_seconds:
+            session.last_prediction, session.last_confidence = record[0], record[1]
+        elif not session_id or len(session_id) > 64:
+            session_id = self.new_id()
+        session.last_seen = now
+        self.save(session_id, session)
+        return session_id, session
+
+    def save(self, session_id: str, session: ChatSession):
+        self._shared[session_id] = (session.last_prediction, session.last_confidence, session.last_seen)
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self._sweep()
+
+    def _sweep(self):
+        now = time.monotonic()
+        records = sorted(self._shared.items(), key=lambda item: item[1][2])
+        overflow = len(records) - self.max_sessions
+        for i, (session_id, record) in enumerate(records):
+            if i >= overflow and now - record[2] <= self.ttl_seconds:
+                break
+            self._shared.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._shared)
+
 
 class BetelLeafChatbot:
     """
@@ -10,83 +254,44 @@ class BetelLeafChatbot:
 
     def __init__(self, classes: Dict[int, str]):
         self.classes = classes
-        self.last_prediction: Optional[str] = None
-        self.last_confidence: Optional[float] = None
-        
-        # Comprehensive Knowledge Base
-        self.knowledge_base = {
-            "Healthy": {
-                "cause": "Optimal soil nutrition and balanced environment.",
-                "advice": "Maintain current care. Use organic mulch to retain soil moisture.",
-                "severity": "Low",
-                "organic": "Apply Vermicompost every 90 days."
-            },
-            "Leaf_Spot": {
-                "cause": "Cercospora fungal pathogen, usually from high humidity.",
-                "advice": "Remove infected leaves. Improve spacing for better airflow.",
-                "severity": "Moderate",
-                "organic": "Spray 5% Neem Seed Kernel Extract (NSKE)."
-            },
-            "Leaf_Rot": {
-                "cause": "Phytophthora parasitica; thrives in waterlogged soil.",
-                "advice": "Drench soil with 1% Bordeaux mixture. Stop irrigation immediately.",
-                "severity": "High",
-                "organic": "Apply Trichoderma viride mixed with well-rotted manure."
-            },
-            "Bacterial_Disease": {
-                "cause": "Xanthomonas campestris bacteria.",
-                "advice": "Spray Streptocycline (0.5g/L) mixed with Copper Oxychloride.",
-                "severity": "Critical",
-                "organic": "Remove and burn infected vines; avoid harvesting in rain."
-            },
-            "Bacterial_Blight": {
-                "cause": "Bacterial infection spreading via water droplets.",
-                "advice": "Prune affected parts. Avoid high-nitrogen fertilizers.",
-                "severity": "Critical",
-                "organic": "Spray Garlic-Chilli extract as a preventive measure."
-            }
-        }
+        # Shared, read-only data built once at import (not per bot instance)
+        self.knowledge_base = KNOWLEDGE_BASE
+        self.intents = INTENTS
+        self.matcher = INTENT_MATCHER
+        # Used when callers do not pass a per-user session
+        self.default_session = ChatSession()
 
-        # Intent Mapping
-        self.intents = {
-            "greeting": ["hi", "hello", "hey", "namaste", "salam", "morning", "evening", "start"],
-            "bot_info": ["who are you", "what is your name", "identify yourself", "tell me about you"],
-            "capabilities": ["what can you do", "features", "how to use", "help", "guide"],
-            "farming_general": ["how to grow", "soil type", "climate", "temperature", "sunlight"],
-            "irrigation": ["water", "watering", "irrigation", "how much water"],
-            "harvest": ["harvest", "picking", "collecting", "ready to pick"],
-            "treatment": ["treat", "medicine", "cure", "fix", "remedy", "solution", "what to do"],
-            "prevention": ["prevent", "avoid", "protect", "stop disease"],
-            "fertilizer": ["fertilizer", "manure", "feeding", "nutrition", "npk", "growth boost"],
-            "thanks": ["thank", "helpful", "great", "appreciate", "good job"],
-            "time": ["time", "date", "today"]
+        self._handlers = {
+            "greeting": self._handle_greeting,
+            "bot_info": self._handle_bot_info,
+            "capabilities": self._handle_capabilities,
+            "farming_general": self._handle_farming_general,
+            "irrigation": self._handle_irrigation,
+            "fertilizer": self._handle_fertilizer,
+            "harvest": self._handle_harvest,
+            "prevention": self._handle_prevention,
+            "time": self._handle_time,
+            "thanks": self._handle_thanks,
         }
 
-    def update_prediction(self, label: str, confidence: float):
-        """Syncs the chatbot with the latest vision model results."""
-        self.last_prediction = label
-        self.last_confidence = round(confidence, 2)
+    def update_prediction(self, label: str, confidence: float, session: Optional[ChatSession] = None):
+        """Syncs the user's session with the latest vision model results."""
+        session = session or self.default_session
+        session.last_prediction = label
+        session.last_confidence = round(confidence, 2)
 
-    def get_response(self, user_message: str) -> str:
+    def get_response(self, user_message: str, session: Optional[ChatSession] = None) -> str:
         """Processes input and routes to the correct handler."""
-        msg = user_message.lower().strip()
+        intent = self.detect_intent(user_message)
+        if intent is None:
+            return self._handle_fallback()
+        if intent == "treatment":
+            return self._handle_treatment(session or self.default_session)
+        return self._handlers[intent]()
 
-        if self._match("greeting", msg): return self._handle_greeting()
-        if self._match("bot_info", msg): return self._handle_bot_info()
-        if self._match("capabilities", msg): return self._handle_capabilities()
-        if self._match("farming_general", msg): return self._handle_farming_general()
-        if self._match("irrigation", msg): return self._handle_irrigation()
-        if self._match("fertilizer", msg): return self._handle_fertilizer()
-        if self._match("harvest", msg): return self._handle_harvest()
-        if self._match("treatment", msg): return self._handle_treatment()
-        if self._match("prevention", msg): return self._handle_prevention()
-        if self._match("time", msg): return self._handle_time()
-        if self._match("thanks", msg): return "You're very welcome! I'm here whenever your vines need me. Happy farming! 🌿"
-
-        return self._handle_fallback()
-
-    def _match(self, intent: str, msg: str) -> bool:
-        return any(keyword in msg for keyword in self.intents.get(intent, []))
+    def detect_intent(self, user_message: str) -> Optional[str]:
+        """Returns the highest-priority intent found in the message, or None."""
+        return self.matcher.best(user_message.lower().strip())
 
     def _handle_greeting(self) -> str:
         options = [
@@ -144,21 +349,21 @@ class BetelLeafChatbot:
             "• Use a sterilized knife or 'Nakh' (thumb-cutter) to avoid pulling the vine."
         )
 
-    def _handle_treatment(self) -> str:
-        if not self.last_prediction:
+    def _handle_treatment(self, session: ChatSession) -> str:
+        if not session.last_prediction:
             return "📸 **Context Required:** Please upload a photo of the leaf first so I can see what we are treating."
 
-        info = self.knowledge_base.get(self.last_prediction)
+        info = self.knowledge_base.get(session.last_prediction)
         if not info:
-            return f"I see {self.last_prediction.replace('_', ' ')}, but I'm still learning the treatment for it. Try checking airflow."
+            return f"I see {session.last_prediction.replace('_', ' ')}, but I'm still learning the treatment for it. Try checking airflow."
 
         severity_icon = {"Low": "🟢", "Moderate": "🟡", "High": "🟠", "Critical": "🔴"}.get(info['severity'], "⚪")
         return (
             f"📋 **Diagnosis Summary**\n"
             f"━━━━━━━━━━━━━━━\n"
-            f"🔍 **Issue:** {self.last_prediction.replace('_', ' ')}\n"
+            f"🔍 **Issue:** {session.last_prediction.replace('_', ' ')}\n"
             f"⚠️ **Severity:** {severity_icon} {info['severity']}\n"
-            f"🎯 **Confidence:** {self.last_confidence}%\n\n"
+            f"🎯 **Confidence:** {session.last_confidence}%\n\n"
             f"🧬 **Cause:** {info['cause']}\n"
             f"🛠️ **Action:** {info['advice']}\n"
             f"🌿 **Organic Fix:** {info['organic']}\n"
@@ -174,6 +379,9 @@ class BetelLeafChatbot:
             "4. Apply Trichoderma to the soil before the monsoon starts."
         )
 
+    def _handle_thanks(self) -> str:
+        return "You're very welcome! I'm here whenever your vines need me. Happy farming! 🌿"
+
     def _handle_time(self) -> str:
         return f"📅 {datetime.now().strftime('%A, %d %B %Y | %I:%M %p')}"
 
@@ -0,0 +1,118 @@
+import os
+import random
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+# ======================================================
+# ATOMIC CHECKPOINT I/O
+# ======================================================
+def save_checkpoint(path, state):
+    """Writes to a temp file in the same directory, fsyncs, then renames over `path`."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, map_location="cpu"):
+    # Checkpoints hold optimizer state and RNG states, not just tensors
+    return torch.load(path, map_location=map_location, weights_only=False)
+
+
+# ======================================================
+# RNG STATE
+# ======================================================
+def capture_rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+# ======================================================
+# RESUMABLE SHUFFLING & EARLY STOPPING
+# ======================================================
+class ResumableRandomSampler(Sampler):
+    """
+    Shuffles with a permutation derived from (seed, epoch) only, so a run
+    resumed mid-epoch sees the same order and can skip the samples it has
+    already trained on instead of re-reading them.
+
+    With `num_replicas` > 1 it shards like DistributedSampler: every rank
+    draws the same permutation, padded to a multiple of `num_replicas`, and
+    takes every num_replicas-th index starting at its rank. `start` then
+    counts samples of this rank's shard.
+    """
+
+    def __init__(self, data_source, seed=0, num_replicas=1, rank=0):
+        self.data_source = data_source
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def _shard_size(self):
+        return -(-len(self.data_source) // self.num_replicas)
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator).tolist()
+        if self.num_replicas > 1:
+            total = self._shard_size() * self.num_replicas
+            order = (order * -(-total // len(order)))[:total]
+            order = order[self.rank::self.num_replicas]
+        return iter(order[self.start:])
+
+    def __len__(self):
+        return self._shard_size() - self.start
+
+
+class EarlyStopping:
+    """Stops when validation loss has not improved by `min_delta` for `patience` epochs."""
+
+    def __init__(self, patience=5, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_loss = float("inf")
+        self.bad_epochs = 0
+
+    def step(self, val_loss):
+        """Records an epoch's validation loss; returns True when training should stop."""
+        if val_loss < self.best_loss - self.min_delta:
+            self.best_loss = val_loss
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {"best_loss": self.best_loss, "bad_epochs": self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best_loss = state["best_loss"]
+        self.bad_epochs = state["bad_epochs"]
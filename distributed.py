@@ -0,0 +1,109 @@
+"""
+Multi-process data-parallel training helpers (torch.distributed).
+
+train_model.py runs in this mode when launched through torchrun, e.g. on one
+machine with 8 processes, or across two machines:
+
+    torchrun --standalone --nproc-per-node 8 train_model.py --workers 1
+    torchrun --nnodes 2 --node-rank 0 --nproc-per-node 8 \\
+             --rdzv-backend c10d --rdzv-endpoint host0:29500 train_model.py
+
+Without torchrun's environment everything here is a no-op, so single-process
+training is unchanged.
+"""
+import os
+
+import torch
+import torch.distributed as dist
+
+
+class DistContext:
+    """Rank/world info for this process; world_size 1 when not distributed."""
+
+    def __init__(self, rank=0, world_size=1, local_rank=0, local_world_size=1):
+        self.rank = rank
+        self.world_size = world_size
+        self.local_rank = local_rank
+        self.local_world_size = local_world_size
+
+    @property
+    def enabled(self):
+        return self.world_size > 1
+
+    @property
+    def is_main(self):
+        return self.rank == 0
+
+
+_context = DistContext()
+
+
+def context():
+    return _context
+
+
+def is_main():
+    """True on rank 0 (and in single-process runs): the only rank that writes files."""
+    return _context.is_main
+
+
+def init(backend="gloo"):
+    """
+    Joins the process group described by torchrun's environment variables.
+    Each local process gets an equal share of the machine's cores so N
+    processes do not oversubscribe the CPU with N full-size thread pools.
+    """
+    global _context
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size <= 1:
+        return _context
+
+    dist.init_process_group(backend=backend)
+    _context = DistContext(
+        rank=dist.get_rank(),
+        world_size=world_size,
+        local_rank=int(os.environ.get("LOCAL_RANK", "0")),
+        local_world_size=int(os.environ.get("LOCAL_WORLD_SIZE", "1")),
+    )
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // _context.local_world_size))
+    if _context.is_main:
+        print(f"🌐 Distributed training: {world_size} processes ({backend}), "
+              f"{torch.get_num_threads()} threads each")
+    return _context
+
+
+def shutdown():
+    if dist.is_available() and dist.is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+def all_reduce_sum(*values):
+    """Sums scalars across ranks (returns them unchanged when not distributed)."""
+    if not _context.enabled:
+        return values
+    tensor = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tuple(tensor.tolist())
+
+
+def gather_object(obj):
+    """Every rank's picklable `obj`, indexed by rank, on all ranks ([obj] when not distributed)."""
+    if not _context.enabled:
+        return [obj]
+    objects = [None] * _context.world_size
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+def wrap_model(model):
+    """DistributedDataParallel wrapper (gradient all-reduce); the model itself when not distributed."""
+    if not _context.enabled:
+        return model
+    from torch.nn.parallel import DistributedDataParallel
+    return DistributedDataParallel(model)
+
+
+def shard_indices(length):
+    """This rank's strided share of range(length), without padding (for exact eval metrics)."""
+    return list(range(_context.rank, length, _context.world_size))
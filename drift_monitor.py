@@ -0,0 +1,254 @@
+"""
+Streaming prediction drift monitor.
+
+Every prediction adds one (class, confidence bin, entropy bin) triple to a
+fixed-size ring buffer; running histograms are updated for the new entry and
+the one it evicts, so each observation is O(1) and memory is constant. No
+images or raw probabilities are kept.
+
+The window is compared against a reference profile of the val split with the
+population stability index (PSI) on three signals:
+
+    class       predicted class frequencies
+    entropy     normalized softmax entropy histogram
+    confidence  top-1 confidence histogram, per predicted class
+
+    python drift_monitor.py reference --data dataset/val   # writes drift_reference.json
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+REFERENCE_PATH = "drift_reference.json"
+CONFIDENCE_BINS = 10
+ENTROPY_BINS = 10
+# Conventional PSI bands: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant
+PSI_WARNING = 0.1
+PSI_DRIFT = 0.25
+STATUS_LEVELS = {"insufficient_data": -1, "ok": 0, "warning": 1, "drift": 2}
+
+
+def psi(expected, actual, eps=1e-4):
+    """Population stability index between two count (or frequency) vectors."""
+    p = np.asarray(expected, dtype=np.float64)
+    q = np.asarray(actual, dtype=np.float64)
+    p = np.clip(p / max(p.sum(), 1e-12), eps, None)
+    q = np.clip(q / max(q.sum(), 1e-12), eps, None)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+class DriftWindow:
+    """Sliding-window class / confidence / entropy histograms over the last `size` predictions."""
+
+    def __init__(self, num_classes, size=1000):
+        self.num_classes = num_classes
+        self.size = size
+        self._log_classes = math.log(num_classes) if num_classes > 1 else 1.0
+        self._ring = np.zeros((size, 3), dtype=np.int16)
+        self._entropies = np.zeros(size, dtype=np.float64)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._next = 0
+            self.count = 0
+            self.total = 0
+            self.class_counts = np.zeros(self.num_classes, dtype=np.int64)
+            self.confidence_hist = np.zeros((self.num_classes, CONFIDENCE_BINS), dtype=np.int64)
+            self.entropy_hist = np.zeros(ENTROPY_BINS, dtype=np.int64)
+            self.entropy_sum = 0.0
+            self.started = time.time()
+
+    def _bins(self, probabilities):
+        p = np.asarray(probabilities, dtype=np.float64)
+        label = int(p.argmax())
+        confidence = float(p[label])
+        entropy = float(-np.sum(p * np.log(np.clip(p, 1e-12, None)))) / self._log_classes
+        return (label,
+                min(int(confidence * CONFIDENCE_BINS), CONFIDENCE_BINS - 1),
+                min(int(entropy * ENTROPY_BINS), ENTROPY_BINS - 1),
+                entropy)
+
+    def observe(self, probabilities):
+        """Adds one softmax vector (length num_classes) to the window."""
+        label, conf_bin, ent_bin, entropy = self._bins(probabilities)
+        with self._lock:
+            slot = self._next
+            if self.count == self.size:
+                old_label, old_conf, old_ent = self._ring[slot]
+                self.class_counts[old_label] -= 1
+                self.confidence_hist[old_label, old_conf] -= 1
+                self.entropy_hist[old_ent] -= 1
+                self.entropy_sum -= self._entropies[slot]
+            else:
+                self.count += 1
+            self._ring[slot] = (label, conf_bin, ent_bin)
+            self._entropies[slot] = entropy
+            self.class_counts[label] += 1
+            self.confidence_hist[label, conf_bin] += 1
+            self.entropy_hist[ent_bin] += 1
+            self.entropy_sum += entropy
+            self._next = (slot + 1) % self.size
+            self.total += 1
+
+    def profile(self):
+        """Histogram snapshot, the same shape as a saved reference profile."""
+        with self._lock:
+            return {
+                "count": int(self.count),
+                "class_counts": self.class_counts.tolist(),
+                "confidence_hist": self.confidence_hist.tolist(),
+                "entropy_hist": self.entropy_hist.tolist(),
+                "mean_entropy": round(self.entropy_sum / self.count, 4) if self.count else None,
+            }
+
+    def snapshot(self):
+        """JSON-serializable window state; snapshots of several windows combine with merge_snapshots()."""
+        return {"size": self.size, "total": self.total, "started": self.started, "profile": self.profile()}
+
+
+def merge_snapshots(snapshots):
+    """One window snapshot covering several windows (e.g. one per pre-forked worker)."""
+    profiles = [s["profile"] for s in snapshots]
+    count = sum(p["count"] for p in profiles)
+    entropy_sum = sum(p["mean_entropy"] * p["count"] for p in profiles if p["count"])
+    return {
+        "size": sum(s["size"] for s in snapshots),
+        "total": sum(s["total"] for s in snapshots),
+        "started": min(s["started"] for s in snapshots),
+        "profile": {
+            "count": count,
+            "class_counts": np.sum([p["class_counts"] for p in profiles], axis=0).tolist(),
+            "confidence_hist": np.sum([p["confidence_hist"] for p in profiles], axis=0).tolist(),
+            "entropy_hist": np.sum([p["entropy_hist"] for p in profiles], axis=0).tolist(),
+            "mean_entropy": round(entropy_sum / count, 4) if count else None,
+        },
+    }
+
+
+class DriftMonitor:
+    """A DriftWindow plus its comparison against the val reference profile."""
+
+    def __init__(self, classes, window=1000, reference_path=REFERENCE_PATH, min_samples=200):
+        self.classes = classes
+        self.window = DriftWindow(len(classes), window)
+        self.min_samples = min_samples
+        self.reference = self.load_reference(reference_path)
+
+    @staticmethod
+    def load_reference(path):
+        try:
+            with open(path) as f:
+                reference = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"⚠️ Ignoring invalid drift reference '{path}': {e}")
+            return None
+        print(f"📈 Drift reference loaded from {path} ({reference['profile']['count']} val predictions)")
+        return reference
+
+    def observe(self, probabilities):
+        self.window.observe(probabilities)
+
+    def report(self, model_version=None, snapshot=None):
+        """
+        PSI per signal and an overall status; computed on demand, not per
+        request. `snapshot` (see merge_snapshots) replaces this window's own.
+        """
+        snapshot = snapshot or self.window.snapshot()
+        current = snapshot["profile"]
+        report = {
+            "window": {"size": snapshot["size"], "count": current["count"], "total_seen": snapshot["total"],
+                       "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(snapshot["started"]))},
+            "current": {
+                "class_frequencies": self._frequencies(current["class_counts"]),
+                "mean_entropy": current["mean_entropy"],
+            },
+            "psi": {},
+            "status": "insufficient_data",
+        }
+        if self.reference is None:
+            report["note"] = "No reference profile; run 'python drift_monitor.py reference'"
+            return report
+        reference = self.reference["profile"]
+        report["reference"] = {
+            "class_frequencies": self._frequencies(reference["class_counts"]),
+            "mean_entropy": reference["mean_entropy"],
+            "model_version": self.reference.get("model_version"),
+        }
+        if model_version and self.reference.get("model_version") not in (None, model_version):
+            report["note"] = (f"Reference was profiled with model {self.reference['model_version']}, "
+                              f"serving {model_version}; recompute it")
+        if current["count"] < self.min_samples:
+            return report
+
+        scores = {
+            "class": psi(reference["class_counts"], current["class_counts"]),
+            "entropy": psi(reference["entropy_hist"], current["entropy_hist"]),
+        }
+        per_class_min = max(self.min_samples // len(self.classes), 20)
+        for i, name in enumerate(self.classes):
+            # Per-class confidence only where both sides have enough predictions of that class
+            if min(current["class_counts"][i], reference["class_counts"][i]) >= per_class_min:
+                scores[f"confidence:{name}"] = psi(reference["confidence_hist"][i], current["confidence_hist"][i])
+        report["psi"] = {k: round(v, 4) for k, v in scores.items()}
+        worst = max(scores.values())
+        report["status"] = "drift" if worst >= PSI_DRIFT else "warning" if worst >= PSI_WARNING else "ok"
+        report["drifting_signals"] = sorted(k for k, v in scores.items() if v >= PSI_WARNING)
+        return report
+
+    def _frequencies(self, counts):
+        total = max(sum(counts), 1)
+        return {name: round(counts[i] / total, 4) for i, name in enumerate(self.classes)}
+
+
+# ======================================================
+# REFERENCE PROFILE (CLI; runs the served model through app.py)
+# ======================================================
+def build_reference(paths, window_size=None):
+    os.environ.setdefault("MODEL_LOAD", "lazy")
+    import app
+    engine = app.load_engine()
+    if engine is None:
+        raise SystemExit("❌ Model is not available")
+    classes = [engine.classes[i] for i in range(len(engine.classes))]
+    window = DriftWindow(len(classes), window_size or max(len(paths), 1))
+    for path in paths:
+        img = engine.preprocessor.open(path)
+        # Same path as serving (including TTA), so confidences are comparable
+        probabilities, _ = app.predict_probabilities(engine, img, engine.preprocessor.resize(img))
+        window.observe(probabilities.numpy())
+    return {"model_version": engine.version, "classes": classes, "images": len(paths),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "profile": window.profile()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the val reference profile for drift monitoring.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ref = sub.add_parser("reference", help="Profile the served model's predictions on the val split")
+    ref.add_argument("--data", default=os.path.join("dataset", "val"))
+    ref.add_argument("--out", default=REFERENCE_PATH)
+    args = parser.parse_args(argv)
+
+    paths = sorted(os.path.join(root, name) for root, _, files in os.walk(args.data) for name in files
+                   if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    reference = build_reference(paths)
+    with open(args.out, "w") as f:
+        json.dump(reference, f, indent=4)
+    profile = reference["profile"]
+    total = max(profile["count"], 1)
+    print(f"📊 {profile['count']} val predictions, mean entropy {profile['mean_entropy']}")
+    for name, count in zip(reference["classes"], profile["class_counts"]):
+        print(f"   {name:<18} {count / total:.2%}")
+    print(f"✅ Reference saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
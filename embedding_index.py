@@ -0,0 +1,444 @@
+"""
+Similar-case retrieval over the backbone's pooled features.
+
+Each labelled reference image is stored as one L2-normalized float16 row in
+an append-only, memory-mapped file (optionally projected to fewer dimensions
+with PCA fitted at build time):
+
+    embedding_index/
+      meta.json          <- dim, committed row count, model version, IVF lists
+      vectors.f16        <- (count, dim) float16, append-only
+      items.jsonl        <- {"path", "label"} per row
+      lists.i32          <- IVF list of each row (only with --nlist)
+      projection.npz     <- PCA mean/components (only with --dim)
+      centroids.npy      <- IVF centroids (only with --nlist)
+
+Adding images appends rows and then rewrites meta.json, so readers (other
+workers) never see a partial row and pick new rows up without a rebuild.
+Search is a batched cosine top-k on a float32 copy of the rows: one matmul
+over all of them, or over the `nprobe` nearest IVF lists for large corpora
+(--dim 256 keeps a few thousand images well under a millisecond). NumPy
+only; the CLI loads the served model through app.py.
+
+    python embedding_index.py build --data dataset/train [--dim 256] [--nlist 64]
+    python embedding_index.py add Leaf_Rot new_photo1.jpg new_photo2.jpg
+    python embedding_index.py query photo.jpg --k 5
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer use only
+    fcntl = None
+
+INDEX_DIR = "embedding_index"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _top_k(scores, k):
+    """Indices of the k largest entries of a 1-D array, best first."""
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _write_meta(root, meta):
+    tmp_path = os.path.join(root, f"meta.json.tmp.{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_path, os.path.join(root, "meta.json"))
+
+
+def spherical_kmeans(x, nlist, iterations=10, seed=0):
+    """Unit-norm centroids for IVF lists (x must be L2-normalized)."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = ~np.bincount(assign, minlength=nlist).astype(bool)
+        # Reseed empty lists with random points so every list stays usable
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IndexState:
+    """
+    Everything a search reads, for one build at one row count. Never mutated:
+    refreshes build a new IndexState and publish it with a single assignment,
+    so a concurrent search always sees one consistent projection, centroid
+    set and row set.
+    """
+    __slots__ = ("meta", "dim", "model_version", "nprobe", "projection", "centroids",
+                 "count", "items", "matrix", "ids", "offsets")
+
+    def __init__(self, meta, dim, model_version, nprobe, projection, centroids, count, items, matrix, ids,
+                 offsets):
+        self.meta = meta
+        self.dim = dim
+        self.model_version = model_version
+        self.nprobe = nprobe
+        # (mean, components) of the PCA projection, or None
+        self.projection = projection
+        self.centroids = centroids
+        self.count = count
+        self.items = items
+        # float32 working copy of the rows (grouped by IVF list), their row ids and list offsets
+        self.matrix = matrix
+        self.ids = ids
+        self.offsets = offsets
+
+    def with_rows(self, meta, count, items, matrix, ids, offsets):
+        return IndexState(meta, self.dim, self.model_version, self.nprobe, self.projection, self.centroids,
+                          count, items, matrix, ids, offsets)
+
+
+def _project(embeddings, projection):
+    x = np.asarray(embeddings, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None]
+    if projection is not None:
+        mean, components = projection
+        x = (x - mean) @ components
+    return _normalize(x)
+
+
+class EmbeddingIndex:
+    """Append-only float16 vector index with cosine top-k search."""
+
+    def __init__(self, root=INDEX_DIR):
+        self.root = root
+        # Serializes refreshes; searches never take it, they read the published state
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self._checked = 0.0
+        self._state = None
+        self.refresh(force=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def __len__(self):
+        return self._state.count
+
+    @property
+    def dim(self):
+        return self._state.dim
+
+    @property
+    def model_version(self):
+        return self._state.model_version
+
+    @property
+    def build_id(self):
+        return self._state.meta.get("build_id")
+
+    # --------------------------------------------------
+    # BUILD & APPEND
+    # --------------------------------------------------
+    @classmethod
+    def build(cls, root, embeddings, items, model_version=None, dim=0, nlist=0, nprobe=8):
+        """Creates a new index from (N, D) embeddings; `dim` > 0 fits a PCA projection first."""
+        os.makedirs(root, exist_ok=True)
+        for name in ("vectors.f16", "items.jsonl", "lists.i32", "projection.npz", "centroids.npy"):
+            if os.path.exists(os.path.join(root, name)):
+                os.remove(os.path.join(root, name))
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        source_dim = embeddings.shape[1]
+        projection = None
+        if 0 < dim < source_dim:
+            if len(embeddings) < dim:
+                raise ValueError(f"PCA to {dim} dims needs at least {dim} images, got {len(embeddings)}")
+            mean = embeddings.mean(axis=0)
+            _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+            projection = (mean, vt[:dim].T.copy())
+            np.savez(os.path.join(root, "projection.npz"), mean=projection[0], components=projection[1])
+        else:
+            dim = source_dim
+
+        if nlist:
+            if len(embeddings) < nlist:
+                raise ValueError(f"{nlist} IVF lists need at least {nlist} images, got {len(embeddings)}")
+            np.save(os.path.join(root, "centroids.npy"), spherical_kmeans(_project(embeddings, projection), nlist))
+
+        # Written last: a new build_id makes readers reload projection and centroids
+        meta = {"dim": dim, "source_dim": source_dim, "count": 0, "model_version": model_version,
+                "nlist": nlist, "nprobe": nprobe, "build_id": uuid.uuid4().hex,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        _write_meta(root, meta)
+        index = cls(root)
+        index.add(embeddings, items)
+        return index
+
+    def project(self, embeddings):
+        """Raw backbone features -> normalized index-space float32 vectors."""
+        return _project(embeddings, self._state.projection)
+
+    def add(self, embeddings, items):
+        """Appends labelled rows and commits them by rewriting meta.json; returns the new row ids."""
+        state = self._state
+        vectors = _project(embeddings, state.projection)
+        if len(vectors) != len(items):
+            raise ValueError("One item per embedding is required")
+        with open(self._path(".lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self._path("meta.json")) as f:
+                meta = json.load(f)
+            if meta.get("build_id") != state.meta.get("build_id"):
+                raise RuntimeError("The index was rebuilt; reopen it before adding rows")
+            count = meta["count"]
+            # Drop bytes left behind by an append that crashed before its commit
+            self._truncate("vectors.f16", count * state.dim * 2)
+            with open(self._path("vectors.f16"), "ab") as f:
+                f.write(vectors.astype(np.float16).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            if state.centroids is not None:
+                self._truncate("lists.i32", count * 4)
+                with open(self._path("lists.i32"), "ab") as f:
+                    f.write(np.argmax(vectors @ state.centroids.T, axis=1).astype(np.int32).tobytes())
+            self._write_items(count, items)
+
+            meta.update(count=count + len(vectors), updated=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            _write_meta(self.root, meta)
+        self.refresh(force=True)
+        return list(range(count, count + len(vectors)))
+
+    def _truncate(self, name, size):
+        path = self._path(name)
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def _write_items(self, count, items):
+        path = self._path("items.jsonl")
+        lines = []
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.readlines()
+        if len(lines) != count:
+            with open(path, "w") as f:
+                f.writelines(lines[:count])
+        with open(path, "a") as f:
+            f.writelines(json.dumps(item) + "\n" for item in items)
+
+    # --------------------------------------------------
+    # READ SIDE
+    # --------------------------------------------------
+    def refresh(self, force=False, interval=1.0):
+        """
+        Maps rows committed since the last check (by this or another process),
+        or reloads everything after a rebuild. Searches keep using the previous
+        state until the new one is published; a search that finds another
+        thread refreshing does not wait for it.
+        """
+        now = time.monotonic()
+        if not force and now - self._checked < interval:
+            return
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            self._checked = now
+            mtime = os.stat(self._path("meta.json")).st_mtime_ns
+            if mtime == self._meta_mtime and not force:
+                return
+            try:
+                meta = self._read_meta()
+                state = self._state
+                if state is None or meta.get("build_id") != state.meta.get("build_id"):
+                    # New or rebuilt index (maybe with another projection): start from no rows
+                    state = self._empty_state(meta)
+                state = self._with_committed_rows(state, meta)
+                # A rebuild that started meanwhile may have replaced files mid-read
+                if self._read_meta().get("build_id") != meta.get("build_id"):
+                    raise ValueError("Index was rebuilt while loading")
+            except (OSError, ValueError):
+                if force:
+                    raise
+                # Keep serving the current state; the next check retries
+                return
+            self._state = state
+            self._meta_mtime = mtime
+        finally:
+            self._lock.release()
+
+    def _read_meta(self):
+        with open(self._path("meta.json")) as f:
+            return json.load(f)
+
+    def _empty_state(self, meta):
+        dim = meta["dim"]
+        projection = None
+        if os.path.exists(self._path("projection.npz")):
+            with np.load(self._path("projection.npz")) as p:
+                projection = (p["mean"], p["components"])
+        centroids = np.load(self._path("centroids.npy")) if meta.get("nlist") else None
+        if projection is not None and projection[1].shape[1] != dim:
+            raise ValueError("Projection does not match the index dimension")
+        return IndexState(meta, dim, meta.get("model_version"), meta.get("nprobe", 8), projection, centroids,
+                          0, [], np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.int64), None)
+
+    def _with_committed_rows(self, state, meta):
+        count = meta["count"]
+        if count == state.count:
+            return state.with_rows(meta, state.count, state.items, state.matrix, state.ids, state.offsets)
+        vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r", shape=(count, state.dim))
+        with open(self._path("items.jsonl")) as f:
+            items = [json.loads(line) for line, _ in zip(f, range(count))]
+        offsets = None
+        if state.centroids is None:
+            # Flat search runs on a float32 working copy, extended with new rows only
+            matrix = np.concatenate([state.matrix, np.asarray(vectors[state.count:], dtype=np.float32)])
+            ids = np.arange(count)
+        else:
+            # Rows grouped by IVF list, so probing a list scans one contiguous slice
+            assign = np.fromfile(self._path("lists.i32"), dtype=np.int32, count=count)
+            ids = np.argsort(assign, kind="stable")
+            matrix = np.asarray(vectors[ids], dtype=np.float32)
+            offsets = np.searchsorted(assign[ids], np.arange(len(state.centroids) + 1))
+        return state.with_rows(meta, count, items, matrix, ids, offsets)
+
+    def item(self, row_id, build_id=None):
+        """The stored {"path", "label"} of a row, or None (unknown row, or not this build)."""
+        state = self._state
+        if build_id is not None and build_id != state.meta.get("build_id"):
+            return None
+        return state.items[row_id] if 0 <= row_id < state.count else None
+
+    def search(self, embeddings, k=5):
+        """
+        Cosine top-k for a batch of raw embeddings; one list per query of
+        {"id", "label", "path", "score"} dicts, best first.
+        """
+        self.refresh()
+        state = self._state
+        queries = _project(embeddings, state.projection)
+        if not state.count:
+            return [[] for _ in queries]
+
+        ids, matrix, offsets = state.ids, state.matrix, state.offsets
+        if state.centroids is None:
+            scores = queries @ matrix.T
+            candidates = [ids] * len(queries)
+        else:
+            probe = np.argsort(-(queries @ state.centroids.T), axis=1)[:, :state.nprobe]
+            candidates, scores = [], []
+            for lists, q in zip(probe, queries):
+                slices = [slice(offsets[i], offsets[i + 1]) for i in lists]
+                candidates.append(np.concatenate([ids[s] for s in slices]))
+                scores.append(np.concatenate([matrix[s] @ q for s in slices]))
+
+        results = []
+        for row_scores, row_ids in zip(scores, candidates):
+            top = _top_k(row_scores, k)
+            rows = row_ids[top]
+            results.append([{"id": int(row), **state.items[row], "score": round(float(row_scores[i]), 4)}
+                            for row, i in zip(rows, top)])
+        return results
+
+    def snapshot(self):
+        state = self._state
+        return {"size": state.count, "dim": state.dim, "ivf_lists": state.meta.get("nlist", 0),
+                "model_version": state.model_version, "build_id": state.meta.get("build_id")}
+
+
+def open_index(root=INDEX_DIR):
+    """The index at `root`, or None when none has been built."""
+    if not os.path.exists(os.path.join(root, "meta.json")):
+        return None
+    return EmbeddingIndex(root)
+
+
+# ======================================================
+# CLI (loads the served model through app.py)
+# ======================================================
+def _embed(paths, batch_size):
+    os.environ.setdefault("MODEL_LOAD", "lazy")
+    import app
+    engine = app.load_engine()
+    if engine is None:
+        raise SystemExit("❌ Model is not available")
+    chunks = []
+    for start in range(0, len(paths), batch_size):
+        arrays = [engine.preprocessor.load(p) for p in paths[start:start + batch_size]]
+        _, embeddings = engine.forward_batch(arrays, with_embeddings=True)
+        if embeddings is None:
+            raise SystemExit("❌ The served model format does not expose embeddings (use the eager model)")
+        chunks.append(embeddings.numpy())
+    return np.concatenate(chunks), engine.version
+
+
+def _labelled_images(folder):
+    items = []
+    for label in sorted(os.listdir(folder)):
+        class_dir = os.path.join(folder, label)
+        if os.path.isdir(class_dir):
+            items.extend({"path": os.path.join(class_dir, name), "label": label}
+                         for name in sorted(os.listdir(class_dir)) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query the similar-case embedding index.")
+    parser.add_argument("--root", default=INDEX_DIR)
+    parser.add_argument("--batch-size", type=int, default=16)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Index every image of a labelled ImageFolder split")
+    build.add_argument("--data", default=os.path.join("dataset", "train"))
+    build.add_argument("--dim", type=int, default=0, help="PCA-project to this many dims (0 = keep all)")
+    build.add_argument("--nlist", type=int, default=0, help="IVF lists for large corpora (0 = flat search)")
+    build.add_argument("--nprobe", type=int, default=8, help="IVF lists scanned per query")
+    add = sub.add_parser("add", help="Append newly labelled images without a rebuild")
+    add.add_argument("label")
+    add.add_argument("images", nargs="+")
+    query = sub.add_parser("query", help="Show the nearest reference images")
+    query.add_argument("images", nargs="+")
+    query.add_argument("--k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        items = _labelled_images(args.data)
+        embeddings, version = _embed([item["path"] for item in items], args.batch_size)
+        index = EmbeddingIndex.build(args.root, embeddings, items, version, args.dim, args.nlist, args.nprobe)
+        print(f"✅ Indexed {len(index)} images ({index.dim} dims, model {version}) in '{args.root}'")
+        return
+
+    index = open_index(args.root)
+    if index is None:
+        raise SystemExit(f"❌ No index in '{args.root}'; run 'build' first")
+    embeddings, version = _embed(args.images, args.batch_size)
+    if version != index.model_version:
+        print(f"⚠️ Index was built with model {index.model_version}, serving {version}; rebuild it")
+    if args.command == "add":
+        rows = index.add(embeddings, [{"path": path, "label": args.label} for path in args.images])
+        print(f"✅ Added {len(rows)} images as '{args.label}' (index size {len(index)})")
+    else:
+        started = time.perf_counter()
+        results = index.search(embeddings, args.k)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for path, matches in zip(args.images, results):
+            print(f"🔎 {path}")
+            for m in matches:
+                print(f"   {m['score']:.3f}  {m['label']:<18} {m['path']}")
+        print(f"⏱️ {elapsed_ms:.3f} ms for {len(args.images)} queries over {len(index)} rows")
+
+
+if __name__ == "__main__":
+    main()
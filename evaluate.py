@@ -0,0 +1,215 @@
+"""
+Evaluation report for a trained model on the val split.
+
+Logits for the whole split are gathered into one preallocated tensor; every
+metric (confusion matrix, per-class precision/recall, top-k accuracy,
+calibration) is then computed with tensor ops over that tensor.
+
+    python evaluate.py                        # report only
+    python evaluate.py --fit-temperature      # also fit and save calibration.json for app.py
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+import train_model
+from inference import load_weights
+from model_registry import weights_sha256
+
+REPORT_PATH = os.path.join("runs", "eval_report.json")
+CALIBRATION_PATH = "calibration.json"
+# Same bands as calculate_severity() in app.py
+SEVERITY_THRESHOLDS = (50.0, 70.0, 85.0)
+SEVERITY_NAMES = ("Uncertain", "Mild Infection", "Moderate Infection", "Severe Infection")
+
+
+# ======================================================
+# LOGIT COLLECTION
+# ======================================================
+def collect_logits(model, dataset, num_classes, batch_size=128, workers=train_model.DEFAULT_WORKERS):
+    """Runs the split in large batches into a preallocated (N, C) logits tensor."""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers,
+                        pin_memory=torch.cuda.is_available())
+    logits = torch.empty((len(dataset), num_classes), dtype=torch.float32)
+    labels = torch.empty(len(dataset), dtype=torch.long)
+
+    model.eval()
+    offset = 0
+    with torch.no_grad():
+        for images, targets in tqdm(loader, desc="Evaluating"):
+            n = targets.size(0)
+            outputs = model(images.to(train_model.DEVICE, non_blocking=True))
+            logits[offset:offset + n].copy_(outputs)
+            labels[offset:offset + n] = targets
+            offset += n
+    return logits, labels
+
+
+# ======================================================
+# METRICS (vectorized)
+# ======================================================
+def confusion_matrix(preds, labels, num_classes):
+    """Rows are true classes, columns predicted classes."""
+    return torch.bincount(labels * num_classes + preds, minlength=num_classes ** 2).view(num_classes, num_classes)
+
+
+def per_class_metrics(cm, classes):
+    cm = cm.double()
+    tp = cm.diag()
+    support = cm.sum(dim=1)
+    predicted = cm.sum(dim=0)
+    precision = torch.where(predicted > 0, tp / predicted.clamp(min=1), torch.zeros_like(tp))
+    recall = torch.where(support > 0, tp / support.clamp(min=1), torch.zeros_like(tp))
+    f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall).clamp(min=1e-12),
+                     torch.zeros_like(tp))
+    return {
+        cls: {"precision": round(precision[i].item(), 4), "recall": round(recall[i].item(), 4),
+              "f1": round(f1[i].item(), 4), "support": int(support[i].item())}
+        for i, cls in enumerate(classes)
+    }
+
+
+def topk_accuracy(logits, labels, ks=(1, 2, 3)):
+    ks = [k for k in ks if k <= logits.size(1)]
+    top = logits.topk(max(ks), dim=1).indices
+    hits = top == labels.unsqueeze(1)
+    return {f"top{k}": round(hits[:, :k].any(dim=1).float().mean().item(), 4) for k in ks}
+
+
+def calibration(probs, labels, n_bins=15):
+    """Expected calibration error plus reliability-diagram bins over top-1 confidence."""
+    confidence, preds = probs.max(dim=1)
+    correct = (preds == labels).double()
+    confidence = confidence.double()
+    bins = (confidence * n_bins).ceil().long().clamp(1, n_bins) - 1
+
+    count = torch.bincount(bins, minlength=n_bins).double()
+    conf_sum = torch.bincount(bins, weights=confidence, minlength=n_bins)
+    acc_sum = torch.bincount(bins, weights=correct, minlength=n_bins)
+    nonempty = count > 0
+    avg_conf = torch.where(nonempty, conf_sum / count.clamp(min=1), torch.zeros_like(count))
+    avg_acc = torch.where(nonempty, acc_sum / count.clamp(min=1), torch.zeros_like(count))
+    gaps = (avg_acc - avg_conf).abs()
+    total = max(labels.numel(), 1)
+
+    return {
+        "ece": round((gaps * count).sum().item() / total, 4),
+        "mce": round(gaps[nonempty].max().item(), 4) if nonempty.any() else 0.0,
+        "nll": round(F.nll_loss(probs.clamp(min=1e-12).log(), labels).item(), 4),
+        "mean_confidence": round(confidence.mean().item(), 4),
+        "accuracy": round(correct.mean().item(), 4),
+        "bins": [
+            {"lower": round(i / n_bins, 4), "upper": round((i + 1) / n_bins, 4), "count": int(count[i].item()),
+             "confidence": round(avg_conf[i].item(), 4), "accuracy": round(avg_acc[i].item(), 4)}
+            for i in range(n_bins) if count[i] > 0
+        ],
+    }
+
+
+def severity_bands(probs, labels):
+    """How accurate predictions are inside each calculate_severity() confidence band."""
+    confidence, preds = probs.max(dim=1)
+    band = torch.bucketize(confidence * 100, torch.tensor(SEVERITY_THRESHOLDS), right=True)
+    correct = (preds == labels).double()
+    count = torch.bincount(band, minlength=len(SEVERITY_NAMES)).double()
+    acc = torch.bincount(band, weights=correct, minlength=len(SEVERITY_NAMES)) / count.clamp(min=1)
+    return {
+        name: {"count": int(count[i].item()), "accuracy": round(acc[i].item(), 4) if count[i] else None}
+        for i, name in enumerate(SEVERITY_NAMES)
+    }
+
+
+def fit_temperature(logits, labels, max_iter=100):
+    """Single scalar T minimizing NLL of softmax(logits / T); optimized in log space so T > 0."""
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_t.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return float(log_t.exp().item())
+
+
+def evaluate_logits(logits, labels, classes, temperature=1.0, n_bins=15, ks=(1, 2, 3)):
+    probs = torch.softmax(logits / temperature, dim=1)
+    preds = probs.argmax(dim=1)
+    cm = confusion_matrix(preds, labels, len(classes))
+    return {
+        "temperature": round(temperature, 4),
+        "accuracy": round((preds == labels).float().mean().item(), 4),
+        "top_k": topk_accuracy(logits, labels, ks),
+        "per_class": per_class_metrics(cm, classes),
+        "confusion_matrix": {"labels": list(classes), "matrix": cm.tolist()},
+        "calibration": calibration(probs, labels, n_bins),
+        "severity_bands": severity_bands(probs, labels),
+    }
+
+
+# ======================================================
+# CLI
+# ======================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the trained model on the val split.")
+    parser.add_argument("--weights", default=train_model.MODEL_PATH)
+    parser.add_argument("--shards", default=None, help="Use tensor shards instead of dataset/val")
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=train_model.DEFAULT_WORKERS)
+    parser.add_argument("--bins", type=int, default=15, help="Reliability diagram bins")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--fit-temperature", action="store_true",
+                        help="Fit temperature scaling and write it for app.py to apply")
+    parser.add_argument("--calibration-out", default=CALIBRATION_PATH)
+    parser.add_argument("--out", default=REPORT_PATH)
+    args = parser.parse_args(argv)
+
+    _, val_dataset = train_model.build_datasets(args.shards, augment=False)
+    classes = val_dataset.classes
+    model = load_weights(args.weights, len(classes), train_model.DEVICE)
+
+    started = time.perf_counter()
+    logits, labels = collect_logits(model, val_dataset, len(classes), args.batch_size, args.workers)
+    forward_seconds = time.perf_counter() - started
+
+    report = {
+        "weights": args.weights,
+        "images": len(labels),
+        "forward_seconds": round(forward_seconds, 3),
+        "uncalibrated": evaluate_logits(logits, labels, classes, 1.0, args.bins, args.top_k),
+    }
+    if args.fit_temperature:
+        temperature = fit_temperature(logits, labels)
+        report["calibrated"] = evaluate_logits(logits, labels, classes, temperature, args.bins, args.top_k)
+        with open(args.calibration_out, "w") as f:
+            # The digest ties the temperature to these exact weights (see model_registry.py)
+            json.dump({"temperature": temperature, "weights": args.weights,
+                       "weights_sha256": weights_sha256(args.weights),
+                       "ece_before": report["uncalibrated"]["calibration"]["ece"],
+                       "ece_after": report["calibrated"]["calibration"]["ece"]}, f, indent=4)
+        print(f"🌡️ Temperature {temperature:.3f} saved to {args.calibration_out}")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for key in ("uncalibrated", "calibrated"):
+        if key in report:
+            r = report[key]
+            print(f"📊 {key:<12} T={r['temperature']:.3f} acc={r['accuracy']:.2%} "
+                  f"ECE={r['calibration']['ece']:.4f} NLL={r['calibration']['nll']:.4f} {r['top_k']}")
+    for cls, m in report["uncalibrated"]["per_class"].items():
+        print(f"   {cls:<18} precision={m['precision']:.3f} recall={m['recall']:.3f} support={m['support']}")
+    print(f"📄 Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import copy
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision import datasets, transforms
+
+import train_model
+from inference import get_model, load_classes
+from model_registry import weights_sha256
+
+# =========================
+# CONFIGURATION
+# =========================
+# Shared with train_model.py; importing app.py would start serving state (model load, upload writer)
+VAL_DIR = train_model.VAL_DIR
+MODEL_WEIGHTS = train_model.MODEL_PATH
+CLASS_INDEX_FILE = train_model.CLASS_INDEX_PATH
+IMG_SIZE = train_model.IMG_SIZE
+REPORT_PATH = "export_report.json"
+EXPORT_VARIANTS = ("fp32", "int8-dynamic", "int8-static")
+
+val_transforms = transforms.Compose([
+    transforms.Resize((IMG_SIZE, IMG_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=train_model.IMAGENET_MEAN, std=train_model.IMAGENET_STD)
+])
+
+
+def export_path(variant, weights=MODEL_WEIGHTS):
+    """betel_leaf_model.pth -> betel_leaf_model.<variant>.ts"""
+    return f"{os.path.splitext(weights)[0]}.{variant}.ts"
+
+
+# =========================
+# MODEL VARIANTS
+# =========================
+def load_fp32_model(weights, num_classes):
+    model = get_model(num_classes)
+    model.load_state_dict(torch.load(weights, map_location="cpu"))
+    return model.eval()
+
+
+def quantize_dynamic(model):
+    """int8 weights for the Linear head; activations are quantized on the fly."""
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches, engine):
+    """FX graph-mode int8 quantization of the whole network, calibrated on real images."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    example = calibration_batches[0]
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping(engine), (example,))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def to_torchscript(model, example):
+    """
+    Traces and freezes the model; freezing folds BatchNorm into the preceding convs.
+
+    `optimize_for_inference` rewrites to prepacked (non-serializable) kernels, so
+    it is applied at load time in app.py rather than here.
+    """
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model, example).eval())
+
+
+# =========================
+# PARITY & LATENCY
+# =========================
+def collect_logits(model, loader):
+    logits, labels = [], []
+    with torch.no_grad():
+        for images, targets in loader:
+            logits.append(model(images))
+            labels.append(targets)
+    return torch.cat(logits), torch.cat(labels)
+
+
+def parity_report(reference_logits, logits, labels):
+    ref_probs = torch.softmax(reference_logits, dim=1)
+    probs = torch.softmax(logits, dim=1)
+    preds = probs.argmax(dim=1)
+    return {
+        "accuracy": round(100 * (preds == labels).float().mean().item(), 2),
+        "top1_agreement_with_fp32": round(100 * (preds == ref_probs.argmax(dim=1)).float().mean().item(), 2),
+        "max_abs_prob_diff": round((probs - ref_probs).abs().max().item(), 5),
+    }
+
+
+def measure_latency(model, batch_size, iterations=20, warmup=3):
+    x = torch.randn(batch_size, 3, IMG_SIZE, IMG_SIZE)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            model(x)
+    per_batch_ms = (time.perf_counter() - started) * 1000 / iterations
+    return {"batch_size": batch_size, "ms_per_batch": round(per_batch_ms, 2),
+            "ms_per_image": round(per_batch_ms / batch_size, 2)}
+
+
+# =========================
+# MAIN
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export optimized CPU inference artifacts.")
+    parser.add_argument("--variants", nargs="+", default=list(EXPORT_VARIANTS), choices=EXPORT_VARIANTS)
+    parser.add_argument("--weights", default=MODEL_WEIGHTS)
+    parser.add_argument("--class-index", default=CLASS_INDEX_FILE)
+    parser.add_argument("--val-dir", default=VAL_DIR)
+    parser.add_argument("--calibration-batches", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for latency runs")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    engine = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+
+    classes = load_classes(args.class_index)
+    fp32 = load_fp32_model(args.weights, len(classes))
+    print(f"✅ Loaded fp32 model from {args.weights}")
+
+    loader = None
+    if os.path.isdir(args.val_dir):
+        val_dataset = datasets.ImageFolder(args.val_dir, transform=val_transforms)
+        loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False)
+        calibration = [images for images, _ in loader][:args.calibration_batches]
+        reference_logits, labels = collect_logits(fp32, loader)
+    else:
+        print(f"⚠️ '{args.val_dir}' not found: calibrating on random inputs, skipping accuracy parity")
+        calibration = [torch.randn(args.batch_size, 3, IMG_SIZE, IMG_SIZE)
+                       for _ in range(args.calibration_batches)]
+
+    report = {
+        "quantized_engine": engine,
+        "threads": torch.get_num_threads(),
+        "fp32_eager": {"latency": [measure_latency(fp32, bs) for bs in (1, args.batch_size)]},
+    }
+    if loader is not None:
+        report["fp32_eager"]["parity"] = parity_report(reference_logits, reference_logits, labels)
+
+    example = calibration[0][:1]
+    source_sha256 = weights_sha256(args.weights)
+    for variant in args.variants:
+        print(f"\n🔧 Exporting {variant} ...")
+        if variant == "int8-dynamic":
+            candidate = quantize_dynamic(fp32)
+        elif variant == "int8-static":
+            candidate = quantize_static(fp32, calibration, engine)
+        else:
+            candidate = fp32
+
+        scripted = to_torchscript(candidate, example)
+        path = export_path(variant, args.weights)
+        # source_sha256 lets model_registry.py match calibration fitted on the source weights
+        meta = {"variant": variant, "quantized_engine": engine, "source": args.weights,
+                "source_sha256": source_sha256, "classes": {str(k): v for k, v in classes.items()}}
+        torch.jit.save(scripted, path, _extra_files={"meta.json": json.dumps(meta)})
+
+        # Benchmark exactly what app.py will serve: the reloaded artifact
+        served = torch.jit.load(path, map_location="cpu")
+        if variant == "fp32":
+            served = torch.jit.optimize_for_inference(served)
+        entry = {"path": path, "size_mb": round(os.path.getsize(path) / 2**20, 2),
+                 "latency": [measure_latency(served, bs) for bs in (1, args.batch_size)]}
+        if loader is not None:
+            logits, _ = collect_logits(served, loader)
+            entry["parity"] = parity_report(reference_logits, logits, labels)
+        report[variant] = entry
+        print(f"✅ Saved {path}: {json.dumps(entry)}")
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\n📄 Report written to {REPORT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+FEATURE_DIR = "feature_cache"
+
+
+def dataset_fingerprint(dataset):
+    """
+    Digest of the sorted image files (path, size, mtime) and labels behind an
+    ImageFolder or ShardDataset, plus its transform. Editing, adding or
+    replacing any image changes it, even if the image count stays the same.
+    """
+    if hasattr(dataset, "samples"):
+        entries = sorted((path, label) for path, label in dataset.samples)
+    else:
+        entries = sorted((os.path.join(dataset.shard_dir, s[key]), None)
+                         for s in dataset._shard_files for key in ("images", "labels"))
+    digest = hashlib.sha256(repr(dataset.transform).encode())
+    for path, label in entries:
+        st = os.stat(path)
+        digest.update(f"{path}\0{label}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def backbone_fingerprint(model):
+    """Digest of the frozen backbone's weights: a different architecture or checkpoint changes it."""
+    digest = hashlib.sha256()
+    for name, tensor in sorted(model.features.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def pooled_features(model, images):
+    """EfficientNet forward up to (and including) global pooling: (N, 1280)."""
+    return torch.flatten(model.avgpool(model.features(images)), 1)
+
+
+def extract_features(model, dataset, out_dir, device, augmentations=1, batch_size=64, workers=0, key=None):
+    """
+    Runs the frozen backbone over `dataset` `augmentations` times and stores the
+    pooled features as a float16 (N * augmentations, D) array with labels;
+    `key` (see cache_key) is recorded in meta.json.
+
+    The backbone runs in eval mode, so BatchNorm uses its ImageNet running
+    statistics, exactly like app.py at inference time.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+    feature_dim = model.classifier[-1].in_features
+    count = len(dataset) * augmentations
+
+    features = np.lib.format.open_memmap(
+        os.path.join(out_dir, "features.npy"), mode="w+", dtype=np.float16, shape=(count, feature_dim)
+    )
+    labels = np.empty(count, dtype=np.int64)
+
+    model.eval()
+    offset = 0
+    with torch.no_grad():
+        for aug in range(augmentations):
+            for images, targets in tqdm(loader, desc=f"Features {aug + 1}/{augmentations}"):
+                feats = pooled_features(model, images.to(device)).cpu().numpy()
+                features[offset:offset + len(feats)] = feats
+                labels[offset:offset + len(feats)] = targets.numpy()
+                offset += len(feats)
+
+    features.flush()
+    np.save(os.path.join(out_dir, "labels.npy"), labels)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({"count": count, "dim": feature_dim, "images": len(dataset),
+                   "augmentations": augmentations, **(key or {})}, f, indent=4)
+    return load_features(out_dir)
+
+
+def load_features(out_dir):
+    """Returns (float16 memmap of features, int64 labels, meta) for a cached split."""
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        meta = json.load(f)
+    features = np.load(os.path.join(out_dir, "features.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(out_dir, "labels.npy"))
+    return features, labels, meta
+
+
+def cache_key(model, dataset, augmentations):
+    return {
+        "augmentations": augmentations,
+        "dataset_sha256": dataset_fingerprint(dataset),
+        "backbone_sha256": backbone_fingerprint(model),
+    }
+
+
+def cached_or_extract(model, dataset, out_dir, device, augmentations=1, rebuild=False, **kwargs):
+    """Reuses cached features only if the image files, transform, backbone weights and augmentation count match."""
+    key = cache_key(model, dataset, augmentations)
+    meta_path = os.path.join(out_dir, "meta.json")
+    if not rebuild and os.path.exists(meta_path):
+        features, labels, meta = load_features(out_dir)
+        if all(meta.get(k) == v for k, v in key.items()):
+            print(f"✅ Reusing cached features from '{out_dir}'")
+            return features, labels, meta
+        print(f"♻️ Cached features in '{out_dir}' are stale; extracting again")
+    return extract_features(model, dataset, out_dir, device, augmentations, key=key, **kwargs)
+
+
+def train_head(head, train_features, train_labels, val_features, val_labels, device,
+               epochs=20, lr=1e-3, batch_size=256):
+    """
+    Trains the classifier head directly on cached features. Yields
+    (epoch, train_loss, val_loss, val_acc, best) after every epoch and keeps
+    the best (by val accuracy) head weights loaded at the end.
+    """
+    x_train = torch.from_numpy(np.asarray(train_features, dtype=np.float32)).to(device)
+    y_train = torch.from_numpy(train_labels).to(device)
+    x_val = torch.from_numpy(np.asarray(val_features, dtype=np.float32)).to(device)
+    y_val = torch.from_numpy(val_labels).to(device)
+
+    head = head.to(device)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    best_acc, best_state = -1.0, None
+
+    for epoch in range(epochs):
+        head.train()
+        permutation = torch.randperm(len(x_train), device=device)
+        train_loss = 0.0
+        for start in range(0, len(x_train), batch_size):
+            idx = permutation[start:start + batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(x_train[idx]), y_train[idx])
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item()
+
+        head.eval()
+        with torch.no_grad():
+            logits = head(x_val)
+            val_loss = criterion(logits, y_val).item()
+            val_acc = 100 * (logits.argmax(dim=1) == y_val).float().mean().item()
+
+        improved = val_acc > best_acc
+        if improved:
+            best_acc = val_acc
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+        yield epoch, train_loss, val_loss, val_acc, improved
+
+    head.load_state_dict(best_state)
@@ -1,5 +1,6 @@
 import React, { useState, useRef, useEffect } from "react";
 import chatbot from "../assets/chatbot.png";
+import { sessionHeaders, rememberSession } from "../session";
 
 const ChatBot = ({ t }) => {
   const [messages, setMessages] = useState([]);
@@ -37,10 +38,11 @@ const ChatBot = ({ t }) => {
     try {
       const res = await fetch("http://127.0.0.1:5000/api/chat", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...sessionHeaders() },
         body: JSON.stringify({ message: userMsg.text }),
       });
       const data = await res.json();
+      rememberSession(data);
       typeResponse(data.reply);
     } catch (error) {
       setMessages((prev) => [...prev, { sender: "bot", text: "Connection error. Please try again.", time: new Date() }]);
@@ -1,4 +1,5 @@
 import React, { useState, useRef } from "react";
+import { sessionHeaders, rememberSession } from "../session";
 
 const DiseaseForm = ({ t }) => {
   const [imgPreview, setImgPreview] = useState(null);
@@ -81,9 +82,11 @@ const DiseaseForm = ({ t }) => {
     try {
       const res = await fetch("http://127.0.0.1:5000/api/predict", {
         method: "POST",
+        headers: sessionHeaders(),
         body: formData,
       });
       const data = await res.json();
+      rememberSession(data);
       setResult(data);
     } catch (err) {
       console.error("Prediction error:", err);
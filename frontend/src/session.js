@@ -0,0 +1,12 @@
+// Chat context (last diagnosis) is kept per session on the server.
+// The session id is issued by the API and echoed back on every request.
+const SESSION_KEY = "betel_session_id";
+
+export const sessionHeaders = () => {
+  const id = localStorage.getItem(SESSION_KEY);
+  return id ? { "X-Session-ID": id } : {};
+};
+
+export const rememberSession = (data) => {
+  if (data?.session_id) localStorage.setItem(SESSION_KEY, data.session_id);
+};
@@ -0,0 +1,218 @@
+"""
+Vision stack for serving. Everything that needs torch/torchvision lives here,
+so importing app.py (and answering /api/chat) never waits for it; app.py
+imports this module on the model-loading path only.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision import models
+
+from model_registry import calibration_mismatch
+from preprocessing import BatchPreprocessor
+
+
+@contextmanager
+def _timed(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - started, 4)
+
+
+# ======================================================
+# MODEL ARCHITECTURE & LOADING
+# ======================================================
+def get_model(num_classes):
+    """Initializes EfficientNet-B0 with custom classifier head."""
+    model = models.efficientnet_b0(weights=None)
+    in_features = model.classifier[1].in_features
+    model.classifier = nn.Sequential(
+        nn.Dropout(p=0.5, inplace=True),
+        nn.Linear(in_features, num_classes)
+    )
+    return model
+
+def resolve_device(name):
+    if name == "auto":
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    return torch.device(name)
+
+def load_exported_model(path, device):
+    """Loads a TorchScript (optionally int8-quantized) artifact from export_model.py."""
+    extra_files = {"meta.json": ""}
+    try:
+        model = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+    except ValueError:
+        print(f"❌ Exported model '{path}' not found.")
+        return None, device
+
+    meta = json.loads(extra_files["meta.json"] or "{}")
+    if meta.get("variant", "").startswith("int8"):
+        # Quantized kernels run on CPU with the engine they were converted for
+        device = torch.device("cpu")
+        torch.backends.quantized.engine = meta.get("quantized_engine", torch.backends.quantized.engine)
+    model.to(device)
+    if meta.get("variant") == "fp32" and device.type == "cpu":
+        model = torch.jit.optimize_for_inference(model)
+    print(f"✅ Exported model ({meta.get('variant', 'unknown')}) loaded on {device}")
+    return model, device
+
+def load_weights(path, num_classes, device, mmap=True, timings=None):
+    """
+    Builds the network and loads a state_dict.
+
+    With `mmap`, the architecture is built on the meta device (no allocation or
+    random init) and the parameters are assigned straight from the memory-mapped
+    checkpoint, so weights are paged in from the file instead of being copied
+    into freshly allocated tensors.
+    """
+    timings = {} if timings is None else timings
+    if mmap:
+        try:
+            with _timed(timings, "load_weights"):
+                state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        except RuntimeError:
+            # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+            mmap = False
+    if mmap:
+        with _timed(timings, "build_model"):
+            with torch.device("meta"):
+                model = get_model(num_classes)
+            model.load_state_dict(state_dict, assign=True)
+    else:
+        with _timed(timings, "build_model"):
+            model = get_model(num_classes)
+        with _timed(timings, "load_weights"):
+            model.load_state_dict(torch.load(path, map_location=device))
+    model.to(device)
+    model.eval()
+    print(f"✅ Model loaded on {device}{' (mmap)' if mmap else ''}")
+    return model
+
+
+# ======================================================
+# INFERENCE ENGINE
+# ======================================================
+class InferenceEngine:
+    """
+    One loaded model version plus the device, class mapping and batch
+    preprocessor it is served with. Engines are immutable once built, so a
+    hot reload swaps whole engines and in-flight requests keep their own.
+    """
+
+    def __init__(self, model, device, preprocessor, classes, version=None, temperature=1.0):
+        self.model = model
+        self.device = device
+        self.preprocessor = preprocessor
+        self.classes = classes
+        self.version = version
+        # Temperature scaling from evaluate.py --fit-temperature; 1.0 leaves softmax unchanged
+        self.temperature = temperature
+        # Eager EfficientNet exposes its pooled features; TorchScript exports are opaque
+        self.has_embeddings = not isinstance(model, torch.jit.ScriptModule) and all(
+            hasattr(model, name) for name in ("features", "avgpool", "classifier"))
+
+    def forward_batch(self, img_arrays, with_embeddings=False):
+        """
+        Runs one forward pass over a list of HxWx3 uint8 arrays and returns
+        per-image probabilities; with `with_embeddings`, (probabilities,
+        pooled features or None) from the same pass.
+        """
+        batch = self.preprocessor.normalize(img_arrays).to(self.device)
+        embeddings = None
+        with torch.no_grad():
+            if with_embeddings and self.has_embeddings:
+                # Same computation as EfficientNet.forward, keeping the pooled features
+                embeddings = torch.flatten(self.model.avgpool(self.model.features(batch)), 1)
+                outputs = self.model.classifier(embeddings)
+                embeddings = embeddings.cpu()
+            else:
+                outputs = self.model(batch)
+            if self.temperature != 1.0:
+                outputs = outputs / self.temperature
+            probabilities = torch.softmax(outputs, dim=1).cpu()
+        return (probabilities, embeddings) if with_embeddings else probabilities
+
+    @staticmethod
+    def top_k(probabilities, k):
+        """[(class_index, probability), ...] for the k most likely classes."""
+        top_probs, top_indices = torch.topk(probabilities, k)
+        return [(int(idx), float(prob)) for prob, idx in zip(top_probs, top_indices)]
+
+    @staticmethod
+    def mean_probabilities(probabilities):
+        """Averages per-view softmax outputs (test-time augmentation)."""
+        return torch.stack(probabilities).mean(dim=0)
+
+    def warmup(self):
+        """Runs one dummy batch so the first real request does not pay for lazy kernel setup."""
+        size = self.preprocessor.size
+        self.forward_batch([np.zeros((size, size, 3), dtype=np.uint8)])
+
+    @staticmethod
+    def torch_threads():
+        return torch.get_num_threads()
+
+
+def load_temperature(artifact):
+    """
+    Temperature fitted by evaluate.py for the artifact's weights, or 1.0 when
+    there is no calibration file or it was fitted on other weights.
+    """
+    path = artifact.calibration
+    if not path or not os.path.exists(path):
+        return 1.0
+    reason = calibration_mismatch(path, artifact.weights_sha256)
+    if reason:
+        print(f"⚠️ Ignoring calibration file '{path}': {reason}")
+        return 1.0
+    try:
+        with open(path) as f:
+            temperature = float(json.load(f)["temperature"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ Ignoring invalid calibration file '{path}': {e}")
+        return 1.0
+    print(f"🌡️ Applying temperature {temperature:.3f} from {path}")
+    return temperature
+
+def load_classes(path):
+    with open(path, "r") as f:
+        class_indices = json.load(f)
+    # Ensure indices are integers for mapping
+    return {int(v): k for k, v in class_indices.items()}
+
+def load_engine(config, artifact, timings=None):
+    """Loads a model artifact (see model_registry.py); returns an InferenceEngine or None."""
+    timings = {} if timings is None else timings
+    try:
+        classes = load_classes(artifact.class_index)
+    except (OSError, ValueError) as e:
+        print(f"❌ Error loading class indices for {artifact.version}: {e}")
+        return None
+
+    device = resolve_device(config.DEVICE)
+    if artifact.format == "torchscript":
+        with _timed(timings, "load_weights"):
+            model, device = load_exported_model(artifact.weights, device)
+    else:
+        try:
+            model = load_weights(artifact.weights, len(classes), device, config.MMAP_WEIGHTS, timings)
+        except FileNotFoundError:
+            print(f"❌ Weights file '{artifact.weights}' not found.")
+            model = None
+    if model is None:
+        return None
+
+    preprocessor = BatchPreprocessor(config.IMG_SIZE, config.BATCH_MAX_SIZE, use_draft=config.JPEG_DRAFT_DECODE)
+    engine = InferenceEngine(model, device, preprocessor, classes, artifact.version,
+                             load_temperature(artifact))
+    with _timed(timings, "warmup"):
+        engine.warmup()
+    return engine
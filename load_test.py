@@ -0,0 +1,355 @@
+"""
+Load generator for the HTTP API: replays images against /api/predict and
+messages against /api/chat at a fixed concurrency and reports latency
+percentiles, throughput and error rate.
+
+Runs fully offline. By default it drives app.py in-process via the Flask test
+client; --url points it at a running server (app.py, serve.py, async_app.py).
+It replays synthetic leaf photos, or the images in --images.
+
+In-process runs keep every production stage (quality gate, drift monitor,
+upload persistence), so the numbers are comparable to serving; uploads go to
+a throwaway folder instead of the real store. --isolate switches those
+stages off to measure decode + inference alone; the stages a run covered are
+saved with it, and --compare warns when they differ from the baseline's.
+
+    python load_test.py --concurrency 8 --requests 400 --save-baseline
+    python load_test.py --compare runs/load_baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+BASELINE_PATH = os.path.join("runs", "load_baseline.json")
+CHAT_MESSAGES = [
+    "hello",
+    "what is the treatment?",
+    "how do I stop leaf spot from spreading",
+    "which fertilizer should I use",
+    "is it safe to harvest",
+    "thanks!",
+    "why are my betel leaves turning yellow",
+]
+
+
+# ======================================================
+# WORKLOAD
+# ======================================================
+def synthetic_leaves(count=8, size=(640, 480), seed=0):
+    """
+    Leaf-like JPEGs: a textured green ellipse with a midrib on a soil-coloured
+    background, sharp and evenly exposed, so they pass the quality gate.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    images = []
+    for i in range(count):
+        cx, cy = rng.uniform(0.4, 0.6) * width, rng.uniform(0.4, 0.6) * height
+        a, b = rng.uniform(0.3, 0.45) * width, rng.uniform(0.3, 0.45) * height
+        leaf = ((xx - cx) / a) ** 2 + ((yy - cy) / b) ** 2 <= 1
+        pixels = np.empty((height, width, 3), dtype=np.float32)
+        pixels[:] = (105, 85, 65)
+        pixels += rng.normal(0, 10, (height, width, 1))
+        green = np.array([60, 140, 45]) * rng.uniform(0.8, 1.2)
+        pixels[leaf] = green + rng.normal(0, 16, (int(leaf.sum()), 3))
+        pixels[leaf & (np.abs(yy - cy) < 3)] *= 0.7
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+        images.append((f"synthetic_leaf_{i}.jpg", buffer.getvalue()))
+    return images
+
+
+def load_images(folder=None, limit=None):
+    """(filename, bytes) for every image in `folder`, or synthetic leaves without one."""
+    images = []
+    if folder:
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), "rb") as f:
+                    images.append((name, f.read()))
+        if not images:
+            sys.exit(f"❌ No images in '{folder}'")
+    else:
+        images = synthetic_leaves()
+    return images[:limit] if limit else images
+
+
+def bust_cache(image_bytes):
+    """
+    Appends random trailing bytes: decoders ignore data after the end marker,
+    but the content hash changes, so every request reaches run_inference.
+    """
+    return image_bytes + uuid.uuid4().bytes
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                   f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(data)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+# ======================================================
+# TRANSPORTS
+# ======================================================
+class InProcessClient:
+    """Drives app.py through the Flask test client (one client per thread)."""
+
+    def __init__(self, isolate=False):
+        import app
+        from upload_store import UploadStore
+        self._upload_dir = None
+        if isolate:
+            app.upload_store = None
+            app.quality_gate = None
+            app.drift_monitor = None
+        elif app.upload_store is not None:
+            # Same writer and retention work, but replays never land in (or evict from) the real store
+            self._upload_dir = tempfile.mkdtemp(prefix="load-test-uploads-")
+            store = app.upload_store
+            app.upload_store = UploadStore(self._upload_dir, store.max_files, store.max_bytes, store.max_age_seconds)
+        self.stages = {
+            "quality_gate": app.quality_gate_mode if app.quality_gate is not None else "off",
+            "drift_monitor": app.drift_monitor is not None,
+            "persist_uploads": app.upload_store is not None,
+        }
+        self.app = app.app
+        self._local = threading.local()
+
+    def close(self):
+        if self._upload_dir is not None:
+            shutil.rmtree(self._upload_dir, ignore_errors=True)
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def predict(self, filename, data, session_id):
+        response = self._client().post(
+            "/api/predict",
+            data={"image": (io.BytesIO(data), filename), "session_id": session_id},
+            content_type="multipart/form-data",
+        )
+        return response.status_code
+
+    def chat(self, message, session_id):
+        response = self._client().post("/api/chat", json={"message": message, "session_id": session_id})
+        return response.status_code
+
+
+class HttpClient:
+    """Drives a running server over HTTP using only the standard library."""
+
+    # Whatever the target server is configured with
+    stages = "server"
+
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def close(self):
+        pass
+
+    def _post(self, path, body, content_type):
+        request = urllib.request.Request(self.url + path, data=body, headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def predict(self, filename, data, session_id):
+        body, content_type = encode_multipart({"session_id": session_id}, {"image": (filename, data)})
+        return self._post("/api/predict", body, content_type)
+
+    def chat(self, message, session_id):
+        body = json.dumps({"message": message, "session_id": session_id}).encode()
+        return self._post("/api/chat", body, "application/json")
+
+
+# ======================================================
+# RUNNER & REPORTING
+# ======================================================
+def summarize(samples, elapsed):
+    """samples: list of (latency_seconds, status_code)."""
+    if not samples:
+        return {"requests": 0}
+    latencies = np.array([s[0] for s in samples]) * 1000
+    errors = sum(1 for _, status in samples if status >= 400 or status == 0)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "error_rate": round(errors / len(samples), 4),
+        "status_codes": {str(k): v for k, v in sorted(Counter(s[1] for s in samples).items())},
+        "latency_ms": {
+            "mean": round(float(latencies.mean()), 2),
+            "p50": round(float(p50), 2),
+            "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2),
+            "max": round(float(latencies.max()), 2),
+        },
+    }
+
+
+def run_load(client, images, concurrency, total, chat_ratio, unique, warmup, seed=0):
+    rng = random.Random(seed)
+    # Pre-draw the whole schedule so every configuration replays the same mix
+    schedule = []
+    for i in range(warmup + total):
+        if rng.random() < chat_ratio:
+            schedule.append(("chat", rng.choice(CHAT_MESSAGES)))
+        else:
+            schedule.append(("predict", images[i % len(images)]))
+    sessions = [uuid.uuid4().hex for _ in range(concurrency)]
+
+    def fire(i):
+        kind, item = schedule[i]
+        session_id = sessions[i % concurrency]
+        started = time.perf_counter()
+        try:
+            if kind == "chat":
+                status = client.chat(item, session_id)
+            else:
+                filename, data = item
+                status = client.predict(filename, bust_cache(data) if unique else data, session_id)
+        except Exception:
+            status = 0
+        return kind, time.perf_counter() - started, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fire, range(warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(fire, range(warmup, warmup + total)))
+        elapsed = time.perf_counter() - started
+
+    report = {"overall": summarize([(latency, status) for _, latency, status in results], elapsed)}
+    for kind in ("predict", "chat"):
+        subset = [(latency, status) for k, latency, status in results if k == kind]
+        if subset:
+            report[kind] = summarize(subset, elapsed)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Prints per-endpoint deltas; returns False if p95 or error rate regressed beyond tolerance."""
+    ok = True
+    for endpoint in ("predict", "chat", "overall"):
+        if endpoint not in report or endpoint not in baseline:
+            continue
+        now, before = report[endpoint], baseline[endpoint]
+        for metric in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"][metric], now["latency_ms"][metric]
+            change = (new - old) / old if old else 0.0
+            regressed = metric == "p95" and change > tolerance
+            ok &= not regressed
+            print(f"{'❌' if regressed else '  '} {endpoint:<8} {metric}: {old:>9.2f} -> {new:>9.2f} ms ({change:+.1%})")
+        if now["error_rate"] > before["error_rate"] + 0.01:
+            ok = False
+            print(f"❌ {endpoint:<8} error rate: {before['error_rate']:.2%} -> {now['error_rate']:.2%}")
+    return ok
+
+
+def print_report(report):
+    for endpoint, stats in report.items():
+        if not stats.get("requests"):
+            continue
+        lat = stats["latency_ms"]
+        print(f"📊 {endpoint:<8} n={stats['requests']:<6} {stats['throughput_rps']:>8.2f} req/s  "
+              f"p50={lat['p50']:.1f}ms p95={lat['p95']:.1f}ms p99={lat['p99']:.1f}ms  "
+              f"errors={stats['error_rate']:.2%} {stats['status_codes']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test /api/predict and /api/chat.")
+    parser.add_argument("--url", default=None, help="Target a running server instead of the in-process app")
+    parser.add_argument("--images", default=None, help="Folder of images to replay (default: synthetic leaves)")
+    parser.add_argument("--max-images", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests per concurrency level")
+    parser.add_argument("--chat-ratio", type=float, default=0.2, help="Fraction of requests sent to /api/chat")
+    parser.add_argument("--allow-cache", action="store_true",
+                        help="Replay identical bytes (measures the prediction cache, not run_inference)")
+    parser.add_argument("--isolate", action="store_true",
+                        help="In-process: skip the quality gate, drift monitor and upload persistence")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, default=None)
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 regression")
+    args = parser.parse_args(argv)
+
+    images = load_images(args.images, args.max_images)
+    client = HttpClient(args.url) if args.url else InProcessClient(args.isolate)
+    print(f"🚀 {len(images)} images, target={args.url or 'in-process'}, stages={client.stages}")
+
+    runs = {}
+    try:
+        for concurrency in args.concurrency:
+            print(f"\n⚙️ concurrency={concurrency}")
+            report = run_load(client, images, concurrency, args.requests, args.chat_ratio,
+                              unique=not args.allow_cache, warmup=args.warmup)
+            print_report(report)
+            runs[str(concurrency)] = report
+    finally:
+        client.close()
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.url or "in-process",
+        "stages": client.stages,
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare")},
+        "runs": runs,
+    }
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("stages") != client.stages:
+            print(f"⚠️ Baseline covered stages {baseline.get('stages')}, this run {client.stages}; "
+                  f"the numbers are not like for like")
+        ok = True
+        for concurrency, report in runs.items():
+            if concurrency in baseline["runs"]:
+                print(f"\n🔎 concurrency={concurrency} vs {args.compare}")
+                ok &= compare(report, baseline["runs"][concurrency], args.tolerance)
+        print("\n✅ No regression" if ok else "\n❌ Regression detected")
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""
+Low-overhead instrumentation: Prometheus-style counters, gauges and
+histograms, plus per-request stage traces linked by a request ID.
+
+Recording a stage is a perf_counter() pair and one short critical section,
+so it is safe to leave on in production. The active request's trace lives in
+a thread-local, so inference code can call `stage()` without threading a
+trace object through every function.
+
+Under pre-forked workers (serve.py) every process records its own values;
+`enable_multiprocess()` makes each worker publish them to a shared directory
+so any worker can answer /metrics and trace lookups for all of them.
+"""
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+
+# ======================================================
+# METRIC TYPES
+# ======================================================
+class Counter:
+    """
+    A monotonically increasing count, or one sampled from `fn()` at scrape
+    time (e.g. a total another component keeps). With `label`, `fn()` returns
+    a {label_value: value} dict, one sample per entry.
+    """
+    kind = "counter"
+
+    def __init__(self, name, help_text, fn=None, label=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            value = self.fn()
+            if value is None:
+                return []
+            if self.label is not None:
+                return [(self.name, _label_key({self.label: k}), v) for k, v in value.items()]
+            return [(self.name, (), value)]
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """
+    A settable value, or one sampled from `fn()` at scrape time. Across
+    workers each one is exported with a `worker` label, unless `cluster_wide`
+    says `fn()` already covers every worker.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn=None, label=None, cluster_wide=False):
+        super().__init__(name, help_text, fn, label)
+        self.cluster_wide = cluster_wide
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        samples = []
+        for key, series in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, round(series[-1], 6)))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._scrape_hooks = []
+        # key -> fn() returning per-process state that workers publish to each other
+        self._shared = {}
+        self._broadcast_handlers = {}
+        # Set by enable_multiprocess(); None keeps everything in this process
+        self.multiprocess = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def on_scrape(self, fn):
+        """Calls `fn()` once at the start of every render, e.g. to compute a value several gauges share."""
+        self._scrape_hooks.append(fn)
+        return fn
+
+    def share(self, key, fn):
+        """Publishes `fn()` (JSON-serializable) per worker; read back with shared_state(key)."""
+        self._shared[key] = fn
+
+    def on_broadcast(self, name, fn):
+        """Calls `fn()` in every worker when any of them calls broadcast(name)."""
+        self._broadcast_handlers.setdefault(name, []).append(fn)
+
+    def collect(self):
+        """(metric, samples) pairs; summed across workers when multiprocess is enabled."""
+        if self.multiprocess is not None:
+            return self.multiprocess.collect(self._metrics)
+        return [(metric, metric.samples()) for metric in self._metrics]
+
+    def shared_state(self, key):
+        """`share(key)` values of every live worker (just this process's without multiprocess)."""
+        if self.multiprocess is not None:
+            return self.multiprocess.shared(key)
+        return [self._shared[key]()]
+
+    def broadcast(self, name):
+        """Runs the `on_broadcast(name)` handlers here now and in other workers on their next flush."""
+        for fn in self._broadcast_handlers.get(name, []):
+            fn()
+        if self.multiprocess is not None:
+            self.multiprocess.broadcast(name)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        for hook in self._scrape_hooks:
+            hook()
+        lines = []
+        for metric, samples in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in samples:
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# ======================================================
+# REQUEST TRACES
+# ======================================================
+class RequestTrace:
+    __slots__ = ("request_id", "endpoint", "started_at", "stages", "status", "total_ms", "_t0")
+
+    def __init__(self, request_id, endpoint):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self.stages = {}
+        self.status = None
+        self.total_ms = None
+        self._t0 = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def finish(self, status):
+        self.status = status
+        self.total_ms = (time.perf_counter() - self._t0) * 1000
+        return self.total_ms / 1000
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "started_at": self.started_at,
+            "status": self.status,
+            "total_ms": round(self.total_ms, 3) if self.total_ms is not None else None,
+            "stages_ms": {stage: round(ms, 3) for stage, ms in self.stages.items()},
+        }
+
+
+class TraceStore:
+    """The most recent `max_entries` finished traces, looked up by request ID."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+
+    def put(self, trace):
+        with self._lock:
+            self._traces[trace.request_id] = trace
+            while len(self._traces) > self.max_entries:
+                self._traces.popitem(last=False)
+
+    def get(self, request_id):
+        with self._lock:
+            return self._traces.get(request_id)
+
+
+# ======================================================
+# MULTIPROCESS (pre-forked workers)
+# ======================================================
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MultiprocessCollector:
+    """
+    Shares metrics, traces and `Registry.share()` state between pre-forked
+    workers through files in `directory`.
+
+    A background thread in each worker rewrites `<pid>.json` with its samples
+    every `interval` seconds and appends its finished traces to
+    `traces-<pid>.jsonl`. A scrape sums counters and histograms over every
+    worker that ever published (so totals do not go backwards when one is
+    replaced) and exports gauges per live worker with a `worker` label.
+    Other workers' values are up to `interval` seconds old.
+    """
+
+    def __init__(self, directory, registry, traces, interval=1.0):
+        self.directory = directory
+        self.registry = registry
+        self.traces = traces
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending_traces = deque()
+        self._trace_lines = 0
+        self._broadcasts_seen = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def ensure_started(self):
+        """Starts this process's publisher thread (again after fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending_traces.clear()
+                self._trace_lines = 0
+                self._broadcasts_seen = {name: self._broadcast_stamp(name)
+                                         for name in self.registry._broadcast_handlers}
+                threading.Thread(target=self._loop, name="metrics-publisher", daemon=True).start()
+                atexit.register(self.flush)
+                self._pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Failed to publish metrics: {e}")
+
+    def flush(self):
+        """Runs pending broadcast handlers, then publishes this worker's samples, shared state and traces."""
+        self._check_broadcasts()
+        state = {
+            "pid": os.getpid(),
+            "metrics": {metric.name: metric.samples() for metric in self.registry._metrics
+                        if not getattr(metric, "cluster_wide", False)},
+            "shared": {key: fn() for key, fn in self.registry._shared.items()},
+        }
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with self._flush_lock:
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f, default=float)
+            os.replace(path + ".tmp", path)
+            self._write_traces()
+
+    def _read_workers(self):
+        workers = {}
+        for path in glob.glob(os.path.join(self.directory, "[0-9]*.json")):
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            workers[state["pid"]] = state
+        return workers
+
+    def collect(self, metrics):
+        self.ensure_started()
+        self.flush()
+        workers = self._read_workers()
+        live = sorted(pid for pid in workers if _pid_alive(pid))
+        collected = []
+        for metric in metrics:
+            if getattr(metric, "cluster_wide", False):
+                collected.append((metric, metric.samples()))
+            elif metric.kind == "gauge":
+                collected.append((metric, [
+                    (name, tuple(map(tuple, key)) + (("worker", pid),), value)
+                    for pid in live for name, key, value in workers[pid]["metrics"].get(metric.name, [])
+                ]))
+            else:
+                totals = {}
+                for state in workers.values():
+                    for name, key, value in state["metrics"].get(metric.name, []):
+                        sample = (name, tuple(map(tuple, key)))
+                        totals[sample] = totals.get(sample, 0) + value
+                collected.append((metric, [(name, key, round(value, 6) if isinstance(value, float) else value)
+                                           for (name, key), value in totals.items()]))
+        return collected
+
+    def shared(self, key):
+        """`key`'s shared state from every live worker; this worker's is read fresh."""
+        own = os.getpid()
+        values = [self.registry._shared[key]()]
+        for pid, state in self._read_workers().items():
+            if pid != own and key in state["shared"] and _pid_alive(pid):
+                values.append(state["shared"][key])
+        return values
+
+    # ---------------- traces ----------------
+    def record_trace(self, trace):
+        self._pending_traces.append(trace.to_dict())
+
+    def _write_traces(self):
+        if not self._pending_traces:
+            return
+        lines = []
+        while self._pending_traces:
+            lines.append(json.dumps(self._pending_traces.popleft()) + "\n")
+        path = os.path.join(self.directory, f"traces-{os.getpid()}.jsonl")
+        if self._trace_lines + len(lines) > self.traces.max_entries:
+            # One previous generation is kept, so at least the last max_entries stay findable
+            if os.path.exists(path):
+                os.replace(path, os.path.join(self.directory, f"traces-{os.getpid()}.old.jsonl"))
+            self._trace_lines = 0
+        with open(path, "a") as f:
+            f.writelines(lines)
+        self._trace_lines += len(lines)
+
+    def find_trace(self, request_id):
+        """The latest published trace with this ID from any worker, as a dict."""
+        prefix = json.dumps({"request_id": request_id})[:-1] + ", "
+        found = None
+        for path in glob.glob(os.path.join(self.directory, "traces-*.jsonl")):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if line.startswith(prefix):
+                            trace = json.loads(line)
+                            if found is None or trace["started_at"] > found["started_at"]:
+                                found = trace
+            except (OSError, ValueError):
+                continue
+        return found
+
+    # ---------------- broadcasts ----------------
+    def _broadcast_stamp(self, name):
+        try:
+            return os.stat(os.path.join(self.directory, f"broadcast-{name}")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def broadcast(self, name):
+        with open(os.path.join(self.directory, f"broadcast-{name}"), "w") as f:
+            f.write(str(time.time()))
+        # The caller has already run its handlers
+        self._broadcasts_seen[name] = self._broadcast_stamp(name)
+
+    def _check_broadcasts(self):
+        for name, handlers in self.registry._broadcast_handlers.items():
+            stamp = self._broadcast_stamp(name)
+            if stamp != self._broadcasts_seen.get(name):
+                self._broadcasts_seen[name] = stamp
+                for fn in handlers:
+                    fn()
+
+
+# ======================================================
+# DEFAULT REGISTRY
+# ======================================================
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "betel_stage_seconds", "Time spent per request stage."))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "betel_request_seconds", "End-to-end request latency by endpoint and status."))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "betel_requests_total", "Requests served by endpoint and status."))
+PREDICTIONS_TOTAL = REGISTRY.register(Counter(
+    "betel_predictions_total", "Top-1 predictions by class and severity bucket."))
+TTA_TOTAL = REGISTRY.register(Counter(
+    "betel_tta_total", "Predictions that ran test-time augmentation, by mode."))
+QUALITY_REJECTED_TOTAL = REGISTRY.register(Counter(
+    "betel_quality_rejected_total", "Quality gate failures by reason and mode (an image can fail several checks)."))
+QUALITY_REJECTED_IMAGES_TOTAL = REGISTRY.register(Counter(
+    "betel_quality_rejected_images_total", "Images failing at least one quality check, by mode."))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "betel_model_load_seconds", "Time taken to load the served model."))
+TRACES = TraceStore()
+
+_local = threading.local()
+
+
+def new_request_id(incoming=None):
+    """Reuses a sane caller-supplied ID (so traces join up across proxies) or makes one."""
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def activate(trace):
+    """Makes `trace` the current thread's trace; returns the previous one for restore."""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    return previous
+
+
+def record(stage_name, seconds, trace=None):
+    """Observes a stage; charges it to `trace`, or else to the current thread's trace."""
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    trace = trace or current_trace()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - started)
+
+
+def run_traced(trace, fn, *args):
+    """Calls fn(*args) with `trace` active, e.g. on an executor thread."""
+    previous = activate(trace)
+    try:
+        return fn(*args)
+    finally:
+        activate(previous)
+
+
+def enable_multiprocess(directory, interval=1.0):
+    """Shares REGISTRY and TRACES between pre-forked workers through `directory`; call before forking."""
+    REGISTRY.multiprocess = MultiprocessCollector(directory, REGISTRY, TRACES, interval)
+    return REGISTRY.multiprocess
+
+
+def find_trace(request_id):
+    """A recent trace as a dict, from this process or (with multiprocess) any worker."""
+    trace = TRACES.get(request_id)
+    if trace is not None:
+        return trace.to_dict()
+    if REGISTRY.multiprocess is not None:
+        return REGISTRY.multiprocess.find_trace(request_id)
+    return None
+
+
+def finish_request(trace, status):
+    seconds = trace.finish(status)
+    REQUEST_SECONDS.observe(seconds, endpoint=trace.endpoint, status=status)
+    REQUESTS_TOTAL.inc(endpoint=trace.endpoint, status=status)
+    TRACES.put(trace)
+    if REGISTRY.multiprocess is not None:
+        REGISTRY.multiprocess.ensure_started()
+        REGISTRY.multiprocess.record_trace(trace)
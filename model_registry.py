@@ -0,0 +1,230 @@
+"""
+Versioned model registry on disk.
+
+    models/
+      CURRENT                      <- name of the active version
+      20261017-120501-ab12cd/
+        model.pth | model.ts       <- weights (state_dict) or a TorchScript export
+        class_indices.json
+        calibration.json           <- optional, from evaluate.py --fit-temperature
+        meta.json                  <- includes weights_sha256
+
+A calibration file records the digest of the weights it was fitted on;
+publishing refuses one that does not match, and loading ignores it with a
+warning, so a stale top-level calibration.json never rescales new weights.
+
+Versions are immutable once published; activating one rewrites CURRENT
+atomically, which a serving process picks up through its file watch or the
+admin reload endpoint. Without a registry, the legacy top-level files are
+served as a single pseudo-version that changes whenever they are rewritten.
+
+    python model_registry.py publish betel_leaf_model.pth --calibration calibration.json --activate
+    python model_registry.py list
+    python model_registry.py activate <version>
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+import zipfile
+
+from prediction_cache import file_signature
+
+REGISTRY_DIR = "models"
+CURRENT_FILE = "CURRENT"
+WEIGHTS_NAMES = {"eager": "model.pth", "torchscript": "model.ts"}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weights_sha256(weights):
+    """
+    Identity of the weights a calibration file must have been fitted on: the
+    file's digest, or for a TorchScript export (export_model.py) the digest of
+    the eager weights it was exported from.
+    """
+    if weights.endswith(".ts"):
+        try:
+            with zipfile.ZipFile(weights) as archive:
+                name = next(n for n in archive.namelist() if n.endswith("/extra/meta.json"))
+                source = json.loads(archive.read(name)).get("source_sha256")
+        except (OSError, ValueError, StopIteration, zipfile.BadZipFile):
+            source = None
+        if source:
+            return source
+    return file_sha256(weights)
+
+
+def calibration_mismatch(path, digest):
+    """Why the calibration file at `path` must not be applied to weights `digest`; None if it fits."""
+    try:
+        with open(path) as f:
+            fitted = json.load(f).get("weights_sha256")
+    except (OSError, ValueError, AttributeError) as e:
+        return f"it could not be read ({e})"
+    if fitted is None:
+        return "it does not record which weights it was fitted on; re-run evaluate.py --fit-temperature"
+    if fitted != digest:
+        return f"it was fitted on other weights ({fitted[:12]}, these are {digest[:12]})"
+    return None
+
+
+class ModelArtifact:
+    """Everything needed to load one model version."""
+    __slots__ = ("version", "weights", "format", "class_index", "calibration", "_weights_sha256")
+
+    def __init__(self, version, weights, format, class_index, calibration, weights_sha256=None):
+        self.version = version
+        self.weights = weights
+        self.format = format
+        self.class_index = class_index
+        self.calibration = calibration
+        self._weights_sha256 = weights_sha256
+
+    @property
+    def weights_sha256(self):
+        """Recorded at publish time for registry versions; hashed on first use for legacy files."""
+        if self._weights_sha256 is None:
+            self._weights_sha256 = weights_sha256(self.weights)
+        return self._weights_sha256
+
+    def signature(self):
+        return file_signature(self.weights, self.class_index, self.calibration)
+
+
+def legacy_artifact(weights, format, class_index, calibration):
+    """The top-level files as a pseudo-version named after their current size/mtime."""
+    artifact = ModelArtifact(None, weights, format, class_index, calibration)
+    digest = hashlib.sha1(repr(artifact.signature()).encode()).hexdigest()[:10]
+    artifact.version = f"legacy-{digest}"
+    return artifact
+
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def versions(self):
+        """Published versions, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(self._path(name, "meta.json")))
+
+    def current(self):
+        try:
+            with open(self._path(CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def current_signature(self):
+        """Changes whenever CURRENT is rewritten; cheap enough to poll."""
+        return file_signature(self._path(CURRENT_FILE))
+
+    def meta(self, version):
+        with open(self._path(version, "meta.json")) as f:
+            return json.load(f)
+
+    def artifact(self, version):
+        meta = self.meta(version)
+        calibration = self._path(version, "calibration.json")
+        return ModelArtifact(
+            version,
+            self._path(version, WEIGHTS_NAMES[meta["format"]]),
+            meta["format"],
+            self._path(version, "class_indices.json"),
+            calibration,
+            meta.get("weights_sha256"),
+        )
+
+    def activate(self, version):
+        if version not in self.versions():
+            raise KeyError(f"Unknown model version '{version}'")
+        tmp_path = self._path(f"{CURRENT_FILE}.tmp.{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            f.write(version + "\n")
+        os.replace(tmp_path, self._path(CURRENT_FILE))
+
+    def publish(self, weights, class_index, calibration=None, version=None, activate=False, **meta):
+        """
+        Copies the files into a new immutable version directory; returns the
+        version name. Raises ValueError if `calibration` was not fitted on `weights`.
+        """
+        format = "torchscript" if weights.endswith(".ts") else "eager"
+        version = version or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        final_dir = self._path(version)
+        if os.path.exists(final_dir):
+            raise FileExistsError(f"Model version '{version}' already exists")
+        digest = weights_sha256(weights)
+        if calibration:
+            reason = calibration_mismatch(calibration, digest)
+            if reason:
+                raise ValueError(f"Refusing to attach '{calibration}': {reason}")
+
+        # Build in a temp dir and rename, so a half-copied version is never visible
+        tmp_dir = self._path(f".{version}.tmp")
+        os.makedirs(tmp_dir)
+        shutil.copy2(weights, os.path.join(tmp_dir, WEIGHTS_NAMES[format]))
+        shutil.copy2(class_index, os.path.join(tmp_dir, "class_indices.json"))
+        if calibration:
+            shutil.copy2(calibration, os.path.join(tmp_dir, "calibration.json"))
+        meta = {"version": version, "format": format, "source": os.path.abspath(weights),
+                "weights_sha256": digest, "published_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **meta}
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(tmp_dir, final_dir)
+
+        if activate:
+            self.activate(version)
+        return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    parser.add_argument("--root", default=REGISTRY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish = sub.add_parser("publish", help="Register a trained model as a new version")
+    publish.add_argument("weights")
+    publish.add_argument("--class-index", default="class_indices.json")
+    publish.add_argument("--calibration", default=None,
+                         help="calibration.json from evaluate.py --fit-temperature on these weights")
+    publish.add_argument("--version", default=None)
+    publish.add_argument("--activate", action="store_true")
+    sub.add_parser("list", help="Show published versions")
+    activate = sub.add_parser("activate", help="Point CURRENT at a version (servers reload it)")
+    activate.add_argument("version")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.root)
+    if args.command == "publish":
+        try:
+            version = registry.publish(args.weights, args.class_index, args.calibration, args.version, args.activate)
+        except (ValueError, FileExistsError) as e:
+            raise SystemExit(f"❌ {e}")
+        print(f"✅ Published {version}{' (active)' if args.activate else ''}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+        print(f"✅ Activated {args.version}")
+    else:
+        current = registry.current()
+        for version in registry.versions():
+            meta = registry.meta(version)
+            print(f"{'*' if version == current else ' '} {version}  {meta['format']:<11} {meta['published_at']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,335 @@
-# import os
-# import shutil
-
-# # Define the source (where your current folders are) and the destination
-# source_dir = "raw_dataset"  # Update this to your current folder path
-# base_dir = "dataset"
-
-# # Define the folder mapping based on your screenshots
-# mapping = {
-#     "Healthy": [
-#         "Cut_Green_Yellow_50", 
-#         "Deformed_Shrinked_Green_100", 
-#         "Deformed_Shrinked_Green_200",
-#         "Light_Yellow_Green_100"
-#     ],
-#     "Leaf_Spot": [
-#         "Brown_Spot_Fungus_Light_Colored_100",
-#         "Brown_Spot_Large_Number_Small_Size_100",
-#         "Dark_Brown_Spot_Edge_Yellow_Green_156",
-#         "Dark_Brown_Spot_Light_Colored_100",
-#         "Green_Leaf_White_Powder_Spot_100",
-#         "Green_Yellow_Black_Spotted_201",
-#         "GreenYellow_Black_Spotted_200",
-#         "Light_Coloured_Spotted_200",
-#         "Distorted_Colours_Brown_Spots_100",
-#         "Yellow_Black_Spotted_200",
-#         "Yellow_Black_Spottted_Leaf_200",
-#         "Yellow_Brown_Big_Spot_200"
-#     ],
-#     "Leaf_Rot": [
-#         "Brown_Fungus_200",
-#         "Green_Fungus_200",
-#         "Yellow_Black_Spotted_Fungus_Back_100"
-#     ],
-#     "Bacterial_Blight": [
-#         "Complete_Yellow_Dark_Black_Spot_200",
-#         "Cut_Brown_Edge_Yellow_100",
-#         "Cut_Brown_Spot_Yellow_100",
-#         "Deformed_Partially_Yellow_100",
-#         "Deformed_Yellow_Leaf_Blackspots_Edge_200",
-#         "Light_Yellow_Green_Dark_Spot_100",
-#         "Light_Yellow_Green_Less_Brown_Spot_100",
-#         "Partial_Yellow_Black_Spotted_Border_200",
-#         "White_Patch_Light_Green_Yellow_Spotted_200",
-#         "Yellow_Brown_Deformed_200",
-#         "Yellow_Green_Brown_Spotted_Cut_200"
-#     ]
-# }
-
-# def organize():
-#     for main_class, subfolders in mapping.items():
-#         # Create the 4 main class directories
-#         target_path = os.path.join(base_dir, main_class)
-#         os.makedirs(target_path, exist_ok=True)
-        
-#         for folder in subfolders:
-#             folder_path = os.path.join(source_dir, folder)
-#             if os.path.exists(folder_path):
-#                 print(f"Moving content from {folder} to {main_class}...")
-#                 for file_name in os.listdir(folder_path):
-#                     src_file = os.path.join(folder_path, file_name)
-#                     dst_file = os.path.join(target_path, f"{folder}_{file_name}")
-#                     # Use copy2 to keep metadata, or move to save space
-#                     shutil.copy2(src_file, dst_file)
-#             else:
-#                 print(f"Warning: Folder {folder} not found.")
-
-# if __name__ == "__main__":
-#     organize()
-#     print("\nDataset organization complete!")
+"""
+Incremental dataset organizer and train/val splitter.
+
+    python organize_dataset.py                         # split dataset/<class>/ into train/ and val/
+    python organize_dataset.py --organize raw_dataset  # first gather raw folders into classes
+
+Files are hashed once (a size/mtime-keyed cache skips unchanged ones), exact
+duplicates are dropped, and each image's split is derived from its content
+hash and the seed. An image therefore keeps its split as the dataset grows,
+and a rerun only touches new, changed or removed files. Outputs are hardlinks
+(or reflinks) where the filesystem allows, falling back to copies, and are
+written from a thread pool. The split is recorded in a CSV/JSON manifest.
+"""
+import argparse
+import csv
+import hashlib
+import json
 import os
 import shutil
-import random
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 DATASET_DIR = "dataset"
 TRAIN_DIR = os.path.join(DATASET_DIR, "train")
 VAL_DIR = os.path.join(DATASET_DIR, "val")
 SPLIT_RATIO = 0.8
+SEED = 42
+HASH_CACHE_FILE = ".hash_cache.json"
+MANIFEST_NAME = "split_manifest"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
 
 classes = ["Bacterial_Blight", "Healthy", "Leaf_Rot", "Leaf_Spot"]
 
-os.makedirs(TRAIN_DIR, exist_ok=True)
-os.makedirs(VAL_DIR, exist_ok=True)
+# Raw capture folders and the class each one belongs to
+RAW_MAPPING = {
+    "Healthy": [
+        "Cut_Green_Yellow_50",
+        "Deformed_Shrinked_Green_100",
+        "Deformed_Shrinked_Green_200",
+        "Light_Yellow_Green_100"
+    ],
+    "Leaf_Spot": [
+        "Brown_Spot_Fungus_Light_Colored_100",
+        "Brown_Spot_Large_Number_Small_Size_100",
+        "Dark_Brown_Spot_Edge_Yellow_Green_156",
+        "Dark_Brown_Spot_Light_Colored_100",
+        "Green_Leaf_White_Powder_Spot_100",
+        "Green_Yellow_Black_Spotted_201",
+        "GreenYellow_Black_Spotted_200",
+        "Light_Coloured_Spotted_200",
+        "Distorted_Colours_Brown_Spots_100",
+        "Yellow_Black_Spotted_200",
+        "Yellow_Black_Spottted_Leaf_200",
+        "Yellow_Brown_Big_Spot_200"
+    ],
+    "Leaf_Rot": [
+        "Brown_Fungus_200",
+        "Green_Fungus_200",
+        "Yellow_Black_Spotted_Fungus_Back_100"
+    ],
+    "Bacterial_Blight": [
+        "Complete_Yellow_Dark_Black_Spot_200",
+        "Cut_Brown_Edge_Yellow_100",
+        "Cut_Brown_Spot_Yellow_100",
+        "Deformed_Partially_Yellow_100",
+        "Deformed_Yellow_Leaf_Blackspots_Edge_200",
+        "Light_Yellow_Green_Dark_Spot_100",
+        "Light_Yellow_Green_Less_Brown_Spot_100",
+        "Partial_Yellow_Black_Spotted_Border_200",
+        "White_Patch_Light_Green_Yellow_Spotted_200",
+        "Yellow_Brown_Deformed_200",
+        "Yellow_Green_Brown_Spotted_Cut_200"
+    ]
+}
+
+
+# ======================================================
+# LINK / COPY
+# ======================================================
+FICLONE = 0x40049409  # Linux ioctl: share extents between two files (btrfs, xfs, ...)
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    shutil.copystat(src, dst)
+
+
+def place_file(src, dst, mode="auto"):
+    """Materializes `src` at `dst` by hardlink, reflink or copy; returns the method used."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            if mode == "hardlink":
+                raise
+    if mode in ("auto", "reflink") and sys.platform.startswith("linux"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if mode == "reflink":
+                raise
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def is_current(src, dst):
+    """True if `dst` already holds `src`: the same inode, or same size and mtime (copy2/copystat)."""
+    try:
+        d = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    s = os.stat(src)
+    if (s.st_dev, s.st_ino) == (d.st_dev, d.st_ino):
+        return True
+    return s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns
+
+
+def sync_files(pairs, workers, mode):
+    """Places every (src, dst) that is not already current, in parallel. Returns method counts."""
+    def sync(pair):
+        src, dst = pair
+        if is_current(src, dst):
+            return "unchanged"
+        return place_file(src, dst, mode)
+
+    for directory in {os.path.dirname(dst) for _, dst in pairs}:
+        os.makedirs(directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return Counter(pool.map(sync, pairs))
+
+
+def remove_stale(root, keep):
+    """Deletes image files under `root` that are not in `keep` (moved split, deleted source)."""
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and path not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+# ======================================================
+# HASHING (cached by size + mtime)
+# ======================================================
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(paths, cache_path, workers):
+    """{path: sha256}; only files whose size or mtime changed since the last run are read."""
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+
+    stats = {path: os.stat(path) for path in paths}
+    hashes, todo = {}, []
+    for path, st in stats.items():
+        entry = cache.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            hashes[path] = entry[2]
+        else:
+            todo.append(path)
+
+    # hashlib releases the GIL on large buffers, so threads hash in parallel
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, digest in zip(todo, pool.map(file_sha256, todo)):
+            hashes[path] = digest
+
+    new_cache = {path: [stats[path].st_size, stats[path].st_mtime_ns, hashes[path]] for path in paths}
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(new_cache, f)
+    os.replace(tmp_path, cache_path)
+    return hashes, len(todo)
+
+
+# ======================================================
+# ORGANIZE: raw capture folders -> dataset/<class>/
+# ======================================================
+def organize(source_dir, base_dir=DATASET_DIR, workers=8, mode="auto"):
+    pairs = []
+    for main_class, subfolders in RAW_MAPPING.items():
+        target_path = os.path.join(base_dir, main_class)
+        for folder in subfolders:
+            folder_path = os.path.join(source_dir, folder)
+            if not os.path.isdir(folder_path):
+                print(f"⚠️ Folder {folder} not found.")
+                continue
+            for file_name in sorted(os.listdir(folder_path)):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    pairs.append((os.path.join(folder_path, file_name),
+                                  os.path.join(target_path, f"{folder}_{file_name}")))
+    methods = sync_files(pairs, workers, mode)
+    print(f"📂 Organized {len(pairs)} raw images into {base_dir}/: {dict(methods)}")
+
+
+# ======================================================
+# SPLIT: dataset/<class>/ -> dataset/{train,val}/<class>/
+# ======================================================
+def split_of(sha256, seed, ratio):
+    """Deterministic per-image split: a seeded hash of the content, compared to the ratio."""
+    bucket = int(hashlib.sha256(f"{seed}:{sha256}".encode()).hexdigest()[:8], 16) / 0x100000000
+    return "train" if bucket < ratio else "val"
+
+
+def build_manifest(hashes, seed, ratio):
+    """
+    Dedupes and assigns splits. Copies of one image inside a class collapse to
+    the first path; an image found under several classes has no trustworthy
+    label and would leak between splits, so all its copies are excluded.
+    """
+    by_hash = defaultdict(list)
+    for path in sorted(hashes):
+        by_hash[hashes[path]].append(path)
+
+    rows, duplicates, conflicts = [], [], []
+    for sha, paths in by_hash.items():
+        labels = {os.path.basename(os.path.dirname(p)) for p in paths}
+        if len(labels) > 1:
+            conflicts.append({"sha256": sha, "paths": paths})
+            continue
+        duplicates.extend(paths[1:])
+        label = labels.pop()
+        rows.append({
+            "split": split_of(sha, seed, ratio),
+            "class": label,
+            "source": paths[0],
+            "file": os.path.basename(paths[0]),
+            "sha256": sha,
+        })
+    rows.sort(key=lambda r: (r["split"], r["class"], r["file"]))
+    return rows, duplicates, conflicts
+
+
+def write_manifest(rows, summary, base_dir):
+    csv_path = os.path.join(base_dir, MANIFEST_NAME + ".csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["split", "class", "file", "source", "sha256"])
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(base_dir, MANIFEST_NAME + ".json"), "w") as f:
+        json.dump({"summary": summary, "images": rows}, f, indent=2)
+    return csv_path
+
+
+def split_dataset(base_dir=DATASET_DIR, ratio=SPLIT_RATIO, seed=SEED, workers=8, mode="auto"):
+    started = time.perf_counter()
+    train_dir, val_dir = os.path.join(base_dir, "train"), os.path.join(base_dir, "val")
+
+    sources = []
+    for cls in classes:
+        src = os.path.join(base_dir, cls)
+        if not os.path.isdir(src):
+            print(f"⚠️ Class folder {src} not found.")
+            continue
+        sources += [os.path.join(src, name) for name in os.listdir(src)
+                    if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+    hashes, rehashed = hash_files(sources, os.path.join(base_dir, HASH_CACHE_FILE), workers)
+    rows, duplicates, conflicts = build_manifest(hashes, seed, ratio)
+
+    pairs = [(row["source"], os.path.join(train_dir if row["split"] == "train" else val_dir,
+                                           row["class"], row["file"])) for row in rows]
+    removed = remove_stale(train_dir, {dst for _, dst in pairs}) + \
+        remove_stale(val_dir, {dst for _, dst in pairs})
+    methods = sync_files(pairs, workers, mode)
+
+    counts = Counter((row["split"], row["class"]) for row in rows)
+    summary = {
+        "seed": seed,
+        "split_ratio": ratio,
+        "images": len(rows),
+        "per_split": {split: {cls: counts[(split, cls)] for cls in classes} for split in ("train", "val")},
+        "duplicates_dropped": len(duplicates),
+        "conflicts_excluded": conflicts,
+        "rehashed": rehashed,
+        "files": dict(methods),
+        "stale_removed": removed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    csv_path = write_manifest(rows, summary, base_dir)
 
-for cls in classes:
-    src = os.path.join(DATASET_DIR, cls)
-    images = os.listdir(src)
-    random.shuffle(images)
+    for split in ("train", "val"):
+        print(f"📊 {split:<5} " + "  ".join(f"{cls}={n}" for cls, n in summary["per_split"][split].items()))
+    print(f"♻️ rehashed={rehashed} {dict(methods)} stale_removed={removed} "
+          f"duplicates_dropped={len(duplicates)} conflicts={len(conflicts)}")
+    for conflict in conflicts[:10]:
+        print(f"⚠️ Same image under several classes, excluded: {conflict['paths']}")
+    print(f"📄 Manifest: {csv_path}")
+    print(f"✅ Dataset split completed in {summary['seconds']}s")
+    return summary
 
-    split = int(len(images) * SPLIT_RATIO)
 
-    train_imgs = images[:split]
-    val_imgs = images[split:]
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Organize and split the betel leaf dataset incrementally.")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--organize", metavar="RAW_DIR", default=None,
+                        help="Gather raw capture folders into class folders first (see RAW_MAPPING)")
+    parser.add_argument("--ratio", type=float, default=SPLIT_RATIO, help="Fraction of images in train")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 1) * 4))
+    parser.add_argument("--link-mode", choices=["auto", "hardlink", "reflink", "copy"], default="auto",
+                        help="auto tries hardlink, then reflink, then a byte copy")
+    return parser.parse_args(argv)
 
-    os.makedirs(os.path.join(TRAIN_DIR, cls), exist_ok=True)
-    os.makedirs(os.path.join(VAL_DIR, cls), exist_ok=True)
 
-    for img in train_imgs:
-        shutil.copy(os.path.join(src, img), os.path.join(TRAIN_DIR, cls, img))
+def main(argv=None):
+    args = parse_args(argv)
+    if args.organize:
+        organize(args.organize, args.dataset, args.workers, args.link_mode)
+    split_dataset(args.dataset, args.ratio, args.seed, args.workers, args.link_mode)
 
-    for img in val_imgs:
-        shutil.copy(os.path.join(src, img), os.path.join(VAL_DIR, cls, img))
 
-print("✅ Dataset split completed")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import io
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def open_image(source, draft_size=None):
+    """
+    Opens an image from a path, raw bytes or a binary stream as RGB.
+
+    For JPEGs, `draft_size` lets libjpeg downscale while decoding (1/2, 1/4 or
+    1/8 scale) as long as the result stays at least `draft_size` on both sides.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    if draft_size and img.format == "JPEG":
+        img.draft("RGB", draft_size)
+    return img.convert("RGB")
+
+
+def resize_to_array(img, size=224):
+    """Resizes like transforms.Resize((size, size)) and returns an HxWx3 uint8 array."""
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.BILINEAR)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _center_crop(img, fraction):
+    w, h = img.size
+    cw, ch = round(w * fraction), round(h * fraction)
+    left, top = (w - cw) // 2, (h - ch) // 2
+    return img.crop((left, top, left + cw, top + ch))
+
+
+# Test-time augmentation views, in the order they are used: flips and
+# rotations are free on the resized array; crops rescale from the decoded image.
+TTA_VIEWS = (
+    ("identity", lambda img, base, size: base),
+    ("hflip", lambda img, base, size: base[:, ::-1]),
+    ("crop90", lambda img, base, size: resize_to_array(_center_crop(img, 0.9), size)),
+    ("vflip", lambda img, base, size: base[::-1]),
+    ("rot90", lambda img, base, size: np.rot90(base)),
+    ("crop90_hflip", lambda img, base, size: resize_to_array(_center_crop(img, 0.9), size)[:, ::-1]),
+    ("crop80", lambda img, base, size: resize_to_array(_center_crop(img, 0.8), size)),
+    ("rot270", lambda img, base, size: np.rot90(base, 3)),
+)
+
+
+def tta_views(img, size=224, k=4, base=None):
+    """The first `k` TTA views of a decoded image as HxWx3 uint8 arrays (view 0 is the plain resize)."""
+    if base is None:
+        base = resize_to_array(img, size)
+    return [build(img, base, size) for _, build in TTA_VIEWS[:max(1, min(k, len(TTA_VIEWS)))]]
+
+
+class BatchPreprocessor:
+    """
+    Decodes images to uint8 arrays and normalizes whole batches at once.
+
+    `normalize()` copies a list of HxWx3 uint8 arrays into a reusable uint8
+    buffer and converts + normalizes the whole batch into a reusable float32
+    NCHW buffer with a single fused multiply-add, instead of running
+    ToTensor/Normalize per image. The returned tensor is a view into that
+    buffer, so it is only valid until the next `normalize()` call; it must be
+    called from a single thread (e.g. the micro-batcher worker).
+    """
+
+    def __init__(self, size=224, max_batch_size=16, mean=IMAGENET_MEAN, std=IMAGENET_STD,
+                 use_draft=True, draft_factor=2):
+        self.size = size
+        self.use_draft = use_draft
+        self.draft_size = (size * draft_factor, size * draft_factor)
+        std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        # (x / 255 - mean) / std  ==  x * scale + offset
+        self._scale = 1.0 / (255.0 * std)
+        self._offset = -mean / std
+        self._allocate(max_batch_size)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self._u8 = torch.empty((capacity, self.size, self.size, 3), dtype=torch.uint8)
+        self._u8_np = self._u8.numpy()
+        self._out = torch.empty((capacity, 3, self.size, self.size), dtype=torch.float32)
+
+    def open(self, source):
+        """Decodes a source, using JPEG downscale-on-decode when enabled."""
+        return open_image(source, self.draft_size if self.use_draft else None)
+
+    def resize(self, img):
+        """Resizes a decoded image to an HxWx3 uint8 array at the model's input size."""
+        return resize_to_array(img, self.size)
+
+    def tta_views(self, img, k, base=None):
+        """The first `k` test-time augmentation views of a decoded image."""
+        return tta_views(img, self.size, k, base)
+
+    def load(self, source):
+        """Decodes and resizes one source to an HxWx3 uint8 array."""
+        return self.resize(self.open(source))
+
+    def normalize(self, arrays):
+        """Converts a list of HxWx3 uint8 arrays to a normalized NCHW float batch."""
+        n = len(arrays)
+        if n > self.capacity:
+            self._allocate(n)
+        for i, arr in enumerate(arrays):
+            self._u8_np[i] = arr
+        out = self._out[:n]
+        torch.addcmul(self._offset, self._u8[:n].permute(0, 3, 1, 2), self._scale, out=out)
+        return out
+
+
+# ======================================================
+# PARITY CHECK: python preprocessing.py [images...]
+# ======================================================
+def check_equivalence(paths, atol=1e-6, draft_mean_atol=0.0175):
+    """
+    Compares BatchPreprocessor against the torchvision Compose it replaced on
+    real photos and times both (tests/test_preprocessing.py is the parity test).
+
+    Without draft decoding the outputs must match within `atol` element-wise.
+    JPEG draft decoding resamples from a DCT-downscaled image, so it is held to
+    a mean absolute deviation of `draft_mean_atol` (about one 8-bit level in
+    normalized units).
+    """
+    from torchvision import transforms
+
+    reference = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=list(IMAGENET_MEAN), std=list(IMAGENET_STD))
+    ])
+    exact = BatchPreprocessor(use_draft=False, max_batch_size=len(paths))
+    drafted = BatchPreprocessor(use_draft=True, max_batch_size=len(paths))
+
+    t0 = time.perf_counter()
+    expected = torch.stack([reference(Image.open(p).convert("RGB")) for p in paths])
+    t1 = time.perf_counter()
+    got = exact.normalize([exact.load(p) for p in paths]).clone()
+    t2 = time.perf_counter()
+    got_draft = drafted.normalize([drafted.load(p) for p in paths]).clone()
+    t3 = time.perf_counter()
+
+    exact_err = (expected - got).abs().max().item()
+    draft_err = (expected - got_draft).abs().mean().item()
+    print(f"torchvision Compose:   {(t1 - t0) * 1000 / len(paths):.2f} ms/img")
+    print(f"batched (no draft):    {(t2 - t1) * 1000 / len(paths):.2f} ms/img | max abs diff {exact_err:.2e}")
+    print(f"batched (JPEG draft):  {(t3 - t2) * 1000 / len(paths):.2f} ms/img | mean abs diff {draft_err:.2e}")
+    return exact_err <= atol and draft_err <= draft_mean_atol
+
+
+if __name__ == "__main__":
+    import glob
+
+    image_paths = sys.argv[1:] or sorted(glob.glob("uploads/*.jp*g"))
+    if not image_paths:
+        sys.exit("No images to check. Pass image paths as arguments.")
+    ok = check_equivalence(image_paths)
+    print("✅ Preprocessing matches torchvision" if ok else "❌ Preprocessing deviates from torchvision")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,239 @@
+"""
+Pre-inference image quality gate.
+
+Scores the resized 224x224 array on a strided 112x112 thumbnail with a few
+vectorized NumPy ops (blur, exposure, leaf-pixel ratio) and rejects photos
+that are not worth a forward pass. NumPy only, so app.py can import it
+without torch.
+
+    python quality_gate.py calibrate --data dataset/train   # writes quality_thresholds.json
+    python quality_gate.py check photo1.jpg photo2.jpg
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+THRESHOLDS_PATH = "quality_thresholds.json"
+# Conservative defaults for when no calibration file exists
+DEFAULT_THRESHOLDS = {
+    "min_sharpness": 10.0,      # variance of the Laplacian on the gray thumbnail
+    "min_brightness": 25.0,     # mean luma, 0-255
+    "max_brightness": 235.0,
+    "max_clipped": 0.6,         # fraction of pixels crushed to black or blown to white
+    # Fraction of leaf-coloured pixels (green to yellow, or brown/orange for rotted and
+    # fungal tissue). Low, since a single leaf on a plain background fills little of a photo
+    "min_leaf_ratio": 0.02,
+}
+REASON_ADVICE = {
+    "blurry": "The photo is blurry. Hold the camera steady and focus on the leaf.",
+    "too_dark": "The photo is too dark. Retake it in daylight.",
+    "overexposed": "The photo is overexposed. Avoid direct sunlight or flash glare on the leaf.",
+    "clipped": "Large parts of the photo are pure black or white. Retake it with even lighting.",
+    "not_a_leaf": "No leaf detected. Fill the frame with a single betel leaf.",
+}
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class ImageRejected(Exception):
+    """Raised by run_inference when the quality gate rejects an image."""
+
+    def __init__(self, reasons, scores):
+        super().__init__(f"Image rejected by quality gate: {', '.join(reasons)}")
+        self.reasons = reasons
+        self.scores = scores
+
+    def to_dict(self):
+        return {
+            "error": "Image quality too low for a reliable diagnosis",
+            "reasons": self.reasons,
+            "advice": " ".join(REASON_ADVICE[r] for r in self.reasons),
+            "quality": self.scores,
+            "status": "rejected",
+        }
+
+
+def thumbnail(img_array, step=2):
+    """Strided float32 thumbnail; the input is already an antialiased resize, so no filtering."""
+    return np.asarray(img_array[::step, ::step], dtype=np.float32)
+
+
+def measure(img_array):
+    """Quality scores for one resized HxWx3 uint8 image."""
+    rgb = thumbnail(img_array)
+    gray = rgb @ LUMA
+
+    # 4-neighbour Laplacian on the interior; low variance means few edges (blur)
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4.0 * gray[1:-1, 1:-1])
+
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    high = np.maximum(np.maximum(r, g), b)
+    low = np.minimum(np.minimum(r, g), b)
+    chroma = high - low
+    # Green to yellow-green hues (healthy and yellowing leaves), saturated and not black
+    green = (g >= 0.85 * r) & (g > b) & (chroma > 0.15 * high)
+    # Warm brown to orange hues (Leaf_Rot, Leaf_Spot, dried tissue); often dull, so a lower
+    # chroma bar. Cool grey/blue backgrounds (b >= r) are excluded
+    brown = (r >= g) & (g >= 0.4 * r) & (r > b) & (chroma > 0.06 * high)
+    leaf = (green | brown) & (high > 30.0)
+
+    return {
+        "sharpness": round(float(laplacian.var()), 2),
+        "brightness": round(float(gray.mean()), 2),
+        "clipped": round(float(np.count_nonzero((gray < 8.0) | (gray > 247.0)) / gray.size), 4),
+        "leaf_ratio": round(float(np.count_nonzero(leaf) / leaf.size), 4),
+    }
+
+
+class QualityGate:
+    """
+    Checks quality scores against thresholds (calibrated per dataset, see
+    `calibrate`). `calibrated` is False when running on the defaults.
+    """
+
+    def __init__(self, thresholds=None, calibrated=False):
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.calibrated = calibrated
+
+    @classmethod
+    def from_file(cls, path=THRESHOLDS_PATH):
+        try:
+            with open(path) as f:
+                thresholds = json.load(f)["thresholds"]
+        except FileNotFoundError:
+            return cls()
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Ignoring invalid quality thresholds '{path}': {e}")
+            return cls()
+        print(f"🔍 Quality gate thresholds loaded from {path}")
+        return cls(thresholds, calibrated=True)
+
+    def reasons(self, scores):
+        t = self.thresholds
+        reasons = []
+        if scores["sharpness"] < t["min_sharpness"]:
+            reasons.append("blurry")
+        if scores["brightness"] < t["min_brightness"]:
+            reasons.append("too_dark")
+        elif scores["brightness"] > t["max_brightness"]:
+            reasons.append("overexposed")
+        if scores["clipped"] > t["max_clipped"]:
+            reasons.append("clipped")
+        if scores["leaf_ratio"] < t["min_leaf_ratio"]:
+            reasons.append("not_a_leaf")
+        return reasons
+
+    def check(self, img_array):
+        """(scores, reasons); an empty `reasons` list means the image passes."""
+        scores = measure(img_array)
+        return scores, self.reasons(scores)
+
+
+# ======================================================
+# CALIBRATION (CLI)
+# ======================================================
+def _load_arrays(paths, size):
+    from preprocessing import open_image, resize_to_array
+    for path in paths:
+        try:
+            # Same decode path as serving (JPEG draft at 2x the model size)
+            yield path, resize_to_array(open_image(path, (size * 2, size * 2)), size)
+        except OSError as e:
+            print(f"⚠️ Skipping {path}: {e}")
+
+
+def _image_paths(folder):
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, name) for name in files
+                     if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    return sorted(paths)
+
+
+def calibrate(paths, quantile=0.005, size=224, never_stricter=False):
+    """
+    Thresholds that reject at most `quantile` of (known good) images per check.
+    They can be stricter or looser than the defaults; `never_stricter` caps
+    each one at its default instead.
+    """
+    scores = {key: [] for key in ("sharpness", "brightness", "clipped", "leaf_ratio")}
+    elapsed = []
+    for _, array in _load_arrays(paths, size):
+        started = time.perf_counter()
+        result = measure(array)
+        elapsed.append(time.perf_counter() - started)
+        for key in scores:
+            scores[key].append(result[key])
+    if not elapsed:
+        raise ValueError("No images to calibrate on")
+    values = {key: np.array(v) for key, v in scores.items()}
+
+    def low(key):
+        return float(np.quantile(values[key], quantile, method="lower"))
+
+    def high(key):
+        return float(np.quantile(values[key], 1 - quantile, method="higher"))
+
+    thresholds = {
+        "min_sharpness": low("sharpness"),
+        "min_brightness": low("brightness"),
+        "max_brightness": high("brightness"),
+        "max_clipped": high("clipped"),
+        "min_leaf_ratio": low("leaf_ratio"),
+    }
+    if never_stricter:
+        d = DEFAULT_THRESHOLDS
+        thresholds = {k: (min if k.startswith("min_") else max)(v, d[k]) for k, v in thresholds.items()}
+    gate = QualityGate(thresholds)
+    rejected = sum(bool(gate.reasons({k: float(values[k][i]) for k in values})) for i in range(len(elapsed)))
+    return {
+        "thresholds": {k: round(v, 4) for k, v in thresholds.items()},
+        "images": len(elapsed),
+        "quantile": quantile,
+        "never_stricter": never_stricter,
+        # Share of the calibration images themselves that the fitted gate rejects
+        "rejection_rate": round(rejected / len(elapsed), 4),
+        "mean_gate_ms": round(1000 * float(np.mean(elapsed)), 4),
+        "percentiles": {key: {p: round(float(np.percentile(v, p)), 4) for p in (1, 5, 50, 95, 99)}
+                        for key, v in values.items()},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibrate or run the pre-inference quality gate.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="Fit thresholds on a folder of known-good images")
+    # Every class, diseased leaves included, must pass: calibrate on the full training set
+    cal.add_argument("--data", default=os.path.join("dataset", "train"))
+    cal.add_argument("--quantile", type=float, default=0.005,
+                     help="Fraction of calibration images each check may reject")
+    cal.add_argument("--never-stricter", action="store_true",
+                     help="Cap every threshold at its built-in default, so calibration only loosens the gate")
+    cal.add_argument("--out", default=THRESHOLDS_PATH)
+    check = sub.add_parser("check", help="Score images against the saved thresholds")
+    check.add_argument("images", nargs="+")
+    check.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "calibrate":
+        report = calibrate(_image_paths(args.data), args.quantile, never_stricter=args.never_stricter)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"📊 {report['images']} images, {report['mean_gate_ms']:.3f} ms/image, "
+              f"rejection rate on them {report['rejection_rate']:.2%}")
+        for key, value in report["thresholds"].items():
+            print(f"   {key:<15} {value}")
+        print(f"✅ Thresholds saved to {args.out}")
+    else:
+        gate = QualityGate.from_file(args.thresholds)
+        for path, array in _load_arrays(args.images, 224):
+            scores, reasons = gate.check(array)
+            print(f"{'❌' if reasons else '✅'} {path}: {scores} {', '.join(reasons)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Production entry point: one pre-forked HTTP worker per core group on Linux.
+
+The parent loads the model once and then forks the workers. Weight tensors are
+never written after loading, so their pages stay shared copy-on-write between
+all workers instead of being duplicated per process. gc.freeze() keeps the
+garbage collector from touching (and so copying) the parent's object pages.
+Each worker runs torch with its own small intra-op thread budget, so N
+workers do not oversubscribe the cores.
+
+Workers publish their metrics, request traces and drift window to a shared
+temporary directory (metrics.enable_multiprocess), so /metrics,
+/api/trace/<id> and /api/admin/drift answer for every worker whichever one
+takes the request. Other workers' numbers lag by up to a second; gauges
+carry a `worker` label, and per-process state such as /api/stats and the
+prediction cache stays per worker.
+
+    python serve.py --workers 4 --port 5000
+"""
+import argparse
+import gc
+import multiprocessing as mp
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Serve the betel leaf API with pre-forked workers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=max(1, cpus // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker (default: cores // workers)")
+    parser.add_argument("--backlog", type=int, default=1024)
+    args = parser.parse_args(argv)
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, cpus // args.workers)
+    return args
+
+
+def make_listener(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def worker_main(sock, host, port, threads):
+    import torch
+    from werkzeug.serving import make_server
+    import app
+    import metrics
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed for this process; intra-op threads are what matter here
+        pass
+
+    # Handle SIGTERM as a clean exit instead of inheriting the parent's handler
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    app.warmup()
+    if metrics.REGISTRY.multiprocess is not None:
+        metrics.REGISTRY.multiprocess.ensure_started()
+    server = make_server(host, port, app.app, threaded=True, fd=sock.fileno())
+    print(f"✅ Worker {os.getpid()} ready ({threads} torch threads)")
+    server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not sys.platform.startswith("linux"):
+        sys.exit("❌ serve.py relies on fork(); use 'python app.py' on this platform.")
+
+    # Load with a single thread so no OpenMP pool exists in the parent at fork time
+    import torch
+    torch.set_num_threads(1)
+    import app
+    import metrics
+    from chatbot import SharedSessionStore
+
+    # Load in the parent so the weights are shared copy-on-write by every worker
+    if app.load_engine() is None:
+        sys.exit("❌ Model is not available; refusing to start workers.")
+
+    ctx = mp.get_context("fork")
+    manager = None
+    metrics_dir = None
+    if args.workers > 1:
+        # Chat context must follow the user across workers
+        manager = ctx.Manager()
+        app.chat_sessions = SharedSessionStore(
+            manager.dict(), app.Config.SESSION_TTL_SECONDS, app.Config.MAX_CHAT_SESSIONS
+        )
+        # So does monitoring: any worker may answer a scrape or a trace lookup
+        metrics_dir = tempfile.mkdtemp(prefix="betel-metrics-")
+        metrics.enable_multiprocess(metrics_dir)
+
+    sock = make_listener(args.host, args.port, args.backlog)
+    gc.freeze()
+
+    def spawn():
+        process = ctx.Process(target=worker_main, args=(sock, args.host, args.port, args.threads_per_worker),
+                              daemon=True)
+        process.start()
+        return process
+
+    workers = [spawn() for _ in range(args.workers)]
+    print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers "
+          f"x {args.threads_per_worker} threads")
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: replace workers that die unexpectedly
+    while not stopping:
+        time.sleep(1)
+        for i, process in enumerate(workers):
+            if not process.is_alive() and not stopping:
+                print(f"⚠️ Worker {process.pid} exited with {process.exitcode}; restarting")
+                workers[i] = spawn()
+
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join(timeout=10)
+    if manager is not None:
+        manager.shutdown()
+    if metrics_dir is not None:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+    sock.close()
+    print("👋 Server stopped")
+
+
+if __name__ == "__main__":
+    main()
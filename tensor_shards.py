@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+META_FILE = "meta.json"
+
+
+# ======================================================
+# PACKING: ImageFolder -> memory-mapped uint8 shards
+# ======================================================
+def _scan_image_folder(split_dir):
+    """Same class ordering and file discovery as torchvision's ImageFolder."""
+    from torchvision.datasets import ImageFolder
+
+    folder = ImageFolder(split_dir)
+    return folder.classes, folder.class_to_idx, folder.samples
+
+
+def _load_resized(path, size):
+    # Same resampling as transforms.Resize((size, size)) on a PIL image
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB").resize((size, size), Image.BILINEAR), dtype=np.uint8)
+
+
+def pack_split(split_dir, out_dir, size=224, shard_size=2048, workers=8):
+    """
+    Decodes and resizes every image of an ImageFolder split once and stores
+    them as `images-XXXXX.npy` (N, size, size, 3) uint8 shards plus
+    `labels-XXXXX.npy`, described by `meta.json`.
+    """
+    classes, class_to_idx, samples = _scan_image_folder(split_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shard_idx, start in enumerate(range(0, len(samples), shard_size)):
+            chunk = samples[start:start + shard_size]
+            images_file = f"images-{shard_idx:05d}.npy"
+            labels_file = f"labels-{shard_idx:05d}.npy"
+
+            images = np.lib.format.open_memmap(
+                os.path.join(out_dir, images_file), mode="w+", dtype=np.uint8,
+                shape=(len(chunk), size, size, 3)
+            )
+            for i, arr in enumerate(pool.map(lambda s: _load_resized(s[0], size), chunk)):
+                images[i] = arr
+            images.flush()
+            del images
+
+            labels = np.array([label for _, label in chunk], dtype=np.int64)
+            np.save(os.path.join(out_dir, labels_file), labels)
+            shards.append({"images": images_file, "labels": labels_file, "count": len(chunk)})
+            print(f"📦 {split_dir}: shard {shard_idx} ({len(chunk)} images)")
+
+    meta = {
+        "size": size,
+        "count": len(samples),
+        "classes": classes,
+        "class_to_idx": class_to_idx,
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=4)
+    return meta
+
+
+# ======================================================
+# DATASET
+# ======================================================
+class ShardDataset(Dataset):
+    """
+    Serves pre-resized uint8 images from memory-mapped shards.
+
+    Items are returned as CHW uint8 tensors passed through `transform`, so
+    augmentation runs on tensors instead of re-decoding JPEGs every epoch.
+    Shards are opened lazily in each DataLoader worker (mmap is fork-safe and
+    the page cache is shared between workers).
+    """
+
+    def __init__(self, shard_dir, transform=None):
+        with open(os.path.join(shard_dir, META_FILE)) as f:
+            meta = json.load(f)
+        self.shard_dir = shard_dir
+        self.transform = transform
+        self.classes = meta["classes"]
+        self.class_to_idx = meta["class_to_idx"]
+        self._shard_files = meta["shards"]
+        self._offsets = np.cumsum([0] + [s["count"] for s in self._shard_files]).tolist()
+        self.targets = np.concatenate([
+            np.load(os.path.join(shard_dir, s["labels"])) for s in self._shard_files
+        ]).tolist() if self._shard_files else []
+        self._images = None
+
+    def _open(self):
+        self._images = [
+            np.load(os.path.join(self.shard_dir, s["images"]), mmap_mode="r")
+            for s in self._shard_files
+        ]
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __getitem__(self, index):
+        if self._images is None:
+            self._open()
+        shard = bisect_right(self._offsets, index) - 1
+        arr = self._images[shard][index - self._offsets[shard]]
+        # Copy out of the read-only mmap so transforms may work in place
+        img = torch.from_numpy(np.array(arr)).permute(2, 0, 1)
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, self.targets[index]
+
+    def __getstate__(self):
+        # Never pickle open memmaps into worker processes
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+
+# ======================================================
+# CLI: python tensor_shards.py --dataset dataset --out dataset_shards
+# ======================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack dataset/train and dataset/val into memory-mapped shards.")
+    parser.add_argument("--dataset", default="dataset")
+    parser.add_argument("--out", default="dataset_shards")
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--shard-size", type=int, default=2048)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    for split in ("train", "val"):
+        meta = pack_split(os.path.join(args.dataset, split), os.path.join(args.out, split),
+                          args.size, args.shard_size, args.workers)
+        print(f"✅ {split}: {meta['count']} images packed into {len(meta['shards'])} shard(s)")
@@ -0,0 +1,35 @@
+import asyncio
+import os
+
+# Importing app must not start loading the model for these tests
+os.environ.setdefault("MODEL_LOAD", "lazy")
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+import async_app  # noqa: E402
+import metrics  # noqa: E402
+
+
+def requests_total(endpoint, status):
+    samples = dict(((name, key), value) for name, key, value in metrics.REQUESTS_TOTAL.samples())
+    return samples.get(("betel_requests_total", (("endpoint", endpoint), ("status", status))), 0)
+
+
+def test_unhandled_errors_are_traced_as_500():
+    async def scenario():
+        application = async_app.create_app()
+
+        async def broken(request):
+            raise ValueError("boom")
+
+        application.router.add_get("/api/broken", broken)
+        async with TestClient(TestServer(application)) as client:
+            response = await client.get("/api/broken", headers={"X-Request-ID": "broken-1"})
+            assert response.status == 500
+            trace = await (await client.get("/api/trace/broken-1")).json()
+        return trace
+
+    before = requests_total("/api/broken", 500)
+    trace = asyncio.run(scenario())
+    assert trace["status"] == 500 and trace["endpoint"] == "/api/broken"
+    assert requests_total("/api/broken", 500) == before + 1
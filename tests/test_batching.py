@@ -0,0 +1,38 @@
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_short_output_fails_the_batch_and_keeps_the_worker():
+    calls = []
+
+    def forward(items):
+        calls.append(len(items))
+        # The first batch drops an output; later batches are fine
+        return [item * 2 for item in items][: -1 if len(calls) == 1 else None]
+
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+    futures = batcher.submit_many([1, 2, 3])
+    for future in futures:
+        with pytest.raises(RuntimeError, match="2 outputs for 3 items"):
+            future.result(timeout=5)
+    assert batcher.infer(5, timeout=5) == 10
+
+
+def test_forward_errors_reach_every_caller():
+    def forward(items):
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher(forward, max_batch_size=4, max_wait_ms=50)
+    for future in batcher.submit_many([1, 2]):
+        with pytest.raises(ValueError, match="bad batch"):
+            future.result(timeout=5)
+    assert batcher.stats.snapshot()["queue_depth"] == 0
+
+
+def test_cancelled_future_does_not_stop_dispatch():
+    batcher = MicroBatcher(lambda items: list(items), max_batch_size=4, max_wait_ms=50)
+    cancelled, kept = batcher.submit_many([1, 2])
+    cancelled.cancel()
+    assert kept.result(timeout=5) == 2
+    assert batcher.infer(3, timeout=5) == 3
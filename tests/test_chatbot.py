@@ -0,0 +1,74 @@
+import itertools
+import random
+
+import pytest
+
+from chatbot import INTENT_PRIORITY, INTENTS, BetelLeafChatbot, IntentMatcher
+
+
+def substring_intents(intents, msg):
+    """Reference routing: one `keyword in msg` scan per intent, in priority order."""
+    return [intent for intent in INTENT_PRIORITY if any(k in msg for k in intents.get(intent, []))]
+
+
+def routing_corpus(intents, samples=5000, seed=0):
+    """Every keyword alone, every keyword pair (spaced and glued), plus random keyword/filler sentences."""
+    rng = random.Random(seed)
+    keywords = [k for intent in INTENT_PRIORITY for k in intents[intent]]
+    filler = ["my", "betel", "vine", "leaves", "are", "yellow", "please", "the", "plant", "is",
+              "SOMETIMES", "Helpful?", "whatever", "soil", "  ", "🌿", "nitrogen", "rain"]
+
+    corpus = list(keywords)
+    corpus += [f"{a} {b}" for a, b in itertools.permutations(keywords, 2)]
+    corpus += ["".join(pair) for pair in itertools.permutations(keywords, 2)]
+    for _ in range(samples):
+        words = rng.sample(filler, rng.randint(1, 8)) + rng.sample(keywords, rng.randint(0, 2))
+        rng.shuffle(words)
+        corpus.append(" ".join(words))
+    return corpus
+
+
+@pytest.fixture(scope="module")
+def bot():
+    return BetelLeafChatbot({})
+
+
+def test_detect_intent_matches_substring_scan(bot):
+    mismatches = []
+    for message in routing_corpus(bot.intents):
+        expected = substring_intents(bot.intents, message.lower().strip())
+        if bot.detect_intent(message) != (expected[0] if expected else None):
+            mismatches.append(message)
+    assert not mismatches, mismatches[:10]
+
+
+def test_matches_returns_every_intent(bot):
+    mismatches = [m for m in routing_corpus(bot.intents)
+                  if bot.matcher.matches(m.lower().strip()) != substring_intents(bot.intents, m.lower().strip())]
+    assert not mismatches, mismatches[:10]
+
+
+def test_overlapping_and_prefix_keywords():
+    intents = {"greeting": ["hi", "hint"], "bot_info": ["int", "nth"], "thanks": ["thank", "than"]}
+    matcher = IntentMatcher(intents, INTENT_PRIORITY)
+    for message in ["hint", "hinth", "thanks", "than", "xhintx", "nthank", "hi", "", "nothing"]:
+        expected = substring_intents(intents, message)
+        assert matcher.matches(message) == expected, message
+        assert matcher.best(message) == (expected[0] if expected else None), message
+
+
+def test_empty_vocabulary():
+    matcher = IntentMatcher({}, INTENT_PRIORITY)
+    assert matcher.matches("hello") == []
+    assert matcher.best("hello") is None
+
+
+def test_grown_vocabulary_keeps_parity():
+    rng = random.Random(1)
+    intents = {intent: list(keywords) + ["".join(rng.choice("abcdefghij") for _ in range(rng.randint(2, 6)))
+                                         for _ in range(20)]
+               for intent, keywords in INTENTS.items()}
+    matcher = IntentMatcher(intents, INTENT_PRIORITY)
+    for message in routing_corpus(intents, samples=2000, seed=2):
+        msg = message.lower().strip()
+        assert matcher.matches(msg) == substring_intents(intents, msg), message
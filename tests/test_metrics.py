@@ -0,0 +1,78 @@
+import multiprocessing as mp
+import sys
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MultiprocessCollector, Registry, RequestTrace, TraceStore
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="pre-forked workers need fork()")
+
+
+def make_registry(directory):
+    registry = Registry()
+    metrics = {
+        "requests": registry.register(Counter("requests_total", "Requests.")),
+        "latency": registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))),
+        "queue": registry.register(Gauge("queue_depth", "Queue depth.", lambda: 3)),
+    }
+    registry.multiprocess = MultiprocessCollector(str(directory), registry, TraceStore(), interval=60)
+    return registry, metrics
+
+
+def samples(registry):
+    return {(name, key): value for metric, series in registry.collect() for name, key, value in series}
+
+
+def worker(registry, metrics, request_id):
+    metrics["requests"].inc(2, status=200)
+    metrics["latency"].observe(0.5)
+    trace = RequestTrace(request_id, "/api/predict")
+    trace.finish(200)
+    registry.multiprocess.record_trace(trace)
+    registry.multiprocess.flush()
+
+
+def test_counters_sum_across_workers_and_survive_restarts(tmp_path):
+    registry, metrics = make_registry(tmp_path)
+    ctx = mp.get_context("fork")
+    for i in range(2):
+        process = ctx.Process(target=worker, args=(registry, metrics, f"req-{i}"))
+        process.start()
+        process.join()
+    metrics["requests"].inc(1, status=200)
+
+    collected = samples(registry)
+    assert collected[("requests_total", (("status", 200),))] == 5
+    assert collected[("latency_seconds_count", ())] == 2
+    assert collected[("latency_seconds_bucket", (("le", 1.0),))] == 2
+    # Gauges are per live worker: the exited ones no longer report
+    gauges = [key for name, key in collected if name == "queue_depth"]
+    assert len(gauges) == 1 and gauges[0][-1][0] == "worker"
+
+
+def test_traces_are_found_from_any_worker(tmp_path):
+    registry, metrics = make_registry(tmp_path)
+    process = mp.get_context("fork").Process(target=worker, args=(registry, metrics, "from-child"))
+    process.start()
+    process.join()
+
+    trace = registry.multiprocess.find_trace("from-child")
+    assert trace["endpoint"] == "/api/predict" and trace["status"] == 200
+    assert registry.multiprocess.find_trace("unknown") is None
+
+
+def test_broadcast_reaches_other_workers_on_flush(tmp_path):
+    calls = []
+    sender, _ = make_registry(tmp_path)
+    receiver, _ = make_registry(tmp_path)
+    sender.on_broadcast("reset", lambda: calls.append("sender"))
+    receiver.on_broadcast("reset", lambda: calls.append("receiver"))
+    receiver.multiprocess.flush()
+
+    sender.broadcast("reset")
+    assert calls == ["sender"]
+    sender.multiprocess.flush()
+    receiver.multiprocess.flush()
+    assert calls == ["sender", "receiver"]
+    receiver.multiprocess.flush()
+    assert calls == ["sender", "receiver"]
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from model_registry import ModelRegistry, legacy_artifact, weights_sha256
+
+
+@pytest.fixture
+def files(tmp_path):
+    weights = tmp_path / "model.pth"
+    weights.write_bytes(b"new weights")
+    class_index = tmp_path / "class_indices.json"
+    class_index.write_text(json.dumps({"Healthy": 0}))
+    return weights, class_index
+
+
+def write_calibration(path, weights_digest, temperature=1.7):
+    calibration = {"temperature": temperature}
+    if weights_digest is not None:
+        calibration["weights_sha256"] = weights_digest
+    path.write_text(json.dumps(calibration))
+    return path
+
+
+def test_publish_attaches_calibration_fitted_on_the_weights(tmp_path, files):
+    weights, class_index = files
+    calibration = write_calibration(tmp_path / "calibration.json", weights_sha256(str(weights)))
+    registry = ModelRegistry(str(tmp_path / "models"))
+
+    version = registry.publish(str(weights), str(class_index), str(calibration))
+    artifact = registry.artifact(version)
+    assert registry.meta(version)["weights_sha256"] == artifact.weights_sha256 == weights_sha256(str(weights))
+    assert json.loads(open(artifact.calibration).read())["temperature"] == 1.7
+
+
+@pytest.mark.parametrize("digest", ["0" * 64, None])
+def test_publish_refuses_stale_or_unverifiable_calibration(tmp_path, files, digest):
+    weights, class_index = files
+    calibration = write_calibration(tmp_path / "calibration.json", digest)
+    registry = ModelRegistry(str(tmp_path / "models"))
+
+    with pytest.raises(ValueError):
+        registry.publish(str(weights), str(class_index), str(calibration))
+    assert registry.versions() == []
+
+
+def test_loading_ignores_calibration_for_other_weights(tmp_path, files):
+    from inference import load_temperature
+    weights, class_index = files
+    calibration = write_calibration(tmp_path / "calibration.json", "0" * 64)
+    assert load_temperature(legacy_artifact(str(weights), "eager", str(class_index), str(calibration))) == 1.0
+
+    write_calibration(calibration, weights_sha256(str(weights)))
+    assert load_temperature(legacy_artifact(str(weights), "eager", str(class_index), str(calibration))) == 1.7
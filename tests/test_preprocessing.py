@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocessing import IMAGENET_MEAN, IMAGENET_STD, BatchPreprocessor, open_image
+
+# One 8-bit intensity step in normalized units (largest for the smallest std)
+LEVEL = 1.0 / (255.0 * min(IMAGENET_STD))
+# Exact decode runs the same PIL resize, so only float rounding differs
+EXACT_ATOL = 1e-6
+# JPEG draft decoding resamples a DCT-downscaled image: under one level on
+# average and a few levels at worst on detailed, noisy photos
+DRAFT_MEAN_ATOL = 1.0 * LEVEL
+DRAFT_MAX_ATOL = 4.0 * LEVEL
+
+
+def reference_pipeline():
+    return transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=list(IMAGENET_MEAN), std=list(IMAGENET_STD))
+    ])
+
+
+def synthetic_leaf(width, height, seed):
+    """Smooth gradients plus sensor-like noise, so resampling differences show up."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width] / max(width, height)
+    img = np.stack([
+        120 + 80 * np.sin(6 * x + seed),
+        150 + 60 * np.cos(5 * y),
+        60 + 40 * np.sin(4 * (x + y)),
+    ], axis=-1)
+    img += rng.normal(0, 12, img.shape)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+@pytest.fixture(scope="module")
+def images(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("images")
+    paths = []
+    for i, (size, fmt) in enumerate([((1600, 1200), "JPEG"), ((900, 900), "JPEG"),
+                                     ((3000, 2000), "JPEG"), ((640, 480), "JPEG"),
+                                     ((300, 500), "PNG")]):
+        path = tmp_path / f"leaf_{i}.{fmt.lower()}"
+        synthetic_leaf(*size, seed=i).save(path, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+        paths.append(str(path))
+    return paths
+
+
+def expected_batch(paths):
+    reference = reference_pipeline()
+    return torch.stack([reference(Image.open(p).convert("RGB")) for p in paths])
+
+
+def test_exact_decode_matches_torchvision(images):
+    pre = BatchPreprocessor(use_draft=False, max_batch_size=2)
+    got = pre.normalize([pre.load(p) for p in images])
+    assert got.shape == (len(images), 3, 224, 224)
+    torch.testing.assert_close(got, expected_batch(images), rtol=0, atol=EXACT_ATOL)
+
+
+def test_exact_decode_from_bytes_matches_path(images):
+    pre = BatchPreprocessor(use_draft=False)
+    with open(images[0], "rb") as f:
+        from_bytes = pre.load(f.read())
+    np.testing.assert_array_equal(from_bytes, pre.load(images[0]))
+
+
+def test_draft_decode_within_bound(images):
+    pre = BatchPreprocessor(use_draft=True, max_batch_size=len(images))
+    # The large JPEGs must actually take the DCT-downscaled path for this to mean anything
+    assert open_image(images[2], pre.draft_size).size[0] < 3000
+
+    diff = (pre.normalize([pre.load(p) for p in images]) - expected_batch(images)).abs()
+    for i, path in enumerate(images):
+        assert diff[i].mean().item() <= DRAFT_MEAN_ATOL, path
+        assert diff[i].max().item() <= DRAFT_MAX_ATOL, path
+
+
+def test_draft_leaves_small_and_non_jpeg_images_exact(images):
+    pre = BatchPreprocessor(use_draft=True)
+    small = images[3:]
+    torch.testing.assert_close(pre.normalize([pre.load(p) for p in small]), expected_batch(small),
+                               rtol=0, atol=EXACT_ATOL)
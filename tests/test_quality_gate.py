@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from quality_gate import DEFAULT_THRESHOLDS, calibrate
+
+
+@pytest.fixture(scope="module")
+def leaf_photos(tmp_path_factory):
+    """Sharp, well-exposed green textures: every check scores them far from its default."""
+    folder = tmp_path_factory.mktemp("leaves")
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(6):
+        pixels = np.zeros((300, 300, 3), dtype=np.uint8)
+        pixels[..., 1] = rng.integers(90, 200, (300, 300))
+        pixels[..., 0] = pixels[..., 1] // 3
+        path = folder / f"leaf_{i}.png"
+        Image.fromarray(pixels).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_calibration_can_tighten_the_defaults(leaf_photos):
+    report = calibrate(leaf_photos, quantile=0.0)
+    thresholds = report["thresholds"]
+    assert thresholds["min_sharpness"] > DEFAULT_THRESHOLDS["min_sharpness"]
+    assert thresholds["min_leaf_ratio"] > DEFAULT_THRESHOLDS["min_leaf_ratio"]
+    assert report["rejection_rate"] == 0.0
+
+
+def test_never_stricter_caps_thresholds_at_the_defaults(leaf_photos):
+    thresholds = calibrate(leaf_photos, quantile=0.0, never_stricter=True)["thresholds"]
+    for key, default in DEFAULT_THRESHOLDS.items():
+        if key.startswith("min_"):
+            assert thresholds[key] <= default
+        else:
+            assert thresholds[key] >= default
@@ -0,0 +1,47 @@
+import os
+import time
+
+from upload_store import UploadStore
+
+
+def drain(*stores, expected, timeout=10):
+    deadline = time.monotonic() + timeout
+    while sum(store.written for store in stores) < expected:
+        assert time.monotonic() < deadline, "upload writers did not finish"
+        time.sleep(0.01)
+
+
+def stored_files(folder):
+    return sorted(name for name in os.listdir(folder) if not name.startswith("."))
+
+
+def test_stores_sharing_a_folder_enforce_one_file_cap(tmp_path):
+    # Two stores stand in for two serve.py workers; each has its own writer and lock file handle
+    first = UploadStore(str(tmp_path), max_files=5, max_bytes=10 ** 6, max_age_seconds=None)
+    second = UploadStore(str(tmp_path), max_files=5, max_bytes=10 ** 6, max_age_seconds=None)
+    for i in range(8):
+        first.submit(f"a{i}.jpg", b"x" * 10)
+        second.submit(f"b{i}.jpg", b"y" * 10)
+    drain(first, second, expected=16)
+
+    assert len(stored_files(tmp_path)) == 5
+    assert first.evicted + second.evicted == 11
+    # Whichever store wrote last sees exactly what is on disk
+    latest = max((first, second), key=lambda store: store._generation)
+    assert latest.snapshot()["stored"] == 5
+    assert latest.snapshot()["stored_bytes"] == 50
+
+
+def test_byte_cap_counts_other_writers_files(tmp_path):
+    first = UploadStore(str(tmp_path), max_files=100, max_bytes=250, max_age_seconds=None)
+    second = UploadStore(str(tmp_path), max_files=100, max_bytes=250, max_age_seconds=None)
+    for i in range(3):
+        first.submit(f"a{i}.jpg", b"x" * 100)
+    drain(first, expected=3)
+    second.submit("b0.jpg", b"y" * 100)
+    drain(second, expected=1)
+
+    # The second store evicts the first one's oldest upload to make room for its own
+    assert stored_files(tmp_path) == ["a2.jpg", "b0.jpg"]
+    assert (first.evicted, second.evicted) == (1, 1)
+    assert second.snapshot()["stored_bytes"] == 200
@@ -1,18 +1,29 @@
 import os
+import sys
 import json
+import argparse
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torchvision import datasets, transforms, models
 from tqdm import tqdm
 
+from tensor_shards import ShardDataset
+import feature_cache
+import distributed
+from model_registry import ModelRegistry
+from training_stats import StageTimer, RunLog, peak_rss_mb, EVAL_STAGES
+from checkpoint import (save_checkpoint, load_checkpoint, capture_rng_state, restore_rng_state,
+                        ResumableRandomSampler, EarlyStopping)
+
 # =========================
 # CONFIGURATION
 # =========================
 DATASET_DIR = "dataset"
 TRAIN_DIR = os.path.join(DATASET_DIR, "train")
 VAL_DIR = os.path.join(DATASET_DIR, "val")
+SHARD_DIR = "dataset_shards"
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
@@ -21,9 +32,20 @@ LEARNING_RATE = 1e-4
 
 MODEL_PATH = "betel_leaf_model.pth"
 CLASS_INDEX_PATH = "class_indices.json"
+RUN_LOG_PATH = os.path.join("runs", "train_log")
+CHECKPOINT_PATH = os.path.join("checkpoints", "last.pt")
+CHECKPOINT_EVERY = 50
+PATIENCE = 5
+SEED = 42
+
+# Worker processes need fork() to share the shard page cache cheaply;
+# keep num_workers=0 on Windows
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1) if sys.platform.startswith("linux") else 0
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"✅ Using device: {DEVICE}")
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
 
 # =========================
 # DATA TRANSFORMS
@@ -35,8 +57,8 @@ train_transforms = transforms.Compose([
     transforms.ColorJitter(brightness=0.2, contrast=0.2),
     transforms.ToTensor(),
     transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
+        mean=IMAGENET_MEAN,
+        std=IMAGENET_STD
     )
 ])
 
@@ -44,142 +66,395 @@ val_transforms = transforms.Compose([
     transforms.Resize((IMG_SIZE, IMG_SIZE)),
     transforms.ToTensor(),
     transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
+        mean=IMAGENET_MEAN,
+        std=IMAGENET_STD
+    )
+])
+
+# Shard images are already resized uint8 CHW tensors
+shard_train_transforms = transforms.Compose([
+    transforms.RandomHorizontalFlip(),
+    transforms.RandomRotation(20),
+    transforms.ColorJitter(brightness=0.2, contrast=0.2),
+    transforms.ConvertImageDtype(torch.float32),
+    transforms.Normalize(
+        mean=IMAGENET_MEAN,
+        std=IMAGENET_STD
+    )
+])
+
+shard_val_transforms = transforms.Compose([
+    transforms.ConvertImageDtype(torch.float32),
+    transforms.Normalize(
+        mean=IMAGENET_MEAN,
+        std=IMAGENET_STD
     )
 ])
 
 # =========================
 # DATASETS & DATALOADERS
-# (num_workers=0 for Windows)
 # =========================
-train_dataset = datasets.ImageFolder(
-    TRAIN_DIR,
-    transform=train_transforms
-)
-
-val_dataset = datasets.ImageFolder(
-    VAL_DIR,
-    transform=val_transforms
-)
-
-train_loader = DataLoader(
-    train_dataset,
-    batch_size=BATCH_SIZE,
-    shuffle=True,
-    num_workers=0,
-    pin_memory=torch.cuda.is_available()
-)
-
-val_loader = DataLoader(
-    val_dataset,
-    batch_size=BATCH_SIZE,
-    shuffle=False,
-    num_workers=0,
-    pin_memory=torch.cuda.is_available()
-)
-
-NUM_CLASSES = len(train_dataset.classes)
-print("✅ Classes detected:", train_dataset.classes)
+def build_datasets(shard_dir=None, augment=True):
+    """JPEG ImageFolders, or pre-packed shards from tensor_shards.py when available."""
+    if shard_dir:
+        train_tf = shard_train_transforms if augment else shard_val_transforms
+        train_dataset = ShardDataset(os.path.join(shard_dir, "train"), transform=train_tf)
+        val_dataset = ShardDataset(os.path.join(shard_dir, "val"), transform=shard_val_transforms)
+        print(f"✅ Using tensor shards from '{shard_dir}'")
+    else:
+        train_tf = train_transforms if augment else val_transforms
+        train_dataset = datasets.ImageFolder(TRAIN_DIR, transform=train_tf)
+        val_dataset = datasets.ImageFolder(VAL_DIR, transform=val_transforms)
+    return train_dataset, val_dataset
+
+
+def build_loaders(train_dataset, val_dataset, batch_size=BATCH_SIZE, workers=DEFAULT_WORKERS, train_sampler=None):
+    loader_kwargs = dict(
+        batch_size=batch_size,
+        num_workers=workers,
+        pin_memory=torch.cuda.is_available(),
+        persistent_workers=workers > 0
+    )
+    train_loader = DataLoader(train_dataset, shuffle=train_sampler is None, sampler=train_sampler, **loader_kwargs)
+    val_loader = DataLoader(val_dataset, shuffle=False, **loader_kwargs)
+    return train_loader, val_loader
 
-# =========================
-# SAVE CLASS INDICES
-# =========================
-class_indices = {cls: idx for idx, cls in enumerate(train_dataset.classes)}
-with open(CLASS_INDEX_PATH, "w") as f:
-    json.dump(class_indices, f, indent=4)
 
-print("✅ Class indices saved")
+def save_class_indices(classes):
+    class_indices = {cls: idx for idx, cls in enumerate(classes)}
+    with open(CLASS_INDEX_PATH, "w") as f:
+        json.dump(class_indices, f, indent=4)
+    print("✅ Class indices saved")
 
 # =========================
 # MODEL: EfficientNet-B0
 # =========================
-model = models.efficientnet_b0(
-    weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1
-)
-
-# Freeze backbone
-for param in model.features.parameters():
-    param.requires_grad = False
-
-# Replace classifier
-model.classifier = nn.Sequential(
-    nn.Dropout(0.5),
-    nn.Linear(model.classifier[1].in_features, NUM_CLASSES)
-)
+def build_model(num_classes, pretrained=True):
+    model = models.efficientnet_b0(
+        weights=models.EfficientNet_B0_Weights.IMAGENET1K_V1 if pretrained else None
+    )
 
-model = model.to(DEVICE)
+    # Freeze backbone
+    for param in model.features.parameters():
+        param.requires_grad = False
 
-# =========================
-# LOSS & OPTIMIZER
-# =========================
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(
-    model.classifier.parameters(),
-    lr=LEARNING_RATE
-)
+    # Replace classifier
+    model.classifier = nn.Sequential(
+        nn.Dropout(0.5),
+        nn.Linear(model.classifier[1].in_features, num_classes)
+    )
+    return model.to(DEVICE)
 
 # =========================
-# TRAINING LOOP
+# TRAIN / VALIDATION LOOPS
 # =========================
-best_val_accuracy = 0.0
-
-for epoch in range(EPOCHS):
-    print(f"\n🔁 Epoch {epoch + 1}/{EPOCHS}")
-
-    # -------- TRAIN --------
+def train_one_epoch(model, loader, criterion, optimizer, max_batches=None, on_step=None):
+    """
+    One pass over `loader`; returns (mean loss per sample, accuracy, per-stage
+    timing summary). `on_step()` is called after every optimizer step (used for
+    checkpointing).
+    """
     model.train()
-    train_loss = 0.0
+    loss_sum = 0.0
     correct, total = 0, 0
+    timer = StageTimer(DEVICE)
+
+    for step, (images, labels) in enumerate(tqdm(loader, desc="Training", disable=not distributed.is_main())):
+        if max_batches is not None and step >= max_batches:
+            break
+        timer.data_ready(labels.size(0))
 
-    for images, labels in tqdm(train_loader, desc="Training"):
-        images = images.to(DEVICE)
-        labels = labels.to(DEVICE)
+        with timer.stage("h2d"):
+            images = images.to(DEVICE, non_blocking=True)
+            labels = labels.to(DEVICE, non_blocking=True)
 
         optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        with timer.stage("forward"):
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+        with timer.stage("backward"):
+            loss.backward()
+            optimizer.step()
+        with timer.stage("metrics"):
+            loss_sum += loss.item() * labels.size(0)
+            _, preds = torch.max(outputs, 1)
+            total += labels.size(0)
+            correct += (preds == labels).sum().item()
+        if on_step is not None:
+            with timer.stage("checkpoint"):
+                on_step()
 
-        train_loss += loss.item()
-        _, preds = torch.max(outputs, 1)
-        total += labels.size(0)
-        correct += (preds == labels).sum().item()
+    # Under torchrun each rank saw its own shard; sum over all ranks, then average per sample
+    loss_sum, correct, total = distributed.all_reduce_sum(loss_sum, correct, total)
+    return loss_sum / max(total, 1), 100 * correct / max(total, 1), timer.summary()
 
-    train_acc = 100 * correct / total
 
-    # -------- VALIDATION --------
+def validate(model, loader, criterion):
+    """Evaluates on `loader`; returns (mean loss per sample, accuracy, per-stage timing summary)."""
     model.eval()
-    val_loss = 0.0
-    correct, total = 0, 0
+    # Accumulate on the device and sync once at the end instead of per batch
+    loss_sum = torch.zeros((), device=DEVICE)
+    correct = torch.zeros((), dtype=torch.long, device=DEVICE)
+    total = 0
+    timer = StageTimer(DEVICE, stages=EVAL_STAGES)
 
     with torch.no_grad():
-        for images, labels in tqdm(val_loader, desc="Validation"):
-            images = images.to(DEVICE)
-            labels = labels.to(DEVICE)
+        for images, labels in tqdm(loader, desc="Validation", disable=not distributed.is_main()):
+            timer.data_ready(labels.size(0))
 
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            with timer.stage("h2d"):
+                images = images.to(DEVICE, non_blocking=True)
+                labels = labels.to(DEVICE, non_blocking=True)
 
-            val_loss += loss.item()
-            _, preds = torch.max(outputs, 1)
-            total += labels.size(0)
-            correct += (preds == labels).sum().item()
+            with timer.stage("forward"):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+
+            with timer.stage("metrics"):
+                loss_sum += loss * labels.size(0)
+                correct += (outputs.argmax(dim=1) == labels).sum()
+                total += labels.size(0)
 
-    val_acc = 100 * correct / total
+    # Per-sample mean over all ranks, so the value does not depend on the world size
+    loss_sum, correct, total = distributed.all_reduce_sum(loss_sum.item(), correct.item(), total)
+    return loss_sum / max(total, 1), 100 * correct / max(total, 1), timer.summary()
 
-    print(f"📊 Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.2f}%")
-    print(f"📊 Val   Loss: {val_loss:.4f} | Val   Acc: {val_acc:.2f}%")
 
-    # -------- SAVE BEST MODEL --------
-    if val_acc > best_val_accuracy:
-        best_val_accuracy = val_acc
-        torch.save(model.state_dict(), MODEL_PATH)
-        print("✅ Best model saved")
+def format_timing(stats):
+    stages = " | ".join(f"{k} {v:.2f}s" for k, v in stats["stage_seconds"].items())
+    return f"{stats['images_per_sec']:.1f} img/s | {stages}"
 
 # =========================
-# DONE
+# HEAD-ONLY TRAINING ON CACHED FEATURES
 # =========================
-print("\n🎉 Training completed successfully!")
-print(f"🏆 Best Validation Accuracy: {best_val_accuracy:.2f}%")
+def train_on_cached_features(args):
+    """
+    The backbone is frozen, so its pooled features are computed once (for
+    N fixed augmentations per image), stored as float16, and only the
+    Dropout+Linear head is trained on them. The saved state_dict is the
+    full model, loadable by inference.load_weights().
+    """
+    augmentations = args.feature_augmentations
+    train_dataset, val_dataset = build_datasets(args.shards, augment=augmentations > 1)
+    print("✅ Classes detected:", train_dataset.classes)
+    save_class_indices(train_dataset.classes)
+
+    model = build_model(len(train_dataset.classes))
+    extract_kwargs = dict(batch_size=args.batch_size, workers=args.workers)
+    train_feats, train_labels, _ = feature_cache.cached_or_extract(
+        model, train_dataset, os.path.join(args.feature_dir, "train"), DEVICE,
+        augmentations, args.rebuild_features, **extract_kwargs
+    )
+    val_feats, val_labels, _ = feature_cache.cached_or_extract(
+        model, val_dataset, os.path.join(args.feature_dir, "val"), DEVICE,
+        1, args.rebuild_features, **extract_kwargs
+    )
+
+    history = feature_cache.train_head(
+        model.classifier, train_feats, train_labels, val_feats, val_labels, DEVICE,
+        epochs=args.epochs, lr=args.lr
+    )
+    best_val_accuracy = 0.0
+    for epoch, train_loss, val_loss, val_acc, improved in history:
+        print(f"📊 Epoch {epoch + 1}/{args.epochs} | Train Loss: {train_loss:.4f} | "
+              f"Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.2f}%")
+        best_val_accuracy = max(best_val_accuracy, val_acc)
+
+    # train_head leaves the best head loaded into model.classifier
+    save_checkpoint(MODEL_PATH, model.state_dict())
+    print("✅ Best model saved")
+    print(f"🏆 Best Validation Accuracy: {best_val_accuracy:.2f}%")
+    return best_val_accuracy
+
+def publish_model(args, best_val_accuracy):
+    version = ModelRegistry().publish(MODEL_PATH, CLASS_INDEX_PATH, activate=True,
+                                      mode=args.mode, epochs=args.epochs,
+                                      best_val_accuracy=round(best_val_accuracy, 3))
+    print(f"📦 Published and activated model version {version}")
+
+# =========================
+# MAIN
+# =========================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the betel leaf disease classifier.")
+    parser.add_argument("--shards", nargs="?", const=SHARD_DIR, default=None,
+                        help=f"Train from tensor shards (default dir: {SHARD_DIR})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="DataLoader worker processes")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--mode", choices=["full", "features"], default="full",
+                        help="'features' trains the head on cached frozen-backbone features")
+    parser.add_argument("--feature-dir", default=feature_cache.FEATURE_DIR)
+    parser.add_argument("--feature-augmentations", type=int, default=1,
+                        help="Augmented copies of each training image to cache (1 = no augmentation)")
+    parser.add_argument("--rebuild-features", action="store_true")
+    parser.add_argument("--run-log", default=RUN_LOG_PATH,
+                        help="Per-epoch metrics are appended to <run-log>.jsonl and <run-log>.csv")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Full training state, written atomically")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="Also checkpoint every N optimizer steps (0 = only at epoch end)")
+    parser.add_argument("--resume", action="store_true", help="Resume from --checkpoint if it exists")
+    parser.add_argument("--patience", type=int, default=PATIENCE,
+                        help="Stop after N epochs without val loss improvement (0 = disabled)")
+    parser.add_argument("--min-delta", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--dist-backend", default="gloo",
+                        help="torch.distributed backend when launched through torchrun")
+    parser.add_argument("--publish", action="store_true",
+                        help="Register the best model in the model registry and activate it (servers hot-reload)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Under torchrun: one process per shard, gradients all-reduced, only rank 0 writes files
+    dist = distributed.init(args.dist_backend)
+    main_rank = dist.is_main
+    if main_rank:
+        print(f"✅ Using device: {DEVICE}")
+
+    if args.mode == "features":
+        if dist.enabled:
+            raise SystemExit("--mode features trains a tiny head in one process; launch it without torchrun")
+        best_val_accuracy = train_on_cached_features(args)
+        if args.publish:
+            publish_model(args, best_val_accuracy)
+        return
+
+    # Ranks share the model init (DDP broadcasts rank 0's) but not augmentation randomness
+    torch.manual_seed(args.seed + dist.rank)
+    train_dataset, val_dataset = build_datasets(args.shards)
+    classes = train_dataset.classes
+    train_sampler = ResumableRandomSampler(train_dataset, seed=args.seed,
+                                           num_replicas=dist.world_size, rank=dist.rank)
+    if dist.enabled:
+        # Each rank validates a disjoint slice; validate() sums the counts across ranks
+        val_dataset = Subset(val_dataset, distributed.shard_indices(len(val_dataset)))
+    train_loader, val_loader = build_loaders(train_dataset, val_dataset, args.batch_size, args.workers, train_sampler)
+
+    if main_rank:
+        print("✅ Classes detected:", classes)
+        save_class_indices(classes)
+
+    model = build_model(len(classes))
+    train_target = distributed.wrap_model(model)
+
+    # -------- LOSS & OPTIMIZER --------
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(
+        model.classifier.parameters(),
+        lr=args.lr
+    )
+
+    best_val_accuracy = 0.0
+    early_stopping = EarlyStopping(args.patience, args.min_delta)
+    run_log = RunLog(args.run_log) if main_rank else None
+    progress = {"epoch": 0, "step_in_epoch": 0, "global_step": 0}
+
+    # -------- RESUME --------
+    if args.resume and os.path.exists(args.checkpoint):
+        state = load_checkpoint(args.checkpoint, map_location=DEVICE)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        early_stopping.load_state_dict(state["early_stopping"])
+        rng_states = state["rng"] if isinstance(state["rng"], list) else [state["rng"]]
+        if len(rng_states) == dist.world_size:
+            # One state per rank, so each rank continues its own augmentation stream
+            restore_rng_state(rng_states[dist.rank])
+        else:
+            # World size changed since the checkpoint: fresh, still rank-distinct streams
+            torch.manual_seed(args.seed + dist.world_size * state["progress"]["epoch"] + dist.rank)
+        best_val_accuracy = state["best_val_accuracy"]
+        progress.update(state["progress"])
+        if main_rank:
+            print(f"♻️ Resumed from '{args.checkpoint}' at epoch {progress['epoch'] + 1}, "
+                  f"step {progress['step_in_epoch']}")
+
+    def write_checkpoint():
+        # Collective: every rank contributes its RNG state, only rank 0 writes
+        rng_states = distributed.gather_object(capture_rng_state())
+        if not main_rank:
+            return
+        save_checkpoint(args.checkpoint, {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "early_stopping": early_stopping.state_dict(),
+            "rng": rng_states,
+            "best_val_accuracy": best_val_accuracy,
+            "progress": dict(progress),
+            "args": vars(args),
+        })
+
+    def on_step():
+        progress["step_in_epoch"] += 1
+        progress["global_step"] += 1
+        if args.checkpoint_every and progress["global_step"] % args.checkpoint_every == 0:
+            write_checkpoint()
+
+    for epoch in range(progress["epoch"], args.epochs):
+        if main_rank:
+            print(f"\n🔁 Epoch {epoch + 1}/{args.epochs}")
+
+        # Same (seed, epoch) permutation as before a restart; skip what was already trained on
+        train_sampler.set_epoch(epoch, start=progress["step_in_epoch"] * args.batch_size)
+
+        train_loss, train_acc, train_stats = train_one_epoch(train_target, train_loader, criterion, optimizer,
+                                                             on_step=on_step)
+        val_loss, val_acc, val_stats = validate(model, val_loader, criterion)
+
+        # Losses and accuracies are already reduced over ranks, so every rank takes the same decisions
+        should_stop = early_stopping.step(val_loss)
+        progress.update(epoch=epoch + 1, step_in_epoch=0)
+        improved = val_acc > best_val_accuracy
+        best_val_accuracy = max(best_val_accuracy, val_acc)
+        if not main_rank:
+            write_checkpoint()
+            if should_stop:
+                break
+            continue
+
+        print(f"📊 Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.2f}%")
+        print(f"📊 Val   Loss: {val_loss:.4f} | Val   Acc: {val_acc:.2f}%")
+        print(f"⏱️ Train: {format_timing(train_stats)}{' per rank' if dist.enabled else ''}")
+        print(f"⏱️ Val:   {format_timing(val_stats)} | peak RSS {peak_rss_mb()} MiB")
+
+        run_log.write({
+            "epoch": epoch + 1,
+            "world_size": dist.world_size,
+            "train_loss": round(train_loss, 5),
+            "train_acc": round(train_acc, 3),
+            "val_loss": round(val_loss, 5),
+            "val_acc": round(val_acc, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "train": train_stats,
+            "val": val_stats,
+        })
+
+        # -------- SAVE BEST MODEL --------
+        if improved:
+            # Atomic: a serving process watching this file never reads a partial write
+            save_checkpoint(MODEL_PATH, model.state_dict())
+            print("✅ Best model saved")
+
+        # -------- CHECKPOINT & EARLY STOPPING --------
+        write_checkpoint()
+
+        if should_stop:
+            print(f"⏹️ Early stopping: no val loss improvement for {args.patience} epochs")
+            break
+
+    # =========================
+    # DONE
+    # =========================
+    distributed.shutdown()
+    if not main_rank:
+        return
+    print("\n🎉 Training completed successfully!")
+    print(f"🏆 Best Validation Accuracy: {best_val_accuracy:.2f}%")
+    if args.publish:
+        publish_model(args, best_val_accuracy)
+
+
+if __name__ == "__main__":
+    main()
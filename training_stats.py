@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import torch
+
+# Every step of the loop body is inside a stage, so data_wait only covers the
+# DataLoader fetch (not loss bookkeeping or checkpoint writes)
+TRAIN_STAGES = ("data_wait", "h2d", "forward", "backward", "metrics", "checkpoint")
+EVAL_STAGES = ("data_wait", "h2d", "forward", "metrics")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (None where unsupported, e.g. Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+class StageTimer:
+    """
+    Accumulates wall time per loop stage. On CUDA the device is synchronized
+    at stage boundaries so asynchronous kernels are charged to the right stage.
+    """
+
+    def __init__(self, device, stages=TRAIN_STAGES):
+        self.sync = device.type == "cuda"
+        self.seconds = {stage: 0.0 for stage in stages}
+        self.images = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self._mark = self.started
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def data_ready(self, batch_size):
+        """
+        Call right after the DataLoader yields: charges the time since the last
+        stage ended to data_wait, so the rest of the loop body must be in stages.
+        """
+        now = time.perf_counter()
+        self.seconds["data_wait"] += now - self._mark
+        self.images += batch_size
+        self.batches += 1
+
+    @contextmanager
+    def stage(self, name):
+        start = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            self.seconds[name] += end - start
+            self._mark = end
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "images": self.images,
+            "batches": self.batches,
+            "seconds": round(elapsed, 3),
+            "images_per_sec": round(self.images / elapsed, 2) if elapsed else 0.0,
+            "stage_seconds": {k: round(v, 4) for k, v in self.seconds.items()},
+        }
+
+
+class RunLog:
+    """Appends one flat record per epoch to `<path>.jsonl` and `<path>.csv`."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fieldnames = None
+
+    @staticmethod
+    def _flatten(record, prefix=""):
+        flat = {}
+        for key, value in record.items():
+            if isinstance(value, dict):
+                flat.update(RunLog._flatten(value, f"{prefix}{key}."))
+            else:
+                flat[f"{prefix}{key}"] = value
+        return flat
+
+    def write(self, record):
+        with open(self.path + ".jsonl", "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        flat = self._flatten(record)
+        csv_path = self.path + ".csv"
+        new_file = not os.path.exists(csv_path)
+        if self._fieldnames is None:
+            self._fieldnames = list(flat)
+        with open(csv_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self._fieldnames, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerow(flat)
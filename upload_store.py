@@ -0,0 +1,155 @@
+import collections
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No pre-forked workers without fork(); one process owns the store
+    fcntl = None
+
+LOCK_NAME = ".store.lock"
+
+
+class UploadStore:
+    """
+    Persists uploaded images in the background with a bounded footprint.
+
+    `submit()` never touches the disk on the request path; a daemon thread
+    writes the bytes and then evicts the oldest stored uploads until the store
+    is within `max_files`, `max_bytes` and `max_age_seconds`.
+
+    Only files the store itself wrote are ever evicted: `folder` is dedicated
+    to the store, it is scanned when the writer starts (to pick up uploads
+    from earlier runs), and after that file and byte totals are kept as
+    running counts, so each upload costs O(1) rather than a folder scan.
+
+    Several processes (serve.py workers) can share one folder: every change
+    happens under an flock on a lock file that also holds a generation
+    number, and a process that finds a generation it did not write rescans
+    the folder first, so the limits hold for the folder as a whole.
+    """
+
+    def __init__(self, folder, max_files=1000, max_bytes=512 * 1024 * 1024,
+                 max_age_seconds=7 * 24 * 3600, max_pending=256):
+        self.folder = folder
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.dropped = 0
+        self.written = 0
+        self.evicted = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pid = None
+        self._lock = threading.Lock()
+        # (mtime, size, path) of stored uploads, oldest first; owned by the writer thread
+        self._files = collections.deque()
+        self._bytes = 0
+        # Generation of the folder that _files reflects; None forces a scan
+        self._generation = None
+        self._lock_file = None
+        os.makedirs(folder, exist_ok=True)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._loop, name="upload-writer", daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, filename, data):
+        """Queues bytes for persistence; drops them if the writer is backlogged."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((filename, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def _loop(self):
+        self._lock_file = open(os.path.join(self.folder, LOCK_NAME), "a+")
+        self._generation = None
+        with self._shared():
+            self.enforce_retention()
+        while True:
+            filename, data = self._queue.get()
+            try:
+                self._write(filename, data)
+            except OSError as e:
+                print(f"❌ Failed to persist upload '{filename}': {e}")
+
+    @contextmanager
+    def _shared(self):
+        """Holds the cross-process store lock with this process's view of the folder up to date."""
+        f = self._lock_file
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            text = f.read().strip()
+            generation = int(text) if text else 0
+            if generation != self._generation:
+                self._scan()
+            yield
+            self._generation = generation + 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(self._generation))
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _scan(self):
+        """Rebuilds the view from disk: uploads from a previous run or another process."""
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(".part"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        entries.sort()
+        self._files = collections.deque(entries)
+        self._bytes = sum(size for _, size, _ in entries)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.folder, filename)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._shared():
+            os.replace(tmp_path, path)
+            self._files.append((time.time(), len(data), path))
+            self._bytes += len(data)
+            self.written += 1
+            self.enforce_retention()
+
+    def enforce_retention(self):
+        """Evicts the oldest stored uploads until all retention limits hold (store lock held)."""
+        cutoff = time.time() - self.max_age_seconds if self.max_age_seconds else None
+        while self._files:
+            mtime, size, path = self._files[0]
+            over_count = len(self._files) > self.max_files
+            over_bytes = self._bytes > self.max_bytes
+            expired = cutoff is not None and mtime < cutoff
+            if not (over_count or over_bytes or expired):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._files.popleft()
+            self._bytes -= size
+            self.evicted += 1
+
+    def snapshot(self):
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "stored": len(self._files),
+            "stored_bytes": self._bytes,
+        }